@@ -0,0 +1,201 @@
+import asyncio
+import aiohttp
+import getopt
+import bugsnag
+import pymongo
+
+from loguru import logger
+from datetime import datetime
+from dynaconf import settings
+from utils.Database import Database
+from utils.Helpers import Helpers
+from utils.Shopify import Shopify
+from utils.Metrics import Metrics
+from utils.BulkOperation import BulkOperation, BulkOperationError
+
+# Get DB instance
+DB = Database.instance()
+
+
+class ShopifyCatalogReconciler:
+
+    # Exported variants compared against ShopifyListings at once
+    BATCH_SIZE = settings.APP.Reconciler.BatchSize
+
+    # One flat line per variant with its product, no nested connection to put back together
+    EXPORT = """
+        {
+            productVariants {
+                edges {
+                    node {
+                        id
+                        price
+                        compareAtPrice
+                        inventoryQuantity
+                        inventoryItem { id }
+                        product { id publishedAt }
+                    }
+                }
+            }
+        }
+    """
+
+    def __init__(self):
+        # Bugsnag for error reporting
+        bugsnag.configure(api_key=settings.APP.Bugsnag.Key)
+
+    async def process(self, payload):
+        """ Gets called every time when a message is consumed """
+
+        # Reject if not my job
+        if payload['task'] != 'Reconcile':
+            return logger.critical("{task} | Task belongs to another service, rejecting", task=payload['task'])
+
+        # Get the related user
+        self.user = Helpers.get_user(payload['user_id'])
+        if not self.user:
+            return logger.critical("{user_id} | User not found", user_id=payload['user_id'])
+
+        # Get Shopify credentials
+        self.shopify_creds = self.user['settings'].get('shopify_creds', {})
+        if not all([self.shopify_creds, self.shopify_creds.get('token')]):
+            return logger.critical("{user_id} | Shopify token not found", user_id=self.user['_id'])
+
+        # Configure logger format
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
+
+        if not Helpers.shop_available(self.user):
+            return
+
+        await self.reconcile()
+
+    async def reconcile(self):
+        """ Stream the shop's export, bring the listings in line with it and mark the ones it doesn't have """
+
+        # Listings not seen since the export started are gone from the shop
+        started_at = datetime.utcnow()
+        stats = {'seen': 0, 'changed': 0}
+        batch = []
+
+        async with Shopify.session(
+            timeout=aiohttp.ClientTimeout(total=120),
+            headers={
+                'Content-Type': 'application/json',
+                'X-Shopify-Access-Token': self.shopify_creds['token'],
+            },
+        ) as session:
+            try:
+                async for variant in BulkOperation.query(session, self.shopify_creds['domain'], self.EXPORT):
+                    batch.append(variant)
+
+                    if len(batch) == self.BATCH_SIZE:
+                        self.compare(batch, started_at, stats)
+                        batch = []
+
+                self.compare(batch, started_at, stats)
+            except BulkOperationError as e:
+                return logger.error("Catalog export failed, {error}", error=e)
+
+        # An empty export is more likely a problem on Shopify's side than a shop without products
+        if not stats['seen']:
+            return logger.warning("No listing found in the export, not marking any as removed")
+
+        removed = self.sweep(started_at)
+
+        Metrics.incr("reconcile.changed", stats['changed'], rate=1)
+        Metrics.incr("reconcile.removed", removed, rate=1)
+
+        logger.success(
+            "{seen} listing(s) found, {changed} changed, {removed} removed",
+            seen=stats['seen'],
+            changed=stats['changed'],
+            removed=removed,
+        )
+
+    def compare(self, batch, started_at, stats):
+        """ Listings of a batch of exported variants, updated where the shop has other values """
+
+        if not batch:
+            return
+
+        # Product id => variants of it in the batch, a listing follows its own variant or the first one
+        variants = {}
+
+        for variant in batch:
+            variants.setdefault(BulkOperation.id_of(variant['product']['id']), []).append(variant)
+
+        listings = DB.ShopifyListings.find({
+            'user_id': self.user['_id'],
+            'shopify_item_id': {'$in': list(variants)},
+        }, {'price': 1, 'compare_at_price': 1, 'quantity': 1, 'active': 1, 'published_at': 1, 'variant_id': 1, 'inventory_item_id': 1, 'shopify_item_id': 1, 'removed_at': 1})
+
+        seen, updates = [], []
+
+        for listing in listings:
+            candidates = variants[listing['shopify_item_id']]
+            variant = next((x for x in candidates if BulkOperation.id_of(x['id']) == listing.get('variant_id')), candidates[0])
+
+            # Another variant of the listing's product, the listing was seen through its own one
+            if listing.get('variant_id') and BulkOperation.id_of(variant['id']) != listing['variant_id']:
+                seen.append(listing['_id'])
+                continue
+
+            live = {
+                'price': Helpers.format_price(float(variant['price']) * 100, precision=0),
+                'compare_at_price': Helpers.format_price(float(variant['compareAtPrice'] or 0) * 100, precision=0),
+                'quantity': variant['inventoryQuantity'],
+                'variant_id': BulkOperation.id_of(variant['id']),
+                'inventory_item_id': BulkOperation.id_of(variant['inventoryItem']['id']),
+                'active': bool(variant['product']['publishedAt']),
+            }
+
+            changes = {key: value for key, value in live.items() if listing.get(key) != value}
+
+            # Published or unpublished outside of the app, the date itself doesn't matter
+            if 'active' in changes:
+                changes['published_at'] = variant['product']['publishedAt']
+
+            if not changes and not listing.get('removed_at'):
+                seen.append(listing['_id'])
+                continue
+
+            updates.append(pymongo.UpdateOne({'_id': listing['_id']}, {
+                '$set': {**changes, 'last_seen_at': started_at, 'reconciled_at': datetime.utcnow()},
+                '$unset': {'removed_at': ''},
+            }))
+
+            logger.debug(
+                "{shopify_item_id} | Changed on Shopify, {changes}",
+                shopify_item_id=listing['shopify_item_id'],
+                changes=changes,
+            )
+
+        if seen:
+            DB.ShopifyListings.update_many({'_id': {'$in': seen}}, {'$set': {'last_seen_at': started_at}})
+
+        if updates:
+            DB.ShopifyListings.bulk_write(updates, ordered=False)
+
+        stats['seen'] += len(seen) + len(updates)
+        stats['changed'] += len(updates)
+
+    def sweep(self, started_at):
+        """ Listings the export didn't have, the repricer leaves them alone from now on """
+
+        result = DB.ShopifyListings.update_many({
+            'user_id': self.user['_id'],
+            'removed_at': {'$exists': False},
+            # Listed while the export was running
+            '_created_at': {'$not': {'$gte': started_at}},
+            '$or': [
+                {'last_seen_at': {'$lt': started_at}},
+                {'last_seen_at': {'$exists': False}},
+            ],
+        }, {
+            '$set': {
+                'active': False,
+                'removed_at': datetime.utcnow(),
+            },
+        })
+
+        return result.modified_count
@@ -2,15 +2,27 @@ import asyncio
 import bugsnag
 import psutil
 
+from collections import Counter
 from loguru import logger
 from subprocess import Popen
 from dynaconf import settings
 from pathlib import Path
+from utils.Database import Database
+from utils.Metrics import Metrics
+from utils.Tracing import Tracing
+from utils.Health import Health
+from utils.CircuitBreaker import CircuitBreaker
+from utils.Priority import Priority
+from utils.FairScheduler import FairScheduler
 
 import json
+import os
 import pika
 import time
 
+# Get DB instance
+DB = Database.instance()
+
 
 class ShopifyConsumerManager:
     # GPL prevents creating exceeding processes and keeps CPU at a sane level
@@ -22,8 +34,22 @@ class ShopifyConsumerManager:
     # Exclusive flag must be turned off at utils/Queue.py:45
     CONSUMER_PER_QUEUE = settings.APP.ConsumerManager.ConsumerPerQueue
 
+    def __init__(self):
+        # Decisions taken so far, served by the health endpoint
+        self.counters = Counter()
+
+        # Pending tasks waiting for capacity, interleaved across shops
+        self.scheduler = FairScheduler()
+
+    # Process handling goes through these, benchmarks/SimulateConsumerManager.py replaces them
+    def children(self):
+        return psutil.Process().children()
+
+    def spawn(self, command, env):
+        return Popen(command, env=env)
+
     def handle(self, channel, method, properties, body):
-        """ Spin up corresponding consumer for a specific task """
+        """ Queue the task in the fair scheduler, it waits there unacked until its shop's turn """
 
         def fetch(body):
             """Convert message from queue to a json message"""
@@ -40,59 +66,205 @@ class ShopifyConsumerManager:
 
         # Determine the target queue name
         queue = payload["target"]
+        self.counters['handled'] += 1
+
+        # Time spent in the pending tasks queue
+        trace_id, published_at = Tracing.read(properties.headers)
+        Tracing.span(trace_id, 'enqueue', start=published_at, queue=queue, task=payload.get('task'))
+
+        # Continuations of chunked tasks don't carry the weight, it's looked up for each of them
+        weight = payload.get('weight') or self.weight(payload.get('payload', {}).get('user_id'))
+
+        self.scheduler.push(
+            shop=queue,
+            item={'delivery_tag': method.delivery_tag, 'payload': payload, 'trace_id': trace_id},
+            task=payload.get('task'),
+            weight=weight,
+        )
+
+        self.schedule(channel)
+
+    def weight(self, user_id):
+        """ Weight of the shop of a user by their plan, nothing is kept per queue """
+
+        user = DB.users.find_one({'_id': user_id}, {'plan': 1}) if user_id else None
+
+        return FairScheduler.weight(user or {})
 
-        def spin_up_consumer():
-            path = Path(__file__).parent.absolute()
+    def schedule(self, channel):
+        """ Dispatch queued tasks in fair order while there is capacity, also called every second """
 
-            command = [
-                f'python3.8',  # f'{path}/venv/bin/python'
-                f'{path}/ShopifyDispatcher.py',
-                f'--target={queue}'
-            ]
+        # Processes spawned in this round are added as they go
+        running = self.running()
 
-            return Popen(command)
+        Metrics.gauge("manager.processes", running)
+        Metrics.gauge("manager.scheduled", len(self.scheduler))
+
+        # Queues with a dispatcher up, read once the head can't get a process, only their items may go ahead of it
+        served = None
 
         try:
-            # Find all processes that are running other than
-            # the children of this (current) one.
-            all_running_processes = [
-                x for x in psutil.Process().children()
-                if all([x.status() == 'running', f'--target={queue}' not in (' '.join(x.cmdline()))])
-            ]
+            while len(self.scheduler):
+                item = self.scheduler.peek()
+                queue = item['payload']['target']
+
+                if served is not None:
+                    if not left:
+                        break
+
+                    if queue not in served:
+                        self.scheduler.set_aside()
+                        continue
+                else:
+                    # Catalog tasks leave the last processes to order tasks
+                    limit = self.GLOBAL_PROCESS_LIMIT
+
+                    if Priority.of(item['payload'].get('task')) != 'order':
+                        limit -= Priority.RESERVED
+
+                    # A shop whose dispatcher is up needs no new process
+                    if running + 1 > limit and not self.consumers(queue):
+                        Metrics.incr("manager.rejections", rate=1)
+                        Metrics.incr(f"manager.rejections.{Priority.of(item['payload'].get('task'))}", rate=1)
+                        self.counters['rejections'] += 1
+
+                        # Continuations behind it would find their dispatcher gone if they waited
+                        served = self.served() & set(self.scheduler.queued)
+                        left = sum(self.scheduler.queued[x] for x in served)
+
+                        self.scheduler.set_aside()
+                        continue
+
+                self.scheduler.pop()
+
+                if self.dispatch(channel, item):
+                    running += 1
+
+                # Finally acknowledge the message
+                channel.basic_ack(item['delivery_tag'])
+
+                # Nothing behind that could go ahead, the rest waits for capacity
+                if served is not None:
+                    left -= 1
+
+                    if not left:
+                        break
+        finally:
+            self.scheduler.put_back()
 
-            if len(all_running_processes) + 1 > self.GLOBAL_PROCESS_LIMIT:
-                logger.warning(
-                    "Working at the maximum capacity, {count} processes running, will try in 5 secs.",
-                    count=len(all_running_processes)
-                )
+        if served is not None:
+            logger.debug(
+                "Working at the maximum capacity, {count} processes running, {queued} task(s) waiting their turn.",
+                count=running,
+                queued=len(self.scheduler),
+            )
 
-                # Avoid hammering the machine
-                time.sleep(5)
+    def running(self):
+        count = 0
 
-                # Pretend didn't see that.
-                return channel.basic_reject(method.delivery_tag, requeue=True)
+        for x in self.children():
+            try:
+                count += x.status() == 'running'
+            except psutil.Error:
+                continue
 
-            # Find all processes assigned to the same queue
-            child_processes = [x for x in psutil.Process().children() if f'--target={queue}' in (' '.join(x.cmdline()))]
+        return count
 
-            # There already exists {count} process(es) running for this queue
-            if len(child_processes) < self.CONSUMER_PER_QUEUE:
-                spin_up_consumer()
+    def consumers(self, queue):
+        """ Processes assigned to the queue, zombies are reaped on the way """
+
+        try:
+            return [x for x in self.children() if f'--target={queue}' in (' '.join(x.cmdline()))]
 
         # calling cmdline() on a zombie proc will throw this exception
         except psutil.ZombieProcess:
             # since actual queue connects to amqp with blocking connection
             # it will remain as a zombie, so we wait and drop it just for the sake of cleanup
-            for x in psutil.Process().children():
+            for x in self.children():
                 if x.status() == 'zombie':
                     x.wait()
 
-            spin_up_consumer()
+            return self.consumers(queue)
         except psutil.NoSuchProcess:
-            spin_up_consumer()
+            return self.consumers(queue)
+
+    def served(self):
+        """ Queues that have a process assigned, from one pass over the children """
+
+        queues = set()
+
+        for x in self.children():
+            try:
+                queues.update(arg[len('--target='):] for arg in x.cmdline() if arg.startswith('--target='))
+            except psutil.Error:
+                continue
+
+        return queues
+
+    def dispatch(self, channel, item):
+        """ Spin up corresponding consumer for a specific task, True if a process was spawned """
+
+        payload = item['payload']
+        queue = payload['target']
+
+        # Rest of a chunked task, it goes to its user queue only now that it's the shop's turn
+        if payload.get('payload'):
+            channel.basic_publish(
+                exchange='',
+                routing_key=queue,
+                body=json.dumps(payload['payload']),
+                properties=pika.BasicProperties(headers=Tracing.headers(item['trace_id']), delivery_mode=2),
+            )
+
+        # There already exists {count} process(es) running for this queue
+        if len(self.consumers(queue)) >= self.CONSUMER_PER_QUEUE:
+            return False
+
+        path = Path(__file__).parent.absolute()
+
+        command = [
+            f'python3.8',  # f'{path}/venv/bin/python'
+            f'{path}/ShopifyDispatcher.py',
+            f'--target={queue}'
+        ]
+
+        Metrics.incr("manager.spawns", rate=1)
+        self.counters['spawns'] += 1
 
-        # Finally acknowledge the message
-        channel.basic_ack(method.delivery_tag)
+        # Consumer reports how long it took to get ready
+        env = {**os.environ, 'TRACE_ID': item['trace_id'] or '', 'TRACE_SPAWNED_AT': str(time.time())}
+
+        self.spawn(command, env)
+
+        return True
+
+    def stats(self):
+        """ Children as psutil sees them and what the dispatchers report about themselves """
+
+        statuses = Counter()
+
+        for child in self.children():
+            try:
+                statuses[child.status()] += 1
+            except psutil.Error:
+                statuses['gone'] += 1
+
+        dispatchers = Health.query_all('dispatcher-*')
+        running_by_task = Counter()
+
+        for dispatcher in dispatchers:
+            running_by_task.update(dispatcher.get('queue', {}).get('running_by_task', {}))
+
+        return {
+            **self.counters,
+            'scheduler': self.scheduler.stats(),
+            'children': dict(statuses),
+            'dispatchers': len(dispatchers),
+            'busy_dispatchers': len([x for x in dispatchers if x.get('queue', {}).get('running_tasks')]),
+            'running_by_task': dict(running_by_task),
+            'backlog': sum(x.get('queue', {}).get('backlog') or 0 for x in dispatchers),
+            'max_loop_lag': max((x.get('loop_lag', {}).get('last') or 0 for x in dispatchers), default=None),
+        }
 
 def main():
     # Bugsnag for error reporting
@@ -108,9 +280,18 @@ def main():
 
     shopify_consumer_manager = ShopifyConsumerManager()
 
+    # Live stats for supervisor and operators
+    health = Health('manager')
+    health.add('manager', shopify_consumer_manager.stats)
+    health.add('circuit_breakers', CircuitBreaker.summary)
+    health.start()
+
     # Declare queue
     channel = connection.channel()
-    channel.queue_declare(queue=settings.SHOPIFY.Queue.PendingTasks, durable=True)
+    channel.queue_declare(queue=settings.SHOPIFY.Queue.PendingTasks, durable=True, arguments=Priority.arguments(settings.SHOPIFY.Queue.PendingTasks))
+
+    # Tasks the scheduler can hold unacked, beyond that they wait in the broker by priority
+    channel.basic_qos(prefetch_count=settings.APP.Scheduling.Prefetch)
 
     channel.basic_consume(
         queue=settings.SHOPIFY.Queue.PendingTasks,
@@ -118,6 +299,13 @@ def main():
         auto_ack=False,
     )
 
+    # Capacity frees up as dispatchers go idle, not only when a message comes in
+    def tick():
+        shopify_consumer_manager.schedule(channel)
+        connection.call_later(settings.APP.Scheduling.Interval, tick)
+
+    connection.call_later(settings.APP.Scheduling.Interval, tick)
+
     channel.start_consuming()
 
 if __name__ == "__main__":
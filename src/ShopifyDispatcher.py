@@ -1,11 +1,17 @@
 import asyncio
 import getopt
+import os
 import sys
 import bugsnag
 
 from loguru import logger
 from dynaconf import settings
 from utils.Queue import Queue
+from utils.Logging import Logging
+from utils.Profiler import Profiler
+from utils.Memory import Memory
+from utils.Tracing import Tracing
+from utils.Health import Health
 
 from ShopifyItemLister import ShopifyItemLister
 from ShopifyItemRepricer import ShopifyItemRepricer
@@ -13,19 +19,26 @@ from ShopifyItemPublisher import ShopifyItemPublisher
 from ShopifyItemUnpublisher import ShopifyItemUnpublisher
 from ShopifyOrderFulfiller import ShopifyOrderFulfiller
 from ShopifyOrderTracker import ShopifyOrderTracker
+from ShopifyCatalogReconciler import ShopifyCatalogReconciler
 
 
-def main(target):
-    # Initiate Shopify services
-    services = {
+def create_services():
+    """ Initiate Shopify services """
+
+    return {
         'List': ShopifyItemLister(),
         'Publish': ShopifyItemPublisher(),
         'Unpublish': ShopifyItemUnpublisher(),
         'Reprice': ShopifyItemRepricer(),
         'Fulfill': ShopifyOrderFulfiller(),
         'Track': ShopifyOrderTracker(),
+        'Reconcile': ShopifyCatalogReconciler(),
     }
 
+
+def create_callback(services, profiler, memory):
+    """ Routes a message to its service, benchmarks/Replay.py drives it the same way """
+
     def callback(payload):
         task = payload.get('task')
         service = services.get(task)
@@ -33,19 +46,55 @@ def main(target):
         if not task or not service:
             return logger.info("{task} | Task not supported")
 
-        return service.process(payload)
+        coroutine = service.process(payload)
+
+        if profiler.wants(payload):
+            coroutine = profiler.run(coroutine, payload)
+
+        return memory.run(coroutine, payload)
+
+    return callback
+
+
+def main(target, profile=False):
+    services = create_services()
+
+    # Sinks are set up once, tasks only bind their own context
+    Logging.setup(services=[x.__class__.__name__ for x in services.values()])
+
+    # Profiling is on for every task with --profile or PROFILE_TASKS, or per task with "profile": true
+    profiler = Profiler(enabled=profile or bool(os.environ.get('PROFILE_TASKS')))
+
+    # Per task memory stats and the recycle policy of this worker
+    memory = Memory()
+
+    callback = create_callback(services, profiler, memory)
 
     # Set up AMQP connection
     queue = Queue(url=settings.QUEUE.RabbitMQ.URL)
 
+    # Live stats for operators and the manager
+    health = Health(f'dispatcher-{os.getpid()}')
+    health.add('queue', queue.stats)
+    health.add('loop_lag', lambda: health.loop_lag)
+    health.add('shops', lambda: {shop: dict(stats) for shop, stats in list(Health.SHOPS.items())})
+    health.add('memory', lambda: {'tasks': memory.tasks, 'rss': memory.rss()})
+
     # Get event loop
     loop = asyncio.get_event_loop()
 
     try:
         # Start consuming the queue and wait for jobs to finish
         loop.run_until_complete(queue.connect(target=target, loop=loop))
+
+        # From the manager's Popen until the queue is ready to consume
+        if spawned_at := os.environ.pop('TRACE_SPAWNED_AT', None):
+            Tracing.span(os.environ.get('TRACE_ID'), 'spawn', start=float(spawned_at), queue=target)
+
+        health.start()
+        loop.create_task(health.watch_loop(interval=settings.APP.Health.LoopLagInterval))
         loop.create_task(queue.consume(callback=callback))
-        loop.run_until_complete(queue.should_live())
+        loop.run_until_complete(queue.should_live(recycle=memory.should_recycle))
         loop.run_until_complete(queue.shutdown())
         loop.run_until_complete(loop.shutdown_asyncgens())
     except ConnectionError as e:
@@ -54,19 +103,33 @@ def main(target):
     # Close the loop
     loop.close()
 
+    health.stop()
+
+    memory.summary()
+
+    # Flush the pending log messages
+    Logging.shutdown()
+
+    return queue.recycling
+
 if __name__ == "__main__":
     # Bugsnag for error reporting
     bugsnag.configure(api_key=settings.APP.Bugsnag.Key)
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hm:d', ['help', 'target='])
+        opts, args = getopt.getopt(sys.argv[1:], 'hm:dp', ['help', 'target=', 'profile'])
     except getopt.GetoptError as err:
         print(str(err))
 
+    profile = False
     for o, a in opts:
         if o in ("-t", "--target"):
             target = a
+        elif o in ("-p", "--profile"):
+            profile = True
         else:
             assert False, "Unhandled option"
 
-    main(target=target)
+    # Replace the process with a fresh one so the manager keeps seeing a consumer for the queue
+    if main(target=target, profile=profile):
+        os.execv(sys.executable, [sys.executable] + sys.argv)
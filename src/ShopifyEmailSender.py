@@ -0,0 +1,191 @@
+import getopt
+import sys
+import time
+import uuid
+import bugsnag
+import pymongo
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from loguru import logger
+from dynaconf import settings
+from utils.Database import Database
+from utils.Email import Email, SMTPPool
+
+# Get DB instance
+DB = Database.instance()
+
+
+class ShopifyEmailSender:
+    # Emails reserved from the outbox at once
+    BATCH_SIZE = settings.EMAILS.Outbox.BatchSize
+
+    # Number of SMTP connections kept open to the relay
+    POOL_SIZE = settings.EMAILS.Outbox.PoolSize
+
+    # Delivery gives up and marks the email as failed after this many attempts
+    MAX_ATTEMPTS = settings.EMAILS.Outbox.MaxAttempts
+
+    # Retry delays grow exponentially from the base up to the max, in seconds
+    RETRY_BASE_DELAY = settings.EMAILS.Outbox.RetryBaseDelay
+    RETRY_MAX_DELAY = settings.EMAILS.Outbox.RetryMaxDelay
+
+    # Seconds to wait when the outbox is empty
+    POLL_INTERVAL = settings.EMAILS.Outbox.PollInterval
+
+    # A sender that died mid-batch leaves emails in sending state, release them after this many seconds
+    CLAIM_TIMEOUT = settings.EMAILS.Outbox.ClaimTimeout
+
+    def __init__(self):
+        self.pool = SMTPPool(size=self.POOL_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=self.POOL_SIZE)
+
+        self.delivered = 0
+        self.started_at = time.time()
+
+    def release_stale_claims(self):
+        """ Put emails claimed by a dead sender back into the outbox """
+
+        DB.EmailOutbox.update_many({
+            'status': 'sending',
+            'claimed_at': {'$lt': datetime.utcnow() - timedelta(seconds=self.CLAIM_TIMEOUT)},
+        }, {
+            '$set': {
+                'status': 'pending',
+            },
+        })
+
+    def claim(self):
+        """ Reserve a batch of due emails so parallel senders don't deliver twice """
+
+        # Three round trips whatever the batch size, the token tells which of the candidates this sender got
+        token = uuid.uuid4().hex
+
+        candidates = [x['_id'] for x in DB.EmailOutbox.find({
+            'status': 'pending',
+            'next_attempt_at': {'$lte': datetime.utcnow()},
+        }, {'_id': 1}).sort('next_attempt_at', pymongo.ASCENDING).limit(self.BATCH_SIZE)]
+
+        if not candidates:
+            return []
+
+        DB.EmailOutbox.update_many({
+            '_id': {'$in': candidates},
+            'status': 'pending',
+        }, {
+            '$set': {
+                'status': 'sending',
+                'claimed_at': datetime.utcnow(),
+                'claim_token': token,
+            },
+        })
+
+        return list(DB.EmailOutbox.find({'claim_token': token, 'status': 'sending'}).sort('next_attempt_at', pymongo.ASCENDING))
+
+    def deliver_one(self, email):
+        """ Returns the error if delivery failed """
+
+        try:
+            self.pool.send(
+                to=email['to'],
+                message=Email.compose(
+                    to=email['to'],
+                    subject=email['subject'],
+                    html=email['html'],
+                ),
+            )
+        except Exception as e:
+            return repr(e)
+
+    def deliver(self, batch):
+        """ Send a batch over the pool and record the delivery status """
+
+        started_at = time.time()
+        errors = list(self.executor.map(self.deliver_one, batch))
+
+        updates = []
+        for email, error in zip(batch, errors):
+            if not error:
+                updates.append(pymongo.UpdateOne({'_id': email['_id']}, {
+                    '$set': {
+                        'status': 'sent',
+                        'sent_at': datetime.utcnow(),
+                    },
+                    '$inc': {
+                        'attempts': 1,
+                    },
+                }))
+                continue
+
+            attempts = email.get('attempts', 0) + 1
+            delay = min(self.RETRY_BASE_DELAY * 2 ** (attempts - 1), self.RETRY_MAX_DELAY)
+
+            logger.warning("{email_id} | Delivery failed on attempt {attempts}, {error}", email_id=email['_id'], attempts=attempts, error=error)
+
+            updates.append(pymongo.UpdateOne({'_id': email['_id']}, {
+                '$set': {
+                    'status': 'failed' if attempts >= self.MAX_ATTEMPTS else 'pending',
+                    'attempts': attempts,
+                    'last_error': error,
+                    'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay),
+                },
+            }))
+
+        DB.EmailOutbox.bulk_write(updates, ordered=False)
+
+        elapsed = time.time() - started_at
+        sent = errors.count(None)
+        self.delivered += sent
+
+        logger.info(
+            "{sent}/{count} email(s) delivered in {elapsed:.2f}s, {rate:.1f}/s (overall {overall:.1f}/s)",
+            sent=sent,
+            count=len(batch),
+            elapsed=elapsed,
+            rate=sent / elapsed if elapsed else 0,
+            overall=self.delivered / (time.time() - self.started_at),
+        )
+
+    def run(self, once=False):
+        """ Drain the outbox, keep polling unless asked to stop once it's empty """
+
+        try:
+            while True:
+                self.release_stale_claims()
+
+                batch = self.claim()
+
+                if batch:
+                    self.deliver(batch)
+                    continue
+
+                if once:
+                    break
+
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            self.executor.shutdown()
+            self.pool.close()
+
+
+def main(once):
+    shopify_email_sender = ShopifyEmailSender()
+    shopify_email_sender.run(once=once)
+
+if __name__ == "__main__":
+    # Bugsnag for error reporting
+    bugsnag.configure(api_key=settings.APP.Bugsnag.Key)
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'ho', ['help', 'once'])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    once = False
+    for o, a in opts:
+        if o in ("-o", "--once"):
+            once = True
+        else:
+            assert False, "Unhandled option"
+
+    main(once=once)
@@ -10,6 +10,7 @@ from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
 from utils.Helpers import Helpers
+from utils.Shopify import Shopify
 from utils.Retry import Retry, TooManyRequestsException, ServerConnectionError
 
 # Get DB instance
@@ -45,7 +46,7 @@ class ShopifyItemLister:
             return logger.critical("{user_id} | Shopify token not found", user_id=self.user['_id'])
 
         # Configure logger format
-        Helpers.configure_logger(user=self.user['_id'])
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
 
         # Prepare product to send
         await self.compose_product()
@@ -102,11 +103,14 @@ class ShopifyItemLister:
             },
         }
 
+        if not Helpers.shop_available(self.user):
+            return
+
         # List product on Shopify
         # published = true | false
         await self.list_product(product)
 
-    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=15, jitter=None, on_backoff=Retry.log)
+    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=Retry.IN_PROCESS_TRIES, jitter=None, on_backoff=Retry.log)
     async def list_product(self, product):
         """ Publish products on Shopify store asynchronously """
 
@@ -118,7 +122,7 @@ class ShopifyItemLister:
 
         logger.debug("Making a request to Shopify API")
 
-        async with aiohttp.ClientSession(
+        async with Shopify.session(
             timeout=aiohttp.ClientTimeout(total=120),
             connector=aiohttp.TCPConnector(limit=5),
             headers=self.headers,
@@ -135,13 +139,22 @@ class ShopifyItemLister:
             except (
                 aiohttp.client_exceptions.ClientConnectorError,
                 aiohttp.client_exceptions.ClientOSError,
-                aiohttp.client_exceptions.ServerDisconnectedError
+                aiohttp.client_exceptions.ServerDisconnectedError,
+                asyncio.TimeoutError
             ) as e:
-                logger.critical(e)
+                logger.critical(repr(e))
+                raise ServerConnectionError()
+
+            # Shopify is down or overloaded, its error pages aren't JSON
+            if request.status >= 500:
+                logger.warning("{status_code} Status Code | Shopify unavailable, retrying...", status_code=request.status)
                 raise ServerConnectionError()
 
             try:
                 response = await request.json()
+            except (aiohttp.client_exceptions.ClientPayloadError, asyncio.TimeoutError) as e:
+                logger.critical(repr(e))
+                raise ServerConnectionError()
             except aiohttp.client_exceptions.ContentTypeError as e:
                 return logger.critical(e)
                 raise ServerConnectionError()
@@ -156,6 +169,8 @@ class ShopifyItemLister:
                         'price': Helpers.format_price(float(response['product']['variants'][0]['price']) * 100, precision=0),
                         'compare_at_price': Helpers.format_price(float(response['product']['variants'][0]['compare_at_price']) * 100, precision=0),
                         'quantity': response['product']['variants'][0]['inventory_quantity'],
+                        'variant_id': response['product']['variants'][0]['id'],
+                        'inventory_item_id': response['product']['variants'][0]['inventory_item_id'],
                         'thumb': (response['product']['image'] if response['product'].get('image', {}) else {}).get('src') or None,
                         'fba_item_id': product['local_fba_item']['_id'],
                         'seller_sku': product['local_fba_item']['seller_sku'],
@@ -3,13 +3,25 @@ import aiohttp
 import getopt
 import bugsnag
 import backoff
+import time
+import pymongo
 
+from collections import deque
 from loguru import logger
 from datetime import datetime
 from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
 from utils.Helpers import Helpers
+from utils.Shopify import Shopify
+from utils.Logging import Logging
+from utils.FairScheduler import FairScheduler
+from utils.Checkpoint import Checkpoint
+from utils.RateBudget import RateBudget
+from utils.Pricing import Pricing
+from utils.Hysteresis import Hysteresis
+from utils.BulkOperation import BulkOperation, BulkOperationError
+from utils.CatalogSnapshot import CatalogSnapshot
 from utils.Retry import Retry, TooManyRequestsException, ServerConnectionError
 
 # Get DB instance
@@ -18,6 +30,20 @@ DB = Database.instance()
 
 class ShopifyItemRepricer:
 
+    # Listings read from Mongo at once, revisions in flight, items waiting between two stages
+    BATCH_SIZE = settings.APP.Repricer.BatchSize
+    WORKERS = settings.APP.Repricer.Workers
+    QUEUE_SIZE = settings.APP.Repricer.QueueSize
+
+    # Diff the batches with utils/Pricing.py, off compares every listing one by one
+    VECTORIZED = settings.APP.Repricer.Vectorized
+
+    # Variant updates and inventory level sets for the listings that know their ids, off sends whole products
+    VARIANT_UPDATES = settings.APP.Repricer.VariantUpdates
+
+    # Domain => primary location id, inventory levels are set there
+    LOCATIONS = {}
+
     def __init__(self):
         # Bugsnag for error reporting
         bugsnag.configure(api_key=settings.APP.Bugsnag.Key)
@@ -44,76 +70,274 @@ class ShopifyItemRepricer:
             return logger.debug("{user_id} | Pricing service disabled by the user", user_id=payload['user_id'])
 
         # Configure logger format
-        Helpers.configure_logger(user=self.user['_id'])
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
+
+        # Primary location is fetched by the first reviser that sets a quantity
+        self.location_lock = asyncio.Lock()
+        self.location_missing = False
+
+        # Collect products to revise, a chunk of them at a time
+        # A run that died halfway left its cursor behind, carry on from there
+        # A retried chunk still has the cursor it was first sent with, whichever got further wins
+        cursors = [x for x in [payload.get('after'), Checkpoint.load(self.user['_id'], 'Reprice', payload.get('slice'))] if x is not None]
+        after = max(cursors) if cursors else None
+
+        # Listings whose inputs moved since the catalog snapshot, the others aren't read at all
+        # They're gone through a chunk at a time like the catalog, the cursor moves over them
+        snapshot, dirty, only = None, None, None
+
+        if not payload.get('slice') and CatalogSnapshot.ENABLED:
+            snapshot = CatalogSnapshot.load(self.user)
+            dirty = CatalogSnapshot.dirty(self.user, snapshot)
+
+            if dirty is not None:
+                only = [x for x in dirty if after is None or x > after][:FairScheduler.chunk_size('Reprice') or None]
+
+                if not only and after is None:
+                    return logger.debug("Nothing changed since the catalog snapshot")
+
+        if not Helpers.shop_available(self.user):
+            return
+
+        last_id = await self.iterate_products(after=after, slice=payload.get('slice'), only=only)
+
+        # Chunk of dirty listings reads fewer than it holds when some went inactive, the walk goes on past it
+        if last_id is None and only:
+            last_id = only[-1]
+
+        # Rest of the catalog waits for its turn in the manager, with the snapshot only if dirty listings are left
+        if last_id is not None and (dirty is None or any(x > last_id for x in dirty)):
+            return {**payload, 'after': last_id}
 
-        # Collect products to revise
-        await self.iterate_products()
+        # Whole catalog is up to date, the next run starts from here
+        # Only the rows of the listings read are redone when the snapshot kept the others out of the run
+        if not payload.get('slice') and CatalogSnapshot.ENABLED:
+            if dirty is not None:
+                Checkpoint.clear(self.user['_id'], 'Reprice')
+                await CatalogSnapshot.patch(self.user, snapshot, dirty, self.unchanged)
+            else:
+                await CatalogSnapshot.build(self.user, self.unchanged)
 
-    async def iterate_products(self):
+    async def iterate_products(self, after=None, slice=None, only=None):
         """ Find Shopify listing and it's fba item equivalent """
         """ Compare their prices and revise product on Shopify if any change needed """
+        """ Returns the id of the last listing when the item or time budget ran out before the end """
 
         # Get all non-delisted listings of the user
-        shopify_listings_count = DB.ShopifyListings.count_documents({
+        query = {
             'user_id': self.user['_id'],
             'active': True,
-        })
+        }
 
-        if not shopify_listings_count:
-            return logger.debug("No listing found")
+        # Slices of one catalog don't overlap, each has its own checkpoint
+        lower, upper = Checkpoint.bounds(slice)
 
-        # Print out start info
-        logger.debug("{total} listing(s) found, starting...", total=shopify_listings_count)
+        if lower or upper:
+            query['_id'] = {**({'$gte': lower} if lower else {}), **({'$lt': upper} if upper else {})}
 
-        shopify_listings = DB.ShopifyListings.find({
-            'user_id': self.user['_id'],
-            'active': True,
-        })
+        # Listings the catalog snapshot can't vouch for, nothing changed for the others
+        if only is not None:
+            query['_id'] = {'$in': only}
 
-        for shopify_item in shopify_listings:
-            # Find the fba_item equivalent
-            fba_item = DB.FbaItems.find_one({
-                '_id': shopify_item['fba_item_id'],
-            })
+        if after is None:
+            shopify_listings_count = DB.ShopifyListings.count_documents(query)
 
-            # Fba item is somehow absent
-            if not fba_item:
-                logger.error("Fba item not found for {fba_item_id}.", fba_item_id=shopify_item['fba_item_id'])
-                continue
+            if not shopify_listings_count:
+                return logger.debug("No listing found")
 
-            price_update = await self.compare_prices(fba_item, shopify_item)
-            quantity_update = await self.compare_quantities(fba_item, shopify_item)
+            # Print out start info
+            logger.debug("{total} listing(s) found, starting...", total=shopify_listings_count)
+        else:
+            query['_id'] = {**query.get('_id', {}), '$gt': after}
 
-            needs_updating = {
-                **(price_update if price_update is not None else {}),
-                **(quantity_update if quantity_update is not None else {}),
-            }
+            logger.debug("Continuing after {after}", after=after)
 
-            # Neither price nor quantity needs update
-            if not needs_updating:
-                # logger.debug("{fba_item_id} | Nothing to update here", fba_item_id=fba_item['_id'])
-                continue
+        chunk_size = FairScheduler.chunk_size('Reprice') or 0
+        time_budget = FairScheduler.time_budget('Reprice')
 
-            # Should provide the current values to prevent deleting other attrs
-            needs_updating = {**{
-                'price': int(shopify_item['price']) / 100.0,
-                'compare_at_price': int(shopify_item['compare_at_price']) / 100.0,
-                'inventory_quantity': int(shopify_item['quantity'])
-            }, **needs_updating}
-
-            # Remote is the one to save on user's Shopify store
-            # Local is for inserting an entry into our Database (seller_sku, user_id...)
-            product = {
-                'local_shopify_item': shopify_item,
-                'local_fba_item': fba_item,
-                'remote_shopify_item': {
-                    'id': shopify_item['shopify_item_id'],
-                    'variants': [needs_updating],
-                },
-            }
+        shopify_listings = DB.ShopifyListings.find(query).sort('_id', 1).limit(chunk_size)
+
+        # Reading, comparing and revising overlap, the bounded queues keep a slow stage from piling up items
+        listings = asyncio.Queue(maxsize=max(1, self.QUEUE_SIZE // self.BATCH_SIZE))
+        revisions = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+
+        # Revisions a bulk mutation could carry, they wait until the diff is over to know if there are enough
+        held = []
+
+        # Ids in the order they were read, the cursor only moves past the ones done before all earlier ones
+        read, done = deque(), set()
+        progress = {'cursor': None, 'count': 0, 'saved': 0, 'out_of_time': False}
+        started_at = time.monotonic()
+
+        def finished(shopify_item_id):
+            done.add(shopify_item_id)
+
+            while read and read[0] in done:
+                done.discard(read[0])
+                progress['cursor'] = read.popleft()
+                progress['count'] += 1
+
+            if progress['count'] - progress['saved'] >= Checkpoint.EVERY:
+                Checkpoint.save(self.user['_id'], 'Reprice', progress['cursor'], progress['count'] - progress['saved'], slice)
+                progress['saved'] = progress['count']
+
+        async def reader():
+            """ Listings with their fba items, fetched a batch at a time """
+
+            batch = []
+
+            for shopify_item in shopify_listings:
+                # Out of time, the rest goes in the next chunk
+                if time_budget and time.monotonic() - started_at > time_budget:
+                    progress['out_of_time'] = True
+                    break
+
+                batch.append(shopify_item)
+
+                if len(batch) == self.BATCH_SIZE:
+                    await put_batch(batch)
+                    batch = []
+
+            await put_batch(batch)
+            await listings.put(None)
+
+        async def put_batch(batch):
+            if not batch:
+                return
+
+            fba_items = {x['_id']: x for x in DB.FbaItems.find({'_id': {'$in': [x['fba_item_id'] for x in batch]}})}
+
+            read.extend(x['_id'] for x in batch)
+            await listings.put([(x, fba_items.get(x['fba_item_id'])) for x in batch])
+
+        async def differ():
+            """ Revisions of the listings that differ from their fba items """
+
+            formula = self.user['settings'].get('shopify_pricing_formulas', {})
+
+            while (batch := await listings.get()) is not None:
+                # Whole batch at once, only the listings that changed or that it can't decide go one by one
+                if self.VECTORIZED:
+                    changed, undecided = Pricing.diff(batch, formula)
+                    candidates = changed | undecided
+                else:
+                    candidates = [True] * len(batch)
+
+                for (shopify_item, fba_item), candidate in zip(batch, candidates):
+                    product = await self.compose_revision(shopify_item, fba_item) if candidate else None
+
+                    if product and self.bulk_eligible(product):
+                        held.append(product)
+                    elif product:
+                        await revisions.put(product)
+                    else:
+                        finished(shopify_item['_id'])
+
+            # Too few for a bulk mutation to pay off, the revisers take them
+            if len(held) < BulkOperation.THRESHOLD:
+                for product in held:
+                    await revisions.put(product)
+
+                held.clear()
+
+            for _ in range(self.WORKERS):
+                await revisions.put(None)
+
+        async def reviser(session):
+            while (product := await revisions.get()) is not None:
+                await self.revise_product(product, session)
+                finished(product['local_shopify_item']['_id'])
+
+        async with Shopify.session(
+            timeout=aiohttp.ClientTimeout(total=120),
+            connector=aiohttp.TCPConnector(limit=self.WORKERS),
+            headers={
+                'Content-Type': 'application/json',
+                'X-Shopify-Access-Token': self.shopify_creds['token'],
+            },
+        ) as session:
+            stages = [asyncio.ensure_future(x) for x in [reader(), differ(), *[reviser(session) for _ in range(self.WORKERS)]]]
+
+            await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+
+            # A revision that ran out of retries stops the run, the cursor keeps what was done before it
+            for stage in stages:
+                stage.cancel()
+
+            await asyncio.gather(*stages, return_exceptions=True)
+
+            error = next((x.exception() for x in stages if not x.cancelled() and x.exception()), None)
+
+            if not error and held:
+                try:
+                    await self.revise_in_bulk(held, session)
+                except Exception as e:
+                    error = e
+                else:
+                    for product in held:
+                        finished(product['local_shopify_item']['_id'])
 
-            # send the product to update
-            await self.revise_product(product)
+        if error:
+            if progress['count'] > progress['saved']:
+                Checkpoint.save(self.user['_id'], 'Reprice', progress['cursor'], progress['count'] - progress['saved'], slice)
+
+            raise error
+
+        if progress['cursor'] is None:
+            return Checkpoint.clear(self.user['_id'], 'Reprice', slice)
+
+        if progress['out_of_time'] or (chunk_size and progress['count'] == chunk_size):
+            Checkpoint.save(self.user['_id'], 'Reprice', progress['cursor'], progress['count'] - progress['saved'], slice, state='paused')
+            return progress['cursor']
+
+        Checkpoint.clear(self.user['_id'], 'Reprice', slice)
+
+    async def compose_revision(self, shopify_item, fba_item):
+        """ Product to revise on Shopify when the listing and its fba item differ, None otherwise """
+
+        # Fba item is somehow absent
+        if not fba_item:
+            return logger.error("Fba item not found for {fba_item_id}.", fba_item_id=shopify_item['fba_item_id'])
+
+        price_update = await self.compare_prices(fba_item, shopify_item)
+        quantity_update = await self.compare_quantities(fba_item, shopify_item)
+
+        needs_updating = {
+            **(price_update if price_update is not None else {}),
+            **(quantity_update if quantity_update is not None else {}),
+        }
+
+        # Neither price nor quantity needs update
+        if not needs_updating:
+            # logger.debug("{fba_item_id} | Nothing to update here", fba_item_id=fba_item['_id'])
+            return None
+
+        # Should provide the current values to prevent deleting other attrs
+        needs_updating = {**{
+            'price': int(shopify_item['price']) / 100.0,
+            'compare_at_price': int(shopify_item['compare_at_price']) / 100.0,
+            'inventory_quantity': int(shopify_item['quantity'])
+        }, **needs_updating}
+
+        # Flickering prices and bouncing quantities wait until they add up or the listing is due
+        if reason := Hysteresis.hold(self.user, shopify_item, needs_updating):
+            return Hysteresis.record(shopify_item, needs_updating, reason)
+
+        # Remote is the one to save on user's Shopify store
+        # Local is for inserting an entry into our Database (seller_sku, user_id...)
+        return {
+            'local_shopify_item': shopify_item,
+            'local_fba_item': fba_item,
+            'remote_shopify_item': {
+                'id': shopify_item['shopify_item_id'],
+                'variants': [needs_updating],
+            },
+        }
+
+    async def unchanged(self, shopify_item, fba_item):
+        """ Neither the price nor the quantity of the listing needs a revision """
+
+        return not (await self.compare_prices(fba_item, shopify_item) or await self.compare_quantities(fba_item, shopify_item))
 
     async def compare_prices(self, fba_item, shopify_item):
         """ Check if price needs updating """
@@ -169,98 +393,320 @@ class ShopifyItemRepricer:
                 'inventory_quantity': fba_item_quantity,
             }
 
-    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=15, jitter=None, on_backoff=Retry.log)
-    async def revise_product(self, product):
+    async def revise_product(self, product, session, parts=None):
         """ Revise products on Shopify store asynchronously """
+        """ Listings that know their variant only send what changed, a variant update for prices and an inventory level set for the quantity """
+        """ parts, (prices, quantity) flags, narrows it down further, e.g. to what a bulk mutation couldn't apply """
 
-        # Set header
-        self.headers = {
-            'Content-Type': 'application/json',
-            'X-Shopify-Access-Token': self.shopify_creds['token'],
-        }
+        shopify_item = product['local_shopify_item']
+        variant = product['remote_shopify_item']['variants'][0]
 
-        logger.debug("Making a request to Shopify API")
+        # Listed before the variant ids were kept, the product update brings them back
+        if not self.VARIANT_UPDATES or not shopify_item.get('variant_id') or not shopify_item.get('inventory_item_id'):
+            return await self.revise_whole_product(product, session)
 
-        async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=120),
-            connector=aiohttp.TCPConnector(limit=5),
-            headers=self.headers,
-        ) as session:
-            try:
-                request = await session.put(
-                    url=settings.SHOPIFY.Endpoints.Product.format(
-                        domain=self.shopify_creds['domain'],
-                        product_id=product['local_shopify_item']['shopify_item_id'],
-                    ),
-                    json={
-                        'product': product['remote_shopify_item'],
-                    }
-                )
-            except (
-                aiohttp.client_exceptions.ClientConnectorError,
-                aiohttp.client_exceptions.ClientOSError,
-                aiohttp.client_exceptions.ServerDisconnectedError
-            ) as e:
-                logger.critical(e)
-                raise ServerConnectionError()
+        price_changed, quantity_changed = parts or self.changes(product)
 
-            try:
-                response = await request.json()
-            except aiohttp.client_exceptions.ContentTypeError as e:
-                return logger.critical(e)
-                raise ServerConnectionError()
+        # Inventory levels are set per location, without one the product update still does it
+        if quantity_changed and not (location_id := await self.location_id()):
+            return await self.revise_whole_product(product, session)
 
-            if request.status == 200:
-                """ Update both collections """
+        updates = {}
 
-                DB.ShopifyListings.update_one({'shopify_item_id': product['local_shopify_item']['shopify_item_id']}, {
-                    '$set': {
-                        'updated_at': datetime.utcnow(),
-                        'price': Helpers.format_price(float(response['product']['variants'][0]['price']) * 100, precision=0),
-                        'compare_at_price': Helpers.format_price(float(response['product']['variants'][0]['compare_at_price']) * 100, precision=0),
-                        'quantity': response['product']['variants'][0]['inventory_quantity'],
-                    },
+        if price_changed:
+            response = await self.request(session, 'PUT', settings.SHOPIFY.Endpoints.Variant.format(
+                domain=self.shopify_creds['domain'],
+                variant_id=shopify_item['variant_id'],
+            ), {
+                'variant': {
+                    'id': shopify_item['variant_id'],
+                    'price': variant['price'],
+                    'compare_at_price': variant['compare_at_price'],
+                },
+            }, shopify_item)
+
+            if response:
+                updates.update({
+                    'price': Helpers.format_price(float(response['variant']['price']) * 100, precision=0),
+                    'compare_at_price': Helpers.format_price(float(response['variant']['compare_at_price']) * 100, precision=0),
+                })
+
+        if quantity_changed:
+            response = await self.request(session, 'POST', settings.SHOPIFY.Endpoints.InventoryLevelsSet.format(
+                domain=self.shopify_creds['domain'],
+            ), {
+                'location_id': location_id,
+                'inventory_item_id': shopify_item['inventory_item_id'],
+                'available': int(variant['inventory_quantity']),
+            }, shopify_item)
+
+            if response:
+                updates['quantity'] = response['inventory_level']['available']
+
+        if updates:
+            self.save_revisions([(product, updates)])
+
+    async def revise_whole_product(self, product, session):
+        """ Product update with the whole variant, for the listings without variant ids """
+
+        response = await self.request(session, 'PUT', settings.SHOPIFY.Endpoints.Product.format(
+            domain=self.shopify_creds['domain'],
+            product_id=product['local_shopify_item']['shopify_item_id'],
+        ), {
+            'product': product['remote_shopify_item'],
+        }, product['local_shopify_item'])
+
+        if response:
+            self.save_revisions([(product, {
+                'price': Helpers.format_price(float(response['product']['variants'][0]['price']) * 100, precision=0),
+                'compare_at_price': Helpers.format_price(float(response['product']['variants'][0]['compare_at_price']) * 100, precision=0),
+                'quantity': response['product']['variants'][0]['inventory_quantity'],
+                'variant_id': response['product']['variants'][0].get('id'),
+                'inventory_item_id': response['product']['variants'][0].get('inventory_item_id'),
+            })])
+
+    async def location_id(self):
+        """ Primary location of the shop, fetched once per process """
+
+        domain = self.shopify_creds['domain']
+
+        # Revisers ask at the same time, only the first one fetches
+        async with self.location_lock:
+            if self.location_missing:
+                return None
+
+            if domain not in self.LOCATIONS:
+                await RateBudget.acquire(domain)
+
+                shop = await Helpers.fetch_shopify_settings(domain=domain, headers={
+                    'Content-Type': 'application/json',
+                    'X-Shopify-Access-Token': self.shopify_creds['token'],
                 })
 
-                # Update shopify_listing_price on FbaItems
-                DB.FbaItems.update_one({'_id': product['local_fba_item']['_id']}, {
+                # Rest of the run sends whole products
+                if not shop or not shop.get('primary_location_id'):
+                    self.location_missing = True
+                    logger.error("Error when getting store settings from Shopify")
+                    return None
+
+                self.LOCATIONS[domain] = shop['primary_location_id']
+
+        return self.LOCATIONS[domain]
+
+    def save_revisions(self, revisions):
+        """ Update both collections with what Shopify answered, (product, updates) pairs """
+
+        listings, fba_items = [], []
+
+        for product, updates in revisions:
+            listings.append(pymongo.UpdateOne({'shopify_item_id': product['local_shopify_item']['shopify_item_id']}, {
+                '$set': {
+                    'updated_at': datetime.utcnow(),
+                    **updates,
+                },
+                '$unset': {'held_revision': ''},
+            }))
+
+            # Update shopify_listing_price on FbaItems
+            if 'price' in updates:
+                fba_items.append(pymongo.UpdateOne({'_id': product['local_fba_item']['_id']}, {
                     '$set': {
                         'updated_at': datetime.utcnow(),
-                        'shopify_listing_price': Helpers.format_price(float(response['product']['variants'][0]['price']) * 100, precision=0),
+                        'shopify_listing_price': updates['price'],
                     },
-                })
+                }))
+
+            Logging.sampled(
+                "SUCCESS",
+                "{fba_item_id} | {shopify_item_id} | Updated with {data}",
+                fba_item_id=product['local_fba_item']['_id'],
+                shopify_item_id=product['local_shopify_item']['shopify_item_id'],
+                data=updates,
+            )
+
+        if listings:
+            DB.ShopifyListings.bulk_write(listings, ordered=False)
+
+        if fba_items:
+            DB.FbaItems.bulk_write(fba_items, ordered=False)
 
-                logger.success(
-                    "{fba_item_id} | {shopify_item_id} | Updated with {data}",
-                    fba_item_id=product['local_fba_item']['_id'],
-                    shopify_item_id=product['local_shopify_item']['shopify_item_id'],
-                    data=product['remote_shopify_item']['variants'],
-                )
+    def changes(self, product):
+        """ Whether the prices and whether the quantity of the revision differ from the listing """
+
+        shopify_item = product['local_shopify_item']
+        variant = product['remote_shopify_item']['variants'][0]
+
+        price_changed = any(
+            Helpers.format_price(float(variant[key]) * 100, precision=0) != shopify_item[key] for key in ['price', 'compare_at_price']
+        )
 
-            if request.status == 404:
-                """ Shopify returns {error: Not Found} """
+        return price_changed, int(variant['inventory_quantity']) != int(shopify_item['quantity'])
 
-                logger.error(
-                    "{fba_item_id} | {shopify_item_id} | seems removed from Shopify",
-                    fba_item_id=product['local_fba_item']['_id'],
-                    shopify_item_id=product['local_shopify_item']['shopify_item_id'],
-                )
+    def bulk_eligible(self, product):
+        """ Bulk mutations address variants and inventory items, listings without their ids can't go """
 
-            if request.status == 429:
-                logger.info(
-                    "{shopify_item_id} | API rate limit reached, retrying...",
-                    shopify_item_id=product['local_shopify_item']['shopify_item_id'],
-                )
+        shopify_item = product['local_shopify_item']
 
-                raise TooManyRequestsException()
+        return bool(BulkOperation.THRESHOLD and shopify_item.get('variant_id') and shopify_item.get('inventory_item_id'))
 
-            if request.status not in [200, 404, 429]:
-                """ Error is not handled yet """
+    async def revise_in_bulk(self, products, session):
+        """ Revisions of a large run as bulk mutations, one for the prices and one for the quantities """
+        """ Whatever the mutations couldn't apply goes through the REST calls after all """
 
-                logger.warning(
-                    "{status_code} Status Code | {shopify_item_id} | {response}",
-                    status_code=request.status,
-                    shopify_item_id=product['local_shopify_item']['shopify_item_id'],
-                    response=response,
-                )
+        domain = self.shopify_creds['domain']
+        changes = [self.changes(x) for x in products]
+
+        # Inventory levels are set per location, without one the quantities take the REST path
+        location_id = await self.location_id() if any(x[1] for x in changes) else None
+
+        prices = [i for i, x in enumerate(changes) if x[0]]
+        quantities = [i for i, x in enumerate(changes) if x[1] and location_id]
+
+        updates = [{} for _ in products]
+        applied = set()
+
+        logger.debug("{count} revision(s), sending them in bulk", count=len(products))
+
+        def variant(i):
+            return products[i]['remote_shopify_item']['variants'][0]
+
+        def lines(name, indexes):
+            for i in indexes:
+                shopify_item = products[i]['local_shopify_item']
+
+                if name == 'VariantPrices':
+                    yield {'input': {
+                        'id': BulkOperation.gid('ProductVariant', shopify_item['variant_id']),
+                        'price': str(variant(i)['price']),
+                        'compareAtPrice': str(variant(i)['compare_at_price']),
+                    }}
+                else:
+                    yield {'input': {
+                        'name': 'available',
+                        'reason': 'correction',
+                        'ignoreCompareQuantity': True,
+                        'quantities': [{
+                            'inventoryItemId': BulkOperation.gid('InventoryItem', shopify_item['inventory_item_id']),
+                            'locationId': BulkOperation.gid('Location', location_id),
+                            'quantity': int(variant(i)['inventory_quantity']),
+                        }],
+                    }}
+
+        for name, field, indexes in [('VariantPrices', 'productVariantUpdate', prices), ('InventoryLevels', 'inventorySetQuantities', quantities)]:
+            if not indexes:
+                continue
+
+            try:
+                async for line_number, data in BulkOperation.mutate(session, domain, name, lines(name, indexes)):
+                    i = indexes[line_number]
+                    result = data.get(field) or {}
+
+                    if result.get('userErrors') or not data.get(field):
+                        logger.warning(
+                            "{shopify_item_id} | {name} | {errors}",
+                            shopify_item_id=products[i]['local_shopify_item']['shopify_item_id'],
+                            name=name,
+                            errors=result.get('userErrors'),
+                        )
+                        continue
+
+                    applied.add((name, i))
+
+                    if name == 'VariantPrices':
+                        updates[i].update({
+                            'price': Helpers.format_price(float(result['productVariant']['price']) * 100, precision=0),
+                            'compare_at_price': Helpers.format_price(float(result['productVariant']['compareAtPrice'] or 0) * 100, precision=0),
+                        })
+                    else:
+                        updates[i]['quantity'] = int(variant(i)['inventory_quantity'])
+            except BulkOperationError as e:
+                logger.error("{name} | Bulk operation failed, {error}", name=name, error=e)
+
+        self.save_revisions([(products[i], x) for i, x in enumerate(updates) if x])
+
+        # Only the parts that didn't go through, the others would cost calls to set the same values again
+        rest = []
+
+        for i, product in enumerate(products):
+            parts = (changes[i][0] and ('VariantPrices', i) not in applied, changes[i][1] and ('InventoryLevels', i) not in applied)
+
+            if any(parts):
+                rest.append((product, parts))
+
+        if rest:
+            logger.warning("{count} revision(s) left to the REST calls", count=len(rest))
+
+        for i in range(0, len(rest), self.WORKERS):
+            await asyncio.gather(*[self.revise_product(product, session, parts) for product, parts in rest[i:i + self.WORKERS]])
+
+    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=Retry.IN_PROCESS_TRIES, jitter=None, on_backoff=Retry.log)
+    async def request(self, session, method, url, json, shopify_item):
+        """ One call to the Shopify API, its response when it succeeded """
+
+        # Waits while the shop's bucket is full, the revisers share it
+        await RateBudget.acquire(self.shopify_creds['domain'])
+
+        Logging.sampled("DEBUG", "Making a request to Shopify API")
+
+        try:
+            request = await session.request(method, url=url, json=json)
+        except (
+            aiohttp.client_exceptions.ClientConnectorError,
+            aiohttp.client_exceptions.ClientOSError,
+            aiohttp.client_exceptions.ServerDisconnectedError,
+            asyncio.TimeoutError
+        ) as e:
+            logger.critical(repr(e))
+            raise ServerConnectionError()
+
+        # Shopify is down or overloaded, its error pages aren't JSON
+        if request.status >= 500:
+            logger.warning("{status_code} Status Code | Shopify unavailable, retrying...", status_code=request.status)
+            raise ServerConnectionError()
+
+        try:
+            response = await request.json()
+        except (aiohttp.client_exceptions.ClientPayloadError, asyncio.TimeoutError) as e:
+            logger.critical(repr(e))
+            raise ServerConnectionError()
+        except aiohttp.client_exceptions.ContentTypeError as e:
+            return logger.critical(e)
+            raise ServerConnectionError()
+
+        if request.status == 200:
+            return response
+
+        if request.status == 404:
+            """ Shopify returns {error: Not Found} """
+
+            # Deleted on Shopify, the repricer leaves it alone until the reconciler sees it again
+            DB.ShopifyListings.update_one({'_id': shopify_item['_id']}, {
+                '$set': {
+                    'active': False,
+                    'removed_at': datetime.utcnow(),
+                },
+            })
 
+            logger.error(
+                "{fba_item_id} | {shopify_item_id} | seems removed from Shopify",
+                fba_item_id=shopify_item['fba_item_id'],
+                shopify_item_id=shopify_item['shopify_item_id'],
+            )
+
+        if request.status == 429:
+            logger.info(
+                "{shopify_item_id} | API rate limit reached, retrying...",
+                shopify_item_id=shopify_item['shopify_item_id'],
+            )
+
+            raise TooManyRequestsException()
+
+        if request.status not in [200, 404, 429]:
+            """ Error is not handled yet """
+
+            logger.warning(
+                "{status_code} Status Code | {shopify_item_id} | {response}",
+                status_code=request.status,
+                shopify_item_id=shopify_item['shopify_item_id'],
+                response=response,
+            )
@@ -10,6 +10,7 @@ from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
 from utils.Helpers import Helpers
+from utils.Shopify import Shopify
 from utils.Retry import Retry, TooManyRequestsException, ServerConnectionError
 
 # Get DB instance
@@ -45,7 +46,7 @@ class ShopifyItemUnpublisher:
             return logger.critical("{user_id} | Shopify token not found", user_id=self.user['_id'])
 
         # Configure logger format
-        Helpers.configure_logger(user=self.user['_id'])
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
 
         # Prepare product to send
         await self.compose_product()
@@ -70,10 +71,13 @@ class ShopifyItemUnpublisher:
             },
         }
 
+        if not Helpers.shop_available(self.user):
+            return
+
         # Unpublish product
         await self.unpublish_product(product)
 
-    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=15, jitter=None, on_backoff=Retry.log)
+    @backoff.on_exception(backoff.fibo, (TooManyRequestsException, ServerConnectionError), max_tries=Retry.IN_PROCESS_TRIES, jitter=None, on_backoff=Retry.log)
     async def unpublish_product(self, product):
         """ Deactivate product on Shopify store asynchronously """
 
@@ -85,7 +89,7 @@ class ShopifyItemUnpublisher:
 
         logger.debug("Making a request to Shopify API")
 
-        async with aiohttp.ClientSession(
+        async with Shopify.session(
             timeout=aiohttp.ClientTimeout(total=120),
             connector=aiohttp.TCPConnector(limit=5),
             headers=self.headers,
@@ -102,13 +106,22 @@ class ShopifyItemUnpublisher:
             except (
                 aiohttp.client_exceptions.ClientConnectorError,
                 aiohttp.client_exceptions.ClientOSError,
-                aiohttp.client_exceptions.ServerDisconnectedError
+                aiohttp.client_exceptions.ServerDisconnectedError,
+                asyncio.TimeoutError
             ) as e:
-                logger.critical(e)
+                logger.critical(repr(e))
+                raise ServerConnectionError()
+
+            # Shopify is down or overloaded, its error pages aren't JSON
+            if request.status >= 500:
+                logger.warning("{status_code} Status Code | Shopify unavailable, retrying...", status_code=request.status)
                 raise ServerConnectionError()
 
             try:
                 response = await request.json()
+            except (aiohttp.client_exceptions.ClientPayloadError, asyncio.TimeoutError) as e:
+                logger.critical(repr(e))
+                raise ServerConnectionError()
             except aiohttp.client_exceptions.ContentTypeError as e:
                 return logger.critical(e)
                 raise ServerConnectionError()
@@ -12,6 +12,10 @@ from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
 from utils.Helpers import Helpers
+from utils.Shopify import Shopify
+from utils.Logging import Logging
+from utils.Metrics import Metrics
+from utils.Recorder import Recorder
 from utils.Email import Email
 from utils.Retry import Retry, ServerConnectionError
 
@@ -52,12 +56,19 @@ class ShopifyOrderFulfiller:
             return logger.debug("{user_id} | Fulfillment service disabled by the user", user_id=payload['user_id'])
 
         # Configure logger format
-        Helpers.configure_logger(user=self.user['_id'])
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
 
-        # Fetch latest sales
-        await self.get_transactions()
+        if not Helpers.shop_available(self.user):
+            return
+
+        try:
+            # Fetch latest sales
+            await self.get_transactions()
+        finally:
+            # Send out the collected notifications if the user prefers a digest
+            Email().flush_digest(self.user)
 
-    @backoff.on_exception(backoff.fibo, ServerConnectionError, max_tries=15, jitter=None, on_backoff=Retry.log)
+    @backoff.on_exception(backoff.fibo, ServerConnectionError, max_tries=Retry.IN_PROCESS_TRIES, jitter=None, on_backoff=Retry.log)
     async def get_transactions(self):
         """ Get Shopify transactions of current user """
 
@@ -69,7 +80,7 @@ class ShopifyOrderFulfiller:
 
         logger.debug("Fetching orders from Shopify API")
 
-        async with aiohttp.ClientSession(
+        async with Shopify.session(
             timeout=aiohttp.ClientTimeout(total=120),
             connector=aiohttp.TCPConnector(limit=5),
             headers=self.headers,
@@ -83,13 +94,22 @@ class ShopifyOrderFulfiller:
             except (
                 aiohttp.client_exceptions.ClientConnectorError,
                 aiohttp.client_exceptions.ClientOSError,
-                aiohttp.client_exceptions.ServerDisconnectedError
+                aiohttp.client_exceptions.ServerDisconnectedError,
+                asyncio.TimeoutError
             ) as e:
-                logger.critical(e)
+                logger.critical(repr(e))
+                raise ServerConnectionError()
+
+            # Shopify is down or overloaded, its error pages aren't JSON
+            if request.status >= 500:
+                logger.warning("{status_code} Status Code | Shopify unavailable, retrying...", status_code=request.status)
                 raise ServerConnectionError()
 
             try:
                 response = await request.json()
+            except (aiohttp.client_exceptions.ClientPayloadError, asyncio.TimeoutError) as e:
+                logger.critical(repr(e))
+                raise ServerConnectionError()
             except aiohttp.client_exceptions.ContentTypeError as e:
                 return logger.critical(e)
                 raise ServerConnectionError()
@@ -116,23 +136,23 @@ class ShopifyOrderFulfiller:
 
         for order_from_db in orders_from_db:
             if order_from_db.get('ignore_fulfilling'):
-                logger.debug("{order_id} | Ignore flag seen for this order", order_id=int(order_from_db['order_id']))
+                Logging.sampled("DEBUG", "{order_id} | Ignore flag seen for this order", order_id=int(order_from_db['order_id']))
                 continue
 
             if order_from_db.get('permanent_fulfillment_error'):
-                logger.debug("{order_id} | Permanent fulfillment error seen for this order", order_id=int(order_from_db['order_id']))
+                Logging.sampled("DEBUG", "{order_id} | Permanent fulfillment error seen for this order", order_id=int(order_from_db['order_id']))
                 continue
 
             if order_from_db.get('fulfilled_at'):
-                logger.debug("{order_id} | Already fulfilled", order_id=int(order_from_db['order_id']))
+                Logging.sampled("DEBUG", "{order_id} | Already fulfilled", order_id=int(order_from_db['order_id']))
                 continue
 
             if order_from_db['financial_status'] != 'paid':
-                logger.debug("{order_id} | Financial status is not paid", order_id=int(order_from_db['order_id']))
+                Logging.sampled("DEBUG", "{order_id} | Financial status is not paid", order_id=int(order_from_db['order_id']))
                 continue
 
             if not order_from_db.get('customer'):
-                logger.debug("{order_id} | Purchaser not found", order_id=int(order_from_db['order_id']))
+                Logging.sampled("DEBUG", "{order_id} | Purchaser not found", order_id=int(order_from_db['order_id']))
                 continue
 
             order_from_shopify = [x for x in orders_from_shopify if x['id'] == int(order_from_db['order_id'])]
@@ -213,14 +233,12 @@ class ShopifyOrderFulfiller:
                         f"</a>"
                     )
 
-                Email().send(
-                    to=self.user['emails'][0]['address'],
-                    subject=settings.EMAILS.Fulfillment.MFN.Subject,
-                    message=settings.EMAILS.Fulfillment.MFN.Body.format(
-                        product_title=shopify_item['title'],
-                        order_id=int(order_from_shopify['id']),
-                        shipping_address=shipping_address,
-                    ),
+                Email().notify(
+                    user=self.user,
+                    template='Fulfillment.MFN',
+                    product_title=shopify_item['title'],
+                    order_id=int(order_from_shopify['id']),
+                    shipping_address=shipping_address,
                 )
 
                 update_order_product({
@@ -258,13 +276,11 @@ class ShopifyOrderFulfiller:
 
         # Email user and mark as shipped on Shopify
         if self.user['settings'].get('enable_email_notifications'):
-            Email().send(
-                to=self.user['emails'][0]['address'],
-                subject=settings.EMAILS.Fulfillment.AFN.Subject,
-                message=settings.EMAILS.Fulfillment.AFN.Body.format(
-                    order_id=int(order_from_shopify['id']),
-                    buyer_name=order_from_db['customer']['address'].get('shipping', {}).get('name', 'N/A'),
-                ),
+            Email().notify(
+                user=self.user,
+                template='Fulfillment.AFN',
+                order_id=int(order_from_shopify['id']),
+                buyer_name=order_from_db['customer']['address'].get('shipping', {}).get('name', 'N/A'),
             )
 
     def make_amazon_fulfillment_request(self, order_from_db, order_from_shopify, amazon_bought_items):
@@ -319,20 +335,27 @@ class ShopifyOrderFulfiller:
             region='US',
         )
 
+        # Local stand-in of the MWS API, the client has no option for it
+        if settings.AMAZON.Api.get('Endpoint'):
+            amazon.domain = settings.AMAZON.Api.Endpoint
+
         logger.debug("Making a fulfillment request {call}", call=call)
 
         try:
-            response = amazon.create_fulfillment_order(
-                marketplace_id=call['params']['marketplace'],
-                seller_fulfillment_order_id=str(call['params']['orderId']),
-                displayable_order_id=str(call['params']['orderId']),
-                displayable_order_datetime=call['params']['orderDate'],
-                displayable_order_comment=call['params']['orderComment'],
-                shipping_speed_category=call['params']['shippingSpeed'],
-                notification_email_list=call['params']['notificationEmail'],
-                destination_address=call['address'],
-                items=call['items'],
-            )
+            with Metrics.timer('mws.create_fulfillment_order') as timer:
+                response = amazon.create_fulfillment_order(
+                    marketplace_id=call['params']['marketplace'],
+                    seller_fulfillment_order_id=str(call['params']['orderId']),
+                    displayable_order_id=str(call['params']['orderId']),
+                    displayable_order_datetime=call['params']['orderDate'],
+                    displayable_order_comment=call['params']['orderComment'],
+                    shipping_speed_category=call['params']['shippingSpeed'],
+                    notification_email_list=call['params']['notificationEmail'],
+                    destination_address=call['address'],
+                    items=call['items'],
+                )
+
+            Recorder.mws('CreateFulfillmentOrder', response, timer.elapsed)
         except Exception as e:
             error = xmltodict.parse(str(e))
 
@@ -362,14 +385,12 @@ class ShopifyOrderFulfiller:
                         problematic_fba_item_id, problematic_fba_item = None, None
                         logger.error(e)
 
-                    Email().send(
-                        to=self.user['emails'][0]['address'],
-                        subject=settings.EMAILS.Fulfillment.NoInventory.Subject,
-                        message=settings.EMAILS.Fulfillment.NoInventory.Body.format(
-                            order_id=int(order_from_shopify['id']),
-                            product_title=problematic_fba_item['title'] if problematic_fba_item else 'N/A',
-                            product_id=problematic_fba_item['_id'] if problematic_fba_item else 'N/A',
-                        ),
+                    Email().notify(
+                        user=self.user,
+                        template='Fulfillment.NoInventory',
+                        order_id=int(order_from_shopify['id']),
+                        product_title=problematic_fba_item['title'] if problematic_fba_item else 'N/A',
+                        product_id=problematic_fba_item['_id'] if problematic_fba_item else 'N/A',
                     )
                 else:
                     DB.ShopifySales.update_one({'_id': order_from_db['_id']}, {
@@ -403,7 +424,7 @@ class ShopifyOrderFulfiller:
     async def make_shopify_fulfillment_request(self, order_from_db, shopify_shop_settings):
         """ Inform Shopify about fulfillment """
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
+        async with Shopify.session(headers=self.headers) as session:
             request = await session.post(
                 url=settings.SHOPIFY.Endpoints.Fulfillments.format(
                     domain=self.shopify_creds['domain'],
@@ -11,6 +11,10 @@ from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
 from utils.Helpers import Helpers
+from utils.Shopify import Shopify
+from utils.Logging import Logging
+from utils.Metrics import Metrics
+from utils.Recorder import Recorder
 from utils.Email import Email
 
 # Get DB instance
@@ -50,10 +54,14 @@ class ShopifyOrderTracker:
             return logger.debug("{user_id} | Fulfillment service disabled by the user", user_id=payload['user_id'])
 
         # Configure logger format
-        Helpers.configure_logger(user=self.user['_id'])
+        Helpers.configure_logger(user=self.user['_id'], service=self.__class__.__name__)
 
-        # Fetch latest sales that are fulfilled
-        await self.get_transactions()
+        try:
+            # Fetch latest sales that are fulfilled
+            await self.get_transactions()
+        finally:
+            # Send out the collected notifications if the user prefers a digest
+            Email().flush_digest(self.user)
 
     async def get_transactions(self):
         """ Get Shopify transactions of current user """
@@ -70,6 +78,10 @@ class ShopifyOrderTracker:
         if not shopify_orders_count:
             return logger.debug("No untracked transaction found")
 
+        # Tracking found from here on is sent to Shopify too
+        if not Helpers.shop_available(self.user):
+            return
+
         # Get shopify sale in our DB
         shopify_orders = DB.ShopifySales.find({
             'user_id': self.user['_id'],
@@ -105,12 +117,19 @@ class ShopifyOrderTracker:
                 region='US',
             )
 
-            logger.debug("Making a get fulfillment request {call}", call=call)
+            # Local stand-in of the MWS API, the client has no option for it
+            if settings.AMAZON.Api.get('Endpoint'):
+                amazon.domain = settings.AMAZON.Api.Endpoint
+
+            Logging.sampled("DEBUG", "Making a get fulfillment request {call}", call=call)
 
             try:
-                response = amazon.get_fulfillment_order(
-                    seller_fulfillment_order_id=call['params']['SellerFulfillmentOrderId'],
-                )
+                with Metrics.timer('mws.get_fulfillment_order') as timer:
+                    response = amazon.get_fulfillment_order(
+                        seller_fulfillment_order_id=call['params']['SellerFulfillmentOrderId'],
+                    )
+
+                Recorder.mws('GetFulfillmentOrder', response, timer.elapsed)
             except Exception as e:
                 error = xmltodict.parse(str(e))
 
@@ -136,20 +155,18 @@ class ShopifyOrderTracker:
                 if order.get('shopify_fulfillment_id'):
                     await self.make_shopify_fulfillment_request(order, shipment_package)
 
-                Email().send(
-                    to=self.user['emails'][0]['address'],
-                    subject=settings.EMAILS.Tracking.Obtained.Subject,
-                    message=settings.EMAILS.Tracking.Obtained.Body.format(
-                        order_id=int(order['order_id']),
-                        carrier_code=shipment_package.CarrierCode,
-                        tracking_number=shipment_package.TrackingNumber,
-                        estimated_arrival=shipment_package.EstimatedArrivalDateTime,
-                    ),
+                Email().notify(
+                    user=self.user,
+                    template='Tracking.Obtained',
+                    order_id=int(order['order_id']),
+                    carrier_code=shipment_package.CarrierCode,
+                    tracking_number=shipment_package.TrackingNumber,
+                    estimated_arrival=shipment_package.EstimatedArrivalDateTime,
                 )
 
                 logger.success("{order_id} | Updated order with the tracking info and notified the customer", order_id=order['_id'])
             except Exception as e:
-                logger.debug("{fid} | Tracking is not yet ready", fid=call['params']['SellerFulfillmentOrderId'])
+                Logging.sampled("DEBUG", "{fid} | Tracking is not yet ready", fid=call['params']['SellerFulfillmentOrderId'])
                 continue
 
     async def make_shopify_fulfillment_request(self, order, shipment_package):
@@ -161,7 +178,7 @@ class ShopifyOrderTracker:
             'X-Shopify-Access-Token': self.shopify_creds['token'],
         }
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
+        async with Shopify.session(headers=self.headers) as session:
             request = await session.put(
                 url=settings.SHOPIFY.Endpoints.Fulfillment.format(
                     domain=self.shopify_creds['domain'],
@@ -8,6 +8,11 @@ from loguru import logger
 from dynaconf import settings
 from utils.Database import Database
 from utils.Queue import Queue
+from utils.Tracing import Tracing
+from utils.CircuitBreaker import CircuitBreaker
+from utils.TaskRegistry import TaskRegistry
+from utils.Priority import Priority
+from utils.FairScheduler import FairScheduler
 
 # Get DB instance
 DB = Database.instance()
@@ -26,26 +31,52 @@ class ShopifyUserPublisher:
             'settings.shopify_creds.token': {'$exists': True},
         })
 
+        # Shops with an open circuit wait for their probe
+        blocked = CircuitBreaker.blocked()
+
         for user in users:
+            if user['settings']['shopify_creds'].get('domain') in blocked:
+                logger.debug("{user_id} | Shopify circuit open, not publishing", user_id=user['_id'])
+                continue
+
             try:
                 shopify_domain = user['settings']['shopify_creds'].get('domain', '').split('.myshopify.com')[0]
             except Exception as e:
                 logger.critical("{user_id} | Shopify domain not found", user_id=user['_id'])
                 continue
 
+            # Both messages carry the same trace, so the stages until the Shopify call can be measured
+            headers = Tracing.headers()
+
             # Publish first message to actual task queue
             target_queue = f"DEBUG::Shopify.{user['_id']}.{shopify_domain}"
             target_queue_message = {'task': task, 'user_id': user['_id']}
 
-            loop.run_until_complete(queue.connect(target=target_queue, loop=loop))
-            loop.create_task(queue.publish(routing_key=target_queue, message=json.dumps(target_queue_message)))
+            # Previous one is still waiting in the queue
+            claimed = TaskRegistry.claim(target_queue, target_queue_message)
 
             # Publish second message to pending tasks queue
             pending_tasks_queue = settings.SHOPIFY.Queue.PendingTasks
-            pending_tasks_queue_message = {'task': task, 'target': target_queue}
+            pending_tasks_queue_message = {'task': task, 'target': target_queue, 'weight': FairScheduler.weight(user)}
+
+            # Both awaited, a claim whose messages never made it to the queues is given back right away
+            try:
+                if claimed:
+                    loop.run_until_complete(queue.connect(target=target_queue, loop=loop))
+                    loop.run_until_complete(queue.publish(routing_key=target_queue, message=json.dumps(target_queue_message), headers=headers))
+                else:
+                    logger.debug("{user_id} | {task} already queued", user_id=user['_id'], task=task)
+
+                # Sent even for a queued one, it may sit there because its dispatcher was on its way out
+                # The manager spawns nothing when the queue has a consumer
+                loop.run_until_complete(queue.connect(target=pending_tasks_queue, loop=loop))
+                # Order tasks are taken first by the manager
+                loop.run_until_complete(queue.publish(routing_key=pending_tasks_queue, message=json.dumps(pending_tasks_queue_message), headers=headers, priority=Priority.level(task)))
+            except Exception as e:
+                if claimed:
+                    TaskRegistry.release(target_queue, target_queue_message)
 
-            loop.run_until_complete(queue.connect(target=pending_tasks_queue, loop=loop))
-            loop.create_task(queue.publish(routing_key=pending_tasks_queue, message=json.dumps(pending_tasks_queue_message)))
+                logger.error("{user_id} | {task} not published, {error}", user_id=user['_id'], task=task, error=e)
 
         loop.run_until_complete(queue.shutdown())
 
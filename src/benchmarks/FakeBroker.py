@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import json
+import time
+
+from collections import defaultdict
+
+
+class FakeMessage:
+    """ Just enough of aio_pika.IncomingMessage for Queue.handle_message """
+
+    def __init__(self, payload, headers=None, at=None):
+        self.body = json.dumps(payload).encode()
+        self.headers = headers or {}
+        self.acked = False
+
+        # Seconds after the start of the run the message arrives, None is right away
+        self.at = at
+
+    @contextlib.asynccontextmanager
+    async def process(self):
+        try:
+            yield self
+        finally:
+            self.acked = True
+
+
+class FakeBroker:
+    """ In-memory user queues consumed through the real Queue.handle_message """
+
+    # Like Queue.should_live, a worker left without messages that long exits and frees its slot
+    IDLE = 10
+
+    def __init__(self, concurrency=32):
+        # Like GlobalProcessLimit / ConsumerPerQueue, that many queues are consumed at once
+        self.concurrency = concurrency
+
+        self.queues = defaultdict(list)
+        self.published = defaultdict(list)
+
+        # Seconds between the arrival and the start of each message
+        self.lateness = []
+
+    def put(self, target, payload, headers=None, at=None):
+        self.queues[target].append(FakeMessage(payload, headers, at))
+
+    async def publish(self, routing_key, message, headers=None):
+        self.published[routing_key].append((json.loads(message), headers))
+
+    async def drain(self, consumer, speed=None):
+        """ Consume every queue, returns the duration of each message
+
+        Messages with an arrival time are held until then, sped up by speed; without speed they all arrive at once.
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        durations = []
+        started_at = time.perf_counter()
+
+        def due(message):
+            return started_at + message.at / speed if speed and message.at is not None else started_at
+
+        async def consume(target, messages):
+            # Queue and callback of the worker, like a dispatcher process per queue
+            queue, callback = consumer(target)
+
+            while messages:
+                await asyncio.sleep(max(0, due(messages[0]) - time.perf_counter()))
+
+                async with semaphore:
+                    # A worker per queue, messages of a queue one after another
+                    while messages and due(messages[0]) - time.perf_counter() < self.IDLE:
+                        await asyncio.sleep(max(0, due(messages[0]) - time.perf_counter()))
+
+                        message = messages.pop(0)
+                        message_started_at = time.perf_counter()
+                        self.lateness.append(message_started_at - due(message))
+
+                        await queue.handle_message(message, callback)
+                        durations.append(time.perf_counter() - message_started_at)
+
+        queues, self.queues = self.queues, defaultdict(list)
+        await asyncio.gather(*[consume(target, messages) for target, messages in queues.items()])
+
+        return durations
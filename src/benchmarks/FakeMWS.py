@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+NAMESPACE = 'http://mws.amazonaws.com/FulfillmentOutboundShipment/2010-10-01/'
+
+
+class FakeMWS:
+    """ Stand-in of the MWS FulfillmentOutboundShipment endpoint """
+
+    def __init__(self, latency=0.2):
+        # Seconds added to every response
+        self.latency = latency
+
+        self.calls = Counter()
+
+        # Recorded bodies per action, served in turn instead of the generated ones
+        self.responses = defaultdict(list)
+
+    def respond(self, action, params):
+        request_id = uuid.uuid4()
+
+        if self.responses[action]:
+            return self.responses[action][self.calls[action] % len(self.responses[action])]
+
+        if action == 'CreateFulfillmentOrder':
+            return (
+                f'<?xml version="1.0"?>'
+                f'<CreateFulfillmentOrderResponse xmlns="{NAMESPACE}">'
+                f'<CreateFulfillmentOrderResult/>'
+                f'<ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>'
+                f'</CreateFulfillmentOrderResponse>'
+            )
+
+        if action == 'GetFulfillmentOrder':
+            order_id = params.get('SellerFulfillmentOrderId', ['0'])[0]
+
+            return (
+                f'<?xml version="1.0"?>'
+                f'<GetFulfillmentOrderResponse xmlns="{NAMESPACE}">'
+                f'<GetFulfillmentOrderResult>'
+                f'<FulfillmentOrder><SellerFulfillmentOrderId>{order_id}</SellerFulfillmentOrderId></FulfillmentOrder>'
+                f'<FulfillmentShipment><member><FulfillmentShipmentPackage><member>'
+                f'<PackageNumber>1</PackageNumber>'
+                f'<TrackingNumber>1Z{order_id}</TrackingNumber>'
+                f'<CarrierCode>UPS</CarrierCode>'
+                f'<EstimatedArrivalDateTime>2020-09-01T00:00:00Z</EstimatedArrivalDateTime>'
+                f'</member></FulfillmentShipmentPackage></member></FulfillmentShipment>'
+                f'</GetFulfillmentOrderResult>'
+                f'<ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>'
+                f'</GetFulfillmentOrderResponse>'
+            )
+
+    def start(self, port):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_action(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+
+                if self.command == 'POST' and (length := int(self.headers.get('Content-Length') or 0)):
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+
+                action = params.get('Action', ['unknown'])[0]
+                fake.calls[action] += 1
+
+                time.sleep(fake.latency)
+
+                body = fake.respond(action, params)
+
+                self.send_response(200 if body else 400)
+                self.send_header('Content-Type', 'text/xml')
+                self.end_headers()
+                self.wfile.write((body or '').encode())
+
+            do_GET = handle_action
+            do_POST = handle_action
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def calls_for(self, action=None):
+        return sum(count for name, count in self.calls.items() if action in [None, name])
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+from collections import Counter, defaultdict
+from datetime import datetime
+
+
+class FakeShopify:
+    """ In-process stand-in of the Shopify Admin API with a leaky bucket per shop """
+
+    # Shopify REST limits of a standard plan
+    BUCKET_SIZE = 40
+    LEAK_RATE = 2
+
+    # Secs a bulk operation runs before its results are ready
+    BULK_DURATION = 0.5
+
+    def __init__(self, latency=0.05, throttle=0.0):
+        # Seconds added to every response
+        self.latency = latency
+
+        # Share of requests answered with 429 regardless of the bucket
+        self.throttle = throttle
+
+        self.products = {}
+
+        # Variant id and inventory item id => variant of the products above
+        self.variants = {}
+        self.inventory_items = {}
+        self.orders = defaultdict(list)
+        self.buckets = {}
+
+        # Staged upload path => its lines, bulk operation id => its state and results
+        self.uploads = {}
+        self.operations = {}
+
+        self.calls = Counter()
+        self.throttled = 0
+        self.not_found = 0
+        self.next_id = 4000000000
+
+    def generate_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def app(self):
+        app = web.Application(middlewares=[self.middleware])
+
+        prefix = '/{domain}/admin/api/{version}'
+
+        app.router.add_get(f'{prefix}/shop.json', self.shop)
+        app.router.add_post(f'{prefix}/products.json', self.create_product)
+        app.router.add_put(f'{prefix}/products/{{product_id}}.json', self.update_product)
+        app.router.add_put(f'{prefix}/variants/{{variant_id}}.json', self.update_variant)
+        app.router.add_post(f'{prefix}/inventory_levels/set.json', self.set_inventory_level)
+        app.router.add_post(f'{prefix}/graphql.json', self.graphql)
+        app.router.add_get(f'{prefix}/orders.json', self.list_orders)
+        app.router.add_post(f'{prefix}/orders/{{order_id}}/fulfillments.json', self.create_fulfillment)
+        app.router.add_put(f'{prefix}/orders/{{order_id}}/fulfillments/{{fulfillment_id}}.json', self.update_fulfillment)
+
+        # Stand-ins of the storage bulk files go to and come from, outside of the shop's bucket
+        app.router.add_post('/{domain}/staged', self.staged_upload)
+        app.router.add_get('/{domain}/bulk/{operation_id}.jsonl', self.bulk_results)
+
+        return app
+
+    def leak(self, domain):
+        """ Current bucket level of the shop """
+
+        level, updated_at = self.buckets.get(domain, (0, time.monotonic()))
+        now = time.monotonic()
+
+        return max(0, level - (now - updated_at) * self.LEAK_RATE), now
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        domain = request.match_info.get('domain', 'unknown')
+        self.calls[(domain, request.method, request.match_info.route.resource.canonical)] += 1
+
+        if '/admin/' not in request.path:
+            return await handler(request)
+
+        await asyncio.sleep(self.latency)
+
+        level, now = self.leak(domain)
+
+        if level + 1 > self.BUCKET_SIZE or random.random() < self.throttle:
+            self.throttled += 1
+
+            return web.json_response({
+                'errors': 'Exceeded 2 calls per second for api client. Reduce request rates to resume uninterrupted service.',
+            }, status=429, headers={
+                'Retry-After': '1.0',
+                'X-Shopify-Shop-Api-Call-Limit': f'{int(level)}/{self.BUCKET_SIZE}',
+            })
+
+        self.buckets[domain] = (level + 1, now)
+
+        response = await handler(request)
+
+        if response.status == 404:
+            self.not_found += 1
+
+        response.headers['X-Shopify-Shop-Api-Call-Limit'] = f'{int(level + 1)}/{self.BUCKET_SIZE}'
+
+        return response
+
+    def add_product(self, domain, price, compare_at_price, quantity, published=True):
+        """ Seed a product the way Shopify would store it """
+
+        product_id = self.generate_id()
+
+        self.products[product_id] = {
+            'id': product_id,
+            'domain': domain,
+            'title': f'Product {product_id}',
+            'handle': f'product-{product_id}',
+            'image': None,
+            'published_at': datetime.utcnow().isoformat() if published else None,
+            'variants': [{
+                'id': self.generate_id(),
+                'inventory_item_id': self.generate_id(),
+                'price': f'{price:.2f}',
+                'compare_at_price': f'{compare_at_price:.2f}',
+                'inventory_quantity': quantity,
+            }],
+        }
+
+        variant = self.products[product_id]['variants'][0]
+
+        self.variants[variant['id']] = variant
+        self.inventory_items[variant['inventory_item_id']] = variant
+
+        return self.products[product_id]
+
+    async def shop(self, request):
+        return web.json_response({
+            'shop': {
+                'domain': request.match_info['domain'],
+                'primary_location_id': 1,
+            },
+        })
+
+    async def create_product(self, request):
+        data = (await request.json())['product']
+        variant = data['variants'][0]
+
+        product = self.add_product(
+            domain=request.match_info['domain'],
+            price=float(variant['price']),
+            compare_at_price=float(variant['compare_at_price']),
+            quantity=int(variant['inventory_quantity']),
+            published=data.get('published', True),
+        )
+        product['title'] = data['title']
+
+        return web.json_response({'product': product}, status=201)
+
+    async def update_product(self, request):
+        product = self.products.get(int(request.match_info['product_id']))
+
+        if not product:
+            return web.json_response({'errors': 'Not Found'}, status=404)
+
+        data = (await request.json())['product']
+
+        if 'published_at' in data:
+            product['published_at'] = data['published_at']
+
+        for variant in data.get('variants', [])[:1]:
+            for key in ['price', 'compare_at_price']:
+                if key in variant:
+                    product['variants'][0][key] = f'{float(variant[key]):.2f}'
+
+            if 'inventory_quantity' in variant:
+                product['variants'][0]['inventory_quantity'] = int(variant['inventory_quantity'])
+
+        return web.json_response({'product': product})
+
+    async def update_variant(self, request):
+        variant = self.variants.get(int(request.match_info['variant_id']))
+
+        if not variant:
+            return web.json_response({'errors': 'Not Found'}, status=404)
+
+        data = (await request.json())['variant']
+
+        for key in ['price', 'compare_at_price']:
+            if key in data:
+                variant[key] = f'{float(data[key]):.2f}'
+
+        return web.json_response({'variant': variant})
+
+    async def set_inventory_level(self, request):
+        data = await request.json()
+        variant = self.inventory_items.get(int(data['inventory_item_id']))
+
+        if not variant:
+            return web.json_response({'errors': 'Not Found'}, status=404)
+
+        variant['inventory_quantity'] = int(data['available'])
+
+        return web.json_response({
+            'inventory_level': {
+                'inventory_item_id': variant['inventory_item_id'],
+                'location_id': data['location_id'],
+                'available': variant['inventory_quantity'],
+                'updated_at': datetime.utcnow().isoformat(),
+            },
+        })
+
+    async def graphql(self, request):
+        """ Only the bulk operation calls, told apart by the field they ask for """
+
+        data = await request.json()
+        query, variables = data['query'], data.get('variables') or {}
+        domain = request.match_info['domain']
+
+        if 'stagedUploadsCreate' in query:
+            key = f'tmp/{self.generate_id()}/bulk/variables.jsonl'
+
+            return web.json_response({'data': {'stagedUploadsCreate': {
+                'stagedTargets': [{
+                    'url': str(request.url.with_path(f'/{domain}/staged').with_query(None)),
+                    'resourceUrl': None,
+                    'parameters': [{'name': 'key', 'value': key}],
+                }],
+                'userErrors': [],
+            }}})
+
+        if 'bulkOperationRunMutation' in query:
+            lines = self.uploads.pop(variables['stagedUploadPath'], None)
+
+            if lines is None:
+                return web.json_response({'data': {'bulkOperationRunMutation': {
+                    'bulkOperation': None,
+                    'userErrors': [{'field': ['stagedUploadPath'], 'message': 'Staged upload not found'}],
+                }}})
+
+            mutation = self.variant_update if 'productVariantUpdate' in variables['mutation'] else self.inventory_set
+            results = [{'data': mutation(line['input']), '__lineNumber': i} for i, line in enumerate(lines)]
+
+            return web.json_response({'data': {'bulkOperationRunMutation': {
+                'bulkOperation': self.start_operation(results),
+                'userErrors': [],
+            }}})
+
+        if 'bulkOperationRunQuery' in query:
+            # Only the variant export of the reconciler, one flat line per variant
+            results = [{
+                'id': f"gid://shopify/ProductVariant/{variant['id']}",
+                'price': variant['price'],
+                'compareAtPrice': variant['compare_at_price'],
+                'inventoryQuantity': variant['inventory_quantity'],
+                'inventoryItem': {'id': f"gid://shopify/InventoryItem/{variant['inventory_item_id']}"},
+                'product': {'id': f"gid://shopify/Product/{product['id']}", 'publishedAt': product['published_at']},
+            } for product in self.products.values() if product['domain'] == domain for variant in product['variants']]
+
+            return web.json_response({'data': {'bulkOperationRunQuery': {
+                'bulkOperation': self.start_operation(results),
+                'userErrors': [],
+            }}})
+
+        if 'node(' in query:
+            operation = self.operations.get(variables['id'])
+
+            if not operation:
+                return web.json_response({'data': {'node': None}})
+
+            completed = time.monotonic() >= operation['ready_at']
+
+            return web.json_response({'data': {'node': {
+                'id': variables['id'],
+                'status': 'COMPLETED' if completed else 'RUNNING',
+                'errorCode': None,
+                'objectCount': str(len(operation['results'])) if completed else '0',
+                'url': str(request.url.with_path(f"/{domain}/bulk/{operation['number']}.jsonl").with_query(None)) if completed else None,
+                'partialDataUrl': None,
+            }}})
+
+        return web.json_response({'errors': [{'message': 'Unsupported query'}]}, status=400)
+
+    def start_operation(self, results):
+        number = self.generate_id()
+        id = f'gid://shopify/BulkOperation/{number}'
+
+        self.operations[id] = {
+            'number': number,
+            'results': results,
+            'ready_at': time.monotonic() + self.BULK_DURATION,
+        }
+
+        return {'id': id, 'status': 'CREATED'}
+
+    def delete_product(self, product_id):
+        for variant in self.products.pop(product_id)['variants']:
+            self.variants.pop(variant['id'], None)
+            self.inventory_items.pop(variant['inventory_item_id'], None)
+
+    def variant_update(self, input):
+        variant = self.variants.get(int(input['id'].split('/')[-1]))
+
+        if not variant:
+            return {'productVariantUpdate': {
+                'productVariant': None,
+                'userErrors': [{'field': ['id'], 'message': 'Product variant does not exist'}],
+            }}
+
+        for key, field in [('price', 'price'), ('compare_at_price', 'compareAtPrice')]:
+            if field in input:
+                variant[key] = f'{float(input[field]):.2f}'
+
+        return {'productVariantUpdate': {
+            'productVariant': {
+                'id': input['id'],
+                'price': variant['price'],
+                'compareAtPrice': variant['compare_at_price'],
+            },
+            'userErrors': [],
+        }}
+
+    def inventory_set(self, input):
+        errors = []
+
+        for quantity in input['quantities']:
+            variant = self.inventory_items.get(int(quantity['inventoryItemId'].split('/')[-1]))
+
+            if not variant:
+                errors.append({'field': ['input', 'quantities'], 'message': 'The specified inventory item could not be found.'})
+                continue
+
+            variant['inventory_quantity'] = int(quantity['quantity'])
+
+        return {'inventorySetQuantities': {
+            'inventoryAdjustmentGroup': None if errors else {'id': f'gid://shopify/InventoryAdjustmentGroup/{self.generate_id()}'},
+            'userErrors': errors,
+        }}
+
+    async def staged_upload(self, request):
+        form = await request.post()
+
+        self.uploads[form['key']] = [json.loads(x) for x in form['file'].file.read().decode().splitlines() if x.strip()]
+
+        return web.Response(status=201)
+
+    async def bulk_results(self, request):
+        operation = self.operations.get(f"gid://shopify/BulkOperation/{request.match_info['operation_id']}")
+
+        if not operation:
+            return web.Response(status=404)
+
+        return web.Response(text=''.join(json.dumps(x) + '\n' for x in operation['results']), content_type='application/jsonl')
+
+    async def list_orders(self, request):
+        return web.json_response({'orders': self.orders[request.match_info['domain']]})
+
+    async def create_fulfillment(self, request):
+        return web.json_response({'fulfillment': {'id': self.generate_id()}}, status=201)
+
+    async def update_fulfillment(self, request):
+        return web.json_response({'fulfillment': {'id': int(request.match_info['fulfillment_id'])}})
+
+    def start(self, port):
+        """ Serve on a background thread, blocking calls of the services won't stall it """
+
+        ready = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+
+            runner = web.AppRunner(self.app())
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+
+    def calls_for(self, method=None):
+        return sum(count for (domain, verb, path), count in self.calls.items() if method in [None, verb])
@@ -0,0 +1,77 @@
+import getopt
+import inspect
+import json
+import os
+import sys
+import tempfile
+import time
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from loguru import logger
+from utils.Logging import Logging
+
+# Compares the per-message cost of reconfiguring loguru on every task
+# (the old Helpers.configure_logger) against binding the task context.
+
+SERVICE = 'ShopifyItemRepricer'
+DEVNULL = open(os.devnull, 'w')
+
+
+def legacy_configure_logger(user, directory):
+    """ Former Helpers.configure_logger, kept here as the baseline """
+
+    filename = os.path.splitext(os.path.basename(inspect.stack()[1][0].f_code.co_filename))[0]
+
+    return logger.configure(
+        handlers=[
+            {'sink': DEVNULL, 'format': filename + ' | <fg #fff>' + user + '</fg #fff> | {time:YYYY-MM-DD HH:mm:ss} | <level>{message}</level> <fg #444>@:{line}</fg #444>'},
+            {'sink': f'{directory}/{SERVICE}.log', 'rotation': '10 MB', 'format': filename + ' | <fg #fff>' + user + '</fg #fff> | {time:YYYY-MM-DD HH:mm:ss} | <level>{message}</level> <fg #444>@:{line}</fg #444>'},
+        ],
+    )
+
+
+def measure(iterations, prepare):
+    started_at = time.perf_counter()
+
+    for i in range(iterations):
+        prepare(f'user{i % 50}')
+        logger.debug("Making a request to Shopify API")
+
+    return (time.perf_counter() - started_at) / iterations * 1e6
+
+
+def main(iterations):
+    with tempfile.TemporaryDirectory() as directory:
+        before = measure(iterations, lambda user: legacy_configure_logger(user, directory))
+
+        # Console goes to devnull on both sides, the file sink is what matters here
+        Logging.setup(services=[SERVICE], directory=directory, stream=DEVNULL)
+
+        after = measure(iterations, lambda user: Logging.bind(service=SERVICE, user=user))
+
+        Logging.shutdown()
+
+    print(json.dumps({
+        'iterations': iterations,
+        'before_us_per_message': round(before, 2),
+        'after_us_per_message': round(after, 2),
+        'speedup': round(before / after, 1) if after else None,
+    }, indent=2))
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hn:', ['help', 'iterations='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    iterations = 2000
+    for o, a in opts:
+        if o in ("-n", "--iterations"):
+            iterations = int(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(iterations=iterations)
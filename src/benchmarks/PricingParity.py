@@ -0,0 +1,164 @@
+import asyncio
+import getopt
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Statsd and tracing are off in the benchmark environment
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from utils.Helpers import Helpers
+from utils.Pricing import Pricing
+
+from ShopifyItemRepricer import ShopifyItemRepricer
+
+# Diffs random catalogs under random formulas with utils/Pricing.py and with
+# ShopifyItemRepricer.compare_prices/compare_quantities, exits 1 if they disagree on any row
+# the vectorized pass decided itself.
+
+
+def random_formula(rng):
+    def margin(percent):
+        return rng.choice([
+            rng.randint(0, 100) if percent else rng.randint(-20, 20),
+            round(rng.uniform(0, 60), rng.choice([1, 2])) if percent else round(rng.uniform(-30, 30), 2),
+            rng.choice([0, 15, 33.3, 12.5, 7.5, 0.99, -5]),
+        ])
+
+    return {
+        'radioGroupShopifyPricing': rng.choice(['equal', 'percent', 'fixed']),
+        'shopifyPercentMargin': margin(True),
+        'shopifyFixedMargin': margin(False),
+        'radioGroupComparePricing': rng.choice(['equal', 'percent', 'fixed']),
+        'comparePercentMargin': margin(True),
+        'compareFixedMargin': margin(False),
+    }
+
+
+def random_rows(rng, size, formula):
+    """ Listings at the price the formula gives, drifted, or stored oddly, with their fba items """
+
+    rows = []
+
+    for i in range(size):
+        # Prices ending in 5 land on half cents under many margins
+        amazon_price = rng.choice([rng.randint(1, 200000), rng.randint(1, 4000) * 5, rng.randint(1, 100) * 25])
+        quantity = rng.randint(0, 30)
+
+        fba_item = {
+            '_id': i,
+            'pricing_info': {'amazon_price': amazon_price} if rng.random() > 0.02 else None,
+            'amazon_quantity': quantity,
+            'merchant_quantity': rng.choice([0, 0, 0, 2]),
+        }
+
+        if rng.random() < 0.01:
+            fba_item['pricing_info'] = {'amazon_price': rng.choice([0, -100, None])}
+
+        sale_price = Helpers.get_price_by_formula(item_price=amazon_price / 100.0, formula=formula, price_type='sale_price')
+        compare_at_price = Helpers.get_price_by_formula(item_price=sale_price, formula=formula, price_type='compare_at_price')
+
+        price = str(round(float(sale_price) * 100))
+        compare_at = str(round(float(compare_at_price) * 100))
+
+        if rng.random() < 0.3:
+            price = str(int(price) + rng.choice([-1, 1, 100]))
+
+        if rng.random() < 0.01:
+            price = rng.choice([f'{price}.0', int(price), ' ' + price])
+
+        shopify_item = {
+            '_id': i,
+            'fba_item_id': i,
+            'active': True,
+            'price': price,
+            'compare_at_price': compare_at,
+            'quantity': quantity if rng.random() > 0.2 else rng.choice([quantity + 1, str(quantity)]),
+        }
+
+        rows.append((shopify_item, fba_item))
+
+    return rows
+
+
+async def scalar(repricer, rows):
+    changed = []
+
+    for shopify_item, fba_item in rows:
+        price_update = await repricer.compare_prices(fba_item, shopify_item)
+        quantity_update = await repricer.compare_quantities(fba_item, shopify_item)
+
+        changed.append(bool(price_update or quantity_update))
+
+    return np.array(changed)
+
+
+def main(catalogs, size, seed):
+    # Missing prices are logged by the scalar path, only the disagreements are shown
+    logger.remove()
+    logger.add(sys.stderr, level='ERROR', filter=lambda record: record['extra'].get('parity'))
+
+    rng = random.Random(seed)
+    loop = asyncio.get_event_loop()
+
+    repricer = ShopifyItemRepricer()
+    report = {'catalogs': catalogs, 'rows': 0, 'changed': 0, 'undecided': 0, 'mismatches': 0, 'scalar_seconds': 0.0, 'vectorized_seconds': 0.0}
+
+    for _ in range(catalogs):
+        formula = random_formula(rng)
+        repricer.user = {'settings': {'shopify_pricing_formulas': formula}}
+
+        rows = random_rows(rng, size, formula)
+
+        started_at = time.perf_counter()
+        expected = loop.run_until_complete(scalar(repricer, rows))
+        report['scalar_seconds'] += time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        changed, undecided = Pricing.diff(rows, formula)
+        report['vectorized_seconds'] += time.perf_counter() - started_at
+
+        # Rows left to the scalar path can't be wrong, every other one must match it
+        mismatches = np.flatnonzero(~undecided & (changed != expected))
+
+        for i in mismatches[:5]:
+            logger.bind(parity=True).error("{formula} | {row} | expected {expected}", formula=formula, row=rows[i], expected=expected[i])
+
+        report['rows'] += len(rows)
+        report['changed'] += int(expected.sum())
+        report['undecided'] += int(undecided.sum())
+        report['mismatches'] += len(mismatches)
+
+    report['scalar_seconds'] = round(report['scalar_seconds'], 3)
+    report['vectorized_seconds'] = round(report['vectorized_seconds'], 3)
+    report['speedup'] = round(report['scalar_seconds'] / report['vectorized_seconds'], 1) if report['vectorized_seconds'] else None
+
+    print(json.dumps(report, indent=2))
+
+    if report['mismatches']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'catalogs=', 'size=', 'seed='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {'catalogs': 50, 'size': 2000, 'seed': 1}
+
+    for o, a in opts:
+        if o in ("--catalogs", "--size", "--seed"):
+            options[o[2:]] = int(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
@@ -0,0 +1,142 @@
+import asyncio
+import getopt
+import json
+import os
+import random
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Fakes are wired in through the benchmark environment of settings.yaml
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from yarl import URL
+from dynaconf import settings
+from utils.Database import Database
+
+from ShopifyCatalogReconciler import ShopifyCatalogReconciler
+from ShopifyItemRepricer import ShopifyItemRepricer
+
+from FakeShopify import FakeShopify
+from Seed import seed
+
+DB = Database.instance()
+
+# Deletes, edits and unpublishes part of a seeded catalog behind the app's back,
+# reconciles it and checks every listing against the fake shop, exits 1 on any
+# mismatch. A Reprice afterwards must not call Shopify for a deleted product.
+
+
+def drift(shopify, deleted, changed):
+    """ What the shop owner did in the admin, returns the ids of the deleted products """
+
+    product_ids = list(shopify.products)
+    random.shuffle(product_ids)
+
+    gone = set(product_ids[:int(len(product_ids) * deleted)])
+
+    for product_id in gone:
+        shopify.delete_product(product_id)
+
+    for product_id in product_ids[len(gone):len(gone) + int(len(product_ids) * changed)]:
+        product = shopify.products[product_id]
+        variant = product['variants'][0]
+
+        edit = random.choice(['price', 'quantity', 'unpublish'])
+
+        if edit == 'price':
+            variant['price'] = f"{float(variant['price']) + 1:.2f}"
+        elif edit == 'quantity':
+            variant['inventory_quantity'] += random.randint(1, 5)
+        else:
+            product['published_at'] = None
+
+    return gone
+
+
+def check(shopify, gone):
+    """ Listings that disagree with the shop """
+
+    mismatches = []
+
+    for listing in DB.ShopifyListings.find():
+        product = shopify.products.get(listing['shopify_item_id'])
+
+        if listing['shopify_item_id'] in gone:
+            if not listing.get('removed_at') or listing['active']:
+                mismatches.append(listing['_id'])
+            continue
+
+        variant = product['variants'][0]
+
+        if any([
+            listing.get('removed_at'),
+            listing['price'] != str(round(float(variant['price']) * 100)),
+            listing['quantity'] != variant['inventory_quantity'],
+            listing['active'] != bool(product['published_at']),
+        ]):
+            mismatches.append(listing['_id'])
+
+    return mismatches
+
+
+def main(listings, deleted, changed):
+    # Services are chatty, keep the benchmark output readable
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    shopify = FakeShopify(latency=0.01)
+    shopify.start(port=URL(settings.SHOPIFY.Endpoints.Products).port)
+
+    random.seed(1)
+    seed(DB, shopify, users=1, listings=listings, unlisted=0, orders=0, change_ratio=0)
+
+    gone = drift(shopify, deleted, changed)
+    user_id = DB.users.find_one()['_id']
+    loop = asyncio.get_event_loop()
+
+    started_at = time.perf_counter()
+    loop.run_until_complete(ShopifyCatalogReconciler().process({'task': 'Reconcile', 'user_id': user_id}))
+    elapsed = time.perf_counter() - started_at
+
+    mismatches = check(shopify, gone)
+
+    # Dead listings are out of the repricer's way
+    calls = shopify.calls_for()
+    loop.run_until_complete(ShopifyItemRepricer().process({'task': 'Reprice', 'user_id': user_id}))
+
+    print(json.dumps({
+        'listings': listings,
+        'deleted': len(gone),
+        'removed': DB.ShopifyListings.count_documents({'removed_at': {'$exists': True}}),
+        'changed': DB.ShopifyListings.count_documents({'reconciled_at': {'$exists': True}}),
+        'duration': round(elapsed, 3),
+        'mismatches': len(mismatches),
+        'reprice_calls': shopify.calls_for() - calls,
+        'reprice_not_found': shopify.not_found,
+    }, indent=2))
+
+    if mismatches or shopify.not_found:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'listings=', 'deleted=', 'changed='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {'listings': 2000, 'deleted': 0.05, 'changed': 0.1}
+
+    for o, a in opts:
+        if o == "--listings":
+            options['listings'] = int(a)
+        elif o in ("--deleted", "--changed"):
+            options[o[2:]] = float(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
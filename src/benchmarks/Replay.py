@@ -0,0 +1,233 @@
+import asyncio
+import getopt
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+from collections import Counter, defaultdict
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Fakes are wired in through the benchmark environment of settings.yaml
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from yarl import URL
+from dynaconf import settings
+from utils.Database import Database
+from utils.Queue import Queue
+from utils.Profiler import Profiler
+from utils.Memory import Memory
+from utils.Recorder import QUEUE
+
+from ShopifyDispatcher import create_services, create_callback
+
+from FakeShopify import FakeShopify
+from FakeMWS import FakeMWS
+from FakeBroker import FakeBroker
+from Report import percentile
+from Seed import reset, seed_user
+
+DB = Database.instance()
+
+
+def load(files):
+    """ Records of the recordings, oldest first """
+
+    records = []
+
+    for filename in files:
+        with open(filename) as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+
+    return sorted(records, key=lambda record: record['at'])
+
+
+def workload(records):
+    """ What every recorded queue needs in the database and from the fakes """
+
+    queues = defaultdict(lambda: {
+        'shape': {'listings': 0, 'unlisted': 0, 'orders': 0},
+        'listed_ids': set(),
+        'unlisted_ids': set(),
+        'reprices': 0,
+        'product_updates': 0,
+    })
+
+    for record in records:
+        queue = queues[record['queue']]
+
+        if record['type'] == 'shape':
+            queue['shape'] = record
+
+        if record['type'] == 'task':
+            payload = record['payload']
+
+            if payload.get('task') == 'List':
+                queue['unlisted_ids'].add(payload['fba_item_id'])
+
+            if payload.get('task') in ['Publish', 'Unpublish']:
+                queue['listed_ids'].add(payload['fba_item_id'])
+
+            if payload.get('task') == 'Reprice':
+                queue['reprices'] += 1
+
+        if record['type'] == 'shopify' and record['method'] == 'PUT' and re.search(r'/products/\d+\.json', record['url']):
+            queue['product_updates'] += 1
+
+    return queues
+
+
+def seed(queues, shopify):
+    reset(DB, shopify)
+
+    for name, queue in queues.items():
+        match = QUEUE.match(name)
+
+        if not match:
+            continue
+
+        shape = queue['shape']
+
+        # Share of the listings the recorded reprices actually changed
+        change_ratio = min(1.0, queue['product_updates'] / (shape['listings'] * queue['reprices'])) if shape['listings'] and queue['reprices'] else 0.1
+
+        seed_user(
+            DB,
+            shopify,
+            user_id=match.group(2),
+            domain=match.group(3) + '.myshopify.com',
+            listings=shape['listings'],
+            unlisted=shape['unlisted'],
+            orders=shape['orders'],
+            change_ratio=change_ratio,
+            # Items listed by a recorded List task start unlisted
+            listed_ids=queue['listed_ids'] - queue['unlisted_ids'],
+            unlisted_ids=queue['unlisted_ids'],
+        )
+
+
+def main(files, speed, concurrency, latency, mws_latency, output):
+    # Services are chatty, keep the replay output readable
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    records = load(files)
+    tasks = [x for x in records if x['type'] == 'task']
+
+    if not tasks:
+        return logger.error("No task found in {files}", files=', '.join(files))
+
+    recorded = {
+        'shopify': [x for x in records if x['type'] == 'shopify'],
+        'mws': [x for x in records if x['type'] == 'mws'],
+    }
+
+    # Recorded latencies unless given
+    if latency is None:
+        latency = statistics.median([x['elapsed'] for x in recorded['shopify']]) if recorded['shopify'] else 0.05
+
+    if mws_latency is None:
+        mws_latency = statistics.median([x['elapsed'] for x in recorded['mws']]) if recorded['mws'] else 0.2
+
+    shopify = FakeShopify(latency=latency)
+    shopify.start(port=URL(settings.SHOPIFY.Endpoints.Products).port)
+
+    mws = FakeMWS(latency=mws_latency)
+    mws.start(port=URL(settings.AMAZON.Api.Endpoint).port)
+
+    for record in recorded['mws']:
+        mws.responses[record['action']].append(record['body'])
+
+    queues = workload(records)
+    seed(queues, shopify)
+
+    broker = FakeBroker(concurrency=concurrency)
+    first_at = tasks[0]['at']
+
+    for record in tasks:
+        broker.put(record['queue'], record['payload'], at=record['at'] - first_at)
+
+    profiler, memory = Profiler(), Memory()
+
+    # Every queue gets its own services, like a dispatcher process per queue
+    def consumer(target):
+        queue = Queue(url=None)
+        queue.target = target
+
+        return queue, create_callback(create_services(), profiler, memory)
+
+    started_at = time.perf_counter()
+    durations = asyncio.get_event_loop().run_until_complete(broker.drain(consumer, speed=speed or None))
+    elapsed = time.perf_counter() - started_at
+
+    results = {
+        'config': {
+            'files': files,
+            'speed': speed or 'max',
+            'concurrency': concurrency,
+            'latency': latency,
+            'mws_latency': mws_latency,
+        },
+        'queues': len(queues),
+        'tasks': len(durations),
+        'tasks_per_type': Counter(x['payload'].get('task') for x in tasks),
+        'listings': sorted((x['shape']['listings'] for x in queues.values()), reverse=True)[:10],
+        'recorded_duration': round(tasks[-1]['at'] - first_at, 3),
+        'duration': round(elapsed, 3),
+        'task_latency_p50': round(percentile(durations, 0.5) or 0, 4),
+        'task_latency_p99': round(percentile(durations, 0.99) or 0, 4),
+        # Waiting for a free worker, the capacity being validated
+        'start_delay_p50': round(percentile(broker.lateness, 0.5) or 0, 4),
+        'start_delay_p99': round(percentile(broker.lateness, 0.99) or 0, 4),
+        'shopify_calls': shopify.calls_for(),
+        'shopify_calls_recorded': len(recorded['shopify']),
+        'shopify_throttled': shopify.throttled,
+        'mws_calls': mws.calls_for(),
+        'mws_calls_recorded': len(recorded['mws']),
+    }
+
+    print(json.dumps(results, indent=2))
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', [
+            'help', 'speed=', 'concurrency=', 'latency=', 'mws-latency=', 'output=',
+        ])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {
+        # 1 is real time, 10 ten times faster, 0 as fast as possible
+        'speed': 1.0,
+        'concurrency': settings.APP.ConsumerManager.GlobalProcessLimit,
+        'latency': None,
+        'mws_latency': None,
+        'output': None,
+    }
+
+    for o, a in opts:
+        if o == "--speed":
+            options['speed'] = float(a)
+        elif o == "--concurrency":
+            options['concurrency'] = int(a)
+        elif o == "--latency":
+            options['latency'] = float(a)
+        elif o == "--mws-latency":
+            options['mws_latency'] = float(a)
+        elif o == "--output":
+            options['output'] = a
+        else:
+            assert False, "Unhandled option"
+
+    # Recordings are the files of APP.Recording.Directory
+    main(files=args, **options)
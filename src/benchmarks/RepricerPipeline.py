@@ -0,0 +1,149 @@
+import asyncio
+import getopt
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Fakes are wired in through the benchmark environment of settings.yaml
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from yarl import URL
+from dynaconf import settings
+from utils.Database import Database
+from utils.RateBudget import RateBudget
+from utils.BulkOperation import BulkOperation
+
+from ShopifyItemRepricer import ShopifyItemRepricer
+
+from FakeShopify import FakeShopify
+from Seed import seed
+
+DB = Database.instance()
+
+# One big catalog repriced with an increasing number of concurrent revisions,
+# 1 is close to the former one request at a time loop. --bulk-threshold sends
+# the revisions of the chunks that have at least that many as bulk mutations.
+
+
+async def reprice(user_id):
+    """ Every chunk of a Reprice, the way the manager would hand them back """
+
+    service = ShopifyItemRepricer()
+    payload = {'task': 'Reprice', 'user_id': user_id}
+    chunks = 0
+
+    while payload:
+        payload = await service.process(payload)
+        chunks += 1
+
+    return chunks
+
+
+def revision_calls(shopify):
+    """ Product and variant updates plus inventory level sets """
+
+    return shopify.calls_for('PUT') + shopify.calls_for('POST')
+
+
+def run(shopify, workers, listings, change_ratio):
+    # Same catalog and drift for every run
+    random.seed(1)
+    seed(DB, shopify, users=1, listings=listings, unlisted=0, orders=0, change_ratio=change_ratio)
+
+    shopify.buckets.clear()
+    RateBudget.SHOPS.clear()
+    ShopifyItemRepricer.WORKERS = workers
+
+    user_id = DB.users.find_one()['_id']
+    calls, throttled, operations = revision_calls(shopify), shopify.throttled, len(shopify.operations)
+
+    tracemalloc.start()
+    started_at = time.perf_counter()
+
+    chunks = asyncio.get_event_loop().run_until_complete(reprice(user_id))
+
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    revisions = revision_calls(shopify) - calls
+
+    return {
+        'workers': workers,
+        'chunks': chunks,
+        'duration': round(elapsed, 3),
+        'listings_per_second': round(listings / elapsed, 2),
+        'revisions': revisions,
+        'revisions_per_second': round(revisions / elapsed, 2),
+        'throttled': shopify.throttled - throttled,
+        'bulk_operations': len(shopify.operations) - operations,
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+    }
+
+
+def main(workers, listings, change_ratio, latency, bucket_size, leak_rate, bulk_threshold):
+    # Services are chatty, keep the benchmark output readable
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    # Both sides of the bucket agree, like a shop on that plan
+    FakeShopify.BUCKET_SIZE = RateBudget.BUCKET_SIZE = bucket_size
+    FakeShopify.LEAK_RATE = RateBudget.LEAK_RATE = leak_rate
+
+    BulkOperation.THRESHOLD = bulk_threshold
+
+    shopify = FakeShopify(latency=latency)
+    shopify.start(port=URL(settings.SHOPIFY.Endpoints.Products).port)
+
+    print(json.dumps({
+        'config': {
+            'listings': listings,
+            'change_ratio': change_ratio,
+            'latency': latency,
+            'bucket_size': bucket_size,
+            'leak_rate': leak_rate,
+            'bulk_threshold': bulk_threshold,
+        },
+        'results': [run(shopify, x, listings, change_ratio) for x in workers],
+    }, indent=2))
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', [
+            'help', 'workers=', 'listings=', 'change-ratio=', 'latency=', 'bucket-size=', 'leak-rate=', 'bulk-threshold=',
+        ])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {
+        'workers': [1, 4, 8, 16],
+        'listings': 2000,
+        'change_ratio': 0.3,
+        # Round trip of a product update from a US datacenter
+        'latency': 0.15,
+        # Plus plans, standard ones are 40 and 2
+        'bucket_size': 80,
+        'leak_rate': 4,
+        # Every revision over REST
+        'bulk_threshold': 0,
+    }
+
+    for o, a in opts:
+        if o == "--workers":
+            options['workers'] = [int(x) for x in a.split(',')]
+        elif o in ("--listings", "--bucket-size", "--bulk-threshold"):
+            options[o[2:].replace('-', '_')] = int(a)
+        elif o in ("--change-ratio", "--latency", "--leak-rate"):
+            options[o[2:].replace('-', '_')] = float(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
@@ -0,0 +1,215 @@
+import asyncio
+import getopt
+import json
+import os
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Fakes are wired in through the benchmark environment of settings.yaml
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from yarl import URL
+from dynaconf import settings
+from utils.Database import Database
+from utils.Queue import Queue
+
+from ShopifyItemLister import ShopifyItemLister
+from ShopifyItemRepricer import ShopifyItemRepricer
+from ShopifyItemPublisher import ShopifyItemPublisher
+from ShopifyItemUnpublisher import ShopifyItemUnpublisher
+from ShopifyOrderFulfiller import ShopifyOrderFulfiller
+from ShopifyOrderTracker import ShopifyOrderTracker
+from ShopifyCatalogReconciler import ShopifyCatalogReconciler
+
+from FakeShopify import FakeShopify
+from FakeMWS import FakeMWS
+from FakeBroker import FakeBroker
+from Seed import seed
+from Report import percentile
+
+DB = Database.instance()
+
+SERVICES = ['List', 'Reprice', 'Publish', 'Unpublish', 'Fulfill', 'Track', 'Reconcile']
+
+
+def queue_name(user):
+    domain = user['settings']['shopify_creds']['domain'].split('.myshopify.com')[0]
+    return f"DEBUG::Shopify.{user['_id']}.{domain}"
+
+
+def enqueue(broker, task):
+    """ Publish the messages of the task, returns the number of items they cover """
+
+    items = 0
+
+    for user in DB.users.find():
+        target = queue_name(user)
+
+        if task == 'List':
+            fba_item_ids = {x['fba_item_id'] for x in DB.ShopifyListings.find({'user_id': user['_id']})}
+
+            for fba_item in DB.FbaItems.find({'user_id': user['_id'], '_id': {'$nin': list(fba_item_ids)}}):
+                broker.put(target, {'task': task, 'fba_item_id': fba_item['_id']})
+                items += 1
+
+        if task in ['Publish', 'Unpublish']:
+            for listing in DB.ShopifyListings.find({'user_id': user['_id']}):
+                broker.put(target, {'task': task, 'fba_item_id': listing['fba_item_id']})
+                items += 1
+
+        if task in ['Reprice', 'Reconcile']:
+            broker.put(target, {'task': task, 'user_id': user['_id']})
+            items += DB.ShopifyListings.count_documents({'user_id': user['_id'], 'active': True})
+
+        if task in ['Fulfill', 'Track']:
+            broker.put(target, {'task': task, 'user_id': user['_id']})
+            items += DB.ShopifySales.count_documents({'user_id': user['_id']})
+
+    return items
+
+
+async def run(task, broker, shopify, mws):
+    services = {
+        'List': ShopifyItemLister,
+        'Publish': ShopifyItemPublisher,
+        'Unpublish': ShopifyItemUnpublisher,
+        'Reprice': ShopifyItemRepricer,
+        'Fulfill': ShopifyOrderFulfiller,
+        'Track': ShopifyOrderTracker,
+        'Reconcile': ShopifyCatalogReconciler,
+    }
+
+    # Every queue gets its own service instance, like a dispatcher process per queue
+    def consumer(target):
+        queue = Queue(url=None)
+        queue.target = target
+
+        return queue, services[task]().process
+
+    items = enqueue(broker, task)
+
+    shopify_calls, mws_calls, throttled = shopify.calls_for(), mws.calls_for(), shopify.throttled
+    started_at = time.perf_counter()
+
+    durations = await broker.drain(consumer)
+    elapsed = time.perf_counter() - started_at
+
+    shopify_calls = shopify.calls_for() - shopify_calls
+    mws_calls = mws.calls_for() - mws_calls
+
+    return {
+        'tasks': len(durations),
+        'items': items,
+        'duration': round(elapsed, 3),
+        'items_per_second': round(items / elapsed, 2) if elapsed else None,
+        'task_latency_p50': round(percentile(durations, 0.5) or 0, 4),
+        'task_latency_p99': round(percentile(durations, 0.99) or 0, 4),
+        'shopify_calls': shopify_calls,
+        'shopify_throttled': shopify.throttled - throttled,
+        'mws_calls': mws_calls,
+        'api_calls_per_item': round((shopify_calls + mws_calls) / items, 3) if items else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Names of the services whose throughput dropped more than tolerance against the baseline """
+
+    regressions = []
+
+    for task, result in results['results'].items():
+        before = baseline.get('results', {}).get(task, {}).get('items_per_second')
+
+        if before and result['items_per_second'] is not None and result['items_per_second'] < before * (1 - tolerance):
+            regressions.append(task)
+
+    return regressions
+
+
+def main(tasks, users, listings, orders, latency, mws_latency, throttle, concurrency, output, baseline, tolerance):
+    # Services are chatty, keep the benchmark output readable
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    shopify = FakeShopify(latency=latency, throttle=throttle)
+    shopify.start(port=URL(settings.SHOPIFY.Endpoints.Products).port)
+
+    mws = FakeMWS(latency=mws_latency)
+    mws.start(port=URL(settings.AMAZON.Api.Endpoint).port)
+
+    config = {
+        'users': users,
+        'listings': listings,
+        'orders': orders,
+        'latency': latency,
+        'mws_latency': mws_latency,
+        'throttle': throttle,
+        'concurrency': concurrency,
+    }
+
+    results = {'config': config, 'results': {}}
+    loop = asyncio.get_event_loop()
+
+    for task in tasks:
+        # Same starting point for every service
+        seed(DB, shopify, users=users, listings=listings, unlisted=listings // 10 or 1, orders=orders, change_ratio=0.3)
+
+        results['results'][task] = loop.run_until_complete(run(task, FakeBroker(concurrency=concurrency), shopify, mws))
+        logger.warning("{task} | {result}", task=task, result=results['results'][task])
+
+    print(json.dumps(results, indent=2))
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        with open(baseline) as file:
+            regressions = compare(results, json.load(file), tolerance)
+
+        if regressions:
+            logger.error("Throughput regressed for {tasks}", tasks=', '.join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', [
+            'help', 'services=', 'users=', 'listings=', 'orders=', 'latency=', 'mws-latency=',
+            'throttle=', 'concurrency=', 'output=', 'baseline=', 'tolerance=',
+        ])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {
+        'tasks': SERVICES,
+        'users': 10,
+        'listings': 200,
+        'orders': 20,
+        'latency': 0.05,
+        'mws_latency': 0.2,
+        'throttle': 0.0,
+        'concurrency': 32,
+        'output': None,
+        'baseline': None,
+        'tolerance': 0.1,
+    }
+
+    for o, a in opts:
+        if o == "--services":
+            options['tasks'] = a.split(',')
+        elif o in ("--users", "--listings", "--orders", "--concurrency"):
+            options[o[2:]] = int(a)
+        elif o in ("--latency", "--throttle", "--tolerance"):
+            options[o[2:]] = float(a)
+        elif o == "--mws-latency":
+            options['mws_latency'] = float(a)
+        elif o in ("--output", "--baseline"):
+            options[o[2:]] = a
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
@@ -0,0 +1,137 @@
+import random
+
+from datetime import datetime
+
+
+def generate_id():
+    return '%024x' % random.randrange(16**24)
+
+
+def reset(db, shopify):
+    for collection in ['users', 'FbaItems', 'ShopifyListings', 'ShopifySales', 'EmailOutbox', 'EmailDigestItems', 'ShopifyCatalogSnapshots']:
+        db[collection].delete_many({})
+
+    shopify.products.clear()
+    shopify.orders.clear()
+
+
+def seed(db, shopify, users, listings, unlisted, orders, change_ratio):
+    """ Users with listed and unlisted FBA items, their Shopify products and sales """
+
+    reset(db, shopify)
+
+    for u in range(users):
+        seed_user(db, shopify, generate_id(), f'benchmark-{u}.myshopify.com', listings, unlisted, orders, change_ratio)
+
+
+def seed_user(db, shopify, user_id, domain, listings, unlisted, orders, change_ratio, listed_ids=(), unlisted_ids=()):
+    """ One user and their shop, FBA items take the given ids first so recorded tasks find them """
+
+    u = domain.split('.myshopify.com')[0]
+
+    db.users.insert_one({
+        '_id': user_id,
+        'emails': [{'address': f'seller-{u}@example.com'}],
+        'settings': {
+            'shopify_creds': {'domain': domain, 'token': f'token-{u}'},
+            'mws_creds': {'mws_merchant_id': f'MERCHANT-{u}', 'jl_mws_auth_token': f'amzn.mws.{u}'},
+            'shopify_settings': {'default_product_import_state': 'visible'},
+            'shopify_pricing_formulas': {'radioGroupShopifyPricing': 'percent', 'shopifyPercentMargin': 15, 'radioGroupComparePricing': 'percent', 'comparePercentMargin': 10},
+            'enable_email_notifications': True,
+        },
+    })
+
+    listed_ids, unlisted_ids = list(listed_ids), list(unlisted_ids)
+    listings, unlisted = max(listings, len(listed_ids)), max(unlisted, len(unlisted_ids))
+
+    listed = []
+    for i in range(listings + unlisted):
+        amazon_price = random.randint(500, 20000)
+        quantity = random.randint(0, 30)
+
+        if i < listings:
+            fba_item_id = listed_ids[i] if i < len(listed_ids) else generate_id()
+        else:
+            fba_item_id = unlisted_ids[i - listings] if i - listings < len(unlisted_ids) else generate_id()
+
+        fba_item = {
+            '_id': fba_item_id,
+            'user_id': user_id,
+            'title': f'Item {u}-{i}',
+            'description': f'Description of item {u}-{i}',
+            'seller_sku': f'SKU-{u}-{i}',
+            'asin': f'B0{i:08d}',
+            'pricing_info': {'amazon_price': amazon_price},
+            'amazon_quantity': quantity,
+            'merchant_quantity': 0,
+        }
+
+        db.FbaItems.insert_one(fba_item)
+
+        if i >= listings:
+            continue
+
+        # Listed at the price the formula gives, some of them drifted since
+        price = round(amazon_price / 100.0 * 1.15, 2)
+        compare_at_price = round(price * 1.10, 2)
+
+        if random.random() < change_ratio:
+            price = round(price * random.uniform(0.8, 1.2), 2)
+
+        product = shopify.add_product(domain, price, compare_at_price, quantity)
+
+        db.ShopifyListings.insert_one({
+            '_id': generate_id(),
+            'title': product['title'],
+            'shopify_item_id': product['id'],
+            'price': str(round(price * 100)),
+            'compare_at_price': str(round(compare_at_price * 100)),
+            'quantity': quantity,
+            'variant_id': product['variants'][0]['id'],
+            'inventory_item_id': product['variants'][0]['inventory_item_id'],
+            'fba_item_id': fba_item['_id'],
+            'seller_sku': fba_item['seller_sku'],
+            'asin': fba_item['asin'],
+            'user_id': user_id,
+            'handle': product['handle'],
+            'published_at': product['published_at'],
+            '_created_at': datetime.utcnow(),
+            'sold': 0,
+            'active': True,
+        })
+
+        listed.append((fba_item, product))
+
+    for o in range(orders):
+        if not listed:
+            break
+
+        fba_item, product = random.choice(listed)
+        order_id = shopify.generate_id()
+
+        shopify.orders[domain].append({'id': order_id})
+
+        db.ShopifySales.insert_one({
+            '_id': generate_id(),
+            'user_id': user_id,
+            'order_id': str(order_id),
+            'financial_status': 'paid',
+            'contact_email': 'buyer@example.com',
+            'customer': {
+                'address': {
+                    'shipping': {
+                        'name': 'Benchmark Buyer',
+                        'phone': '5555555555',
+                        'address1': '1 Main St',
+                        'address2': '',
+                        'city': 'Springfield',
+                        'province_code': 'IL',
+                        'country_code': 'US',
+                        'zip': '62701',
+                    },
+                },
+            },
+            'products': [{'product_id': product['id'], 'quantity': 1}],
+            # Half of them went through Amazon already and wait for tracking
+            **({'amazon_fid': str(order_id), 'shopify_fulfillment_id': shopify.generate_id()} if o % 2 else {}),
+        })
@@ -0,0 +1,398 @@
+import getopt
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Statsd and tracing are off in the benchmark environment
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+import psutil
+
+from loguru import logger
+from dynaconf import settings
+
+from ShopifyConsumerManager import ShopifyConsumerManager
+from Report import percentile
+
+# Like Queue.should_live, secs a dispatcher waits for work after its last task, and before its first one
+IDLE_AFTER_TASK = 10
+IDLE_AFTER_START = 60
+
+
+class SimulatedProcess:
+    """ A dispatcher as psutil sees it, exited ones stay zombies until reaped """
+
+    PIDS = itertools.count(1000)
+
+    def __init__(self, simulation, queue):
+        self.simulation = simulation
+        self.queue = queue
+        self.pid = next(self.PIDS)
+
+        self.state = 'starting'
+        self.running = 0
+        self.last_task_time = None
+        self.started_at = simulation.manager_time
+
+        # Bumped on every state change, stale idle checks are ignored
+        self.generation = 0
+
+    def status(self):
+        if self.state == 'exited':
+            return 'zombie'
+
+        # Dispatchers mostly wait on IO, only the busy ones are on the CPU
+        return 'running' if self.running else 'sleeping'
+
+    def cmdline(self):
+        if self.state == 'exited':
+            raise psutil.ZombieProcess(self.pid)
+
+        return ['python3.8', 'ShopifyDispatcher.py', f'--target={self.queue}']
+
+    def wait(self):
+        self.simulation.processes.remove(self)
+        self.simulation.by_queue[self.queue].remove(self)
+        self.simulation.stats['reaped'] += 1
+
+
+class SimulatedConsumerManager(ShopifyConsumerManager):
+    """ The real handle() with processes, spawning and sleeping done by the simulation """
+
+    def __init__(self, simulation, global_process_limit, consumer_per_queue):
+        super().__init__()
+
+        self.simulation = simulation
+        self.GLOBAL_PROCESS_LIMIT = global_process_limit
+        self.CONSUMER_PER_QUEUE = consumer_per_queue
+
+    def children(self):
+        # psutil reads /proc for every child, the manager pays for it on every message
+        self.simulation.manager_time += len(self.simulation.processes) * self.simulation.scan_cost
+
+        return list(self.simulation.processes)
+
+    def spawn(self, command, env):
+        return self.simulation.spawn(command[-1].split('=', 1)[1])
+
+
+class Simulation:
+    """ Discrete event simulation of the pending tasks queue, the manager and the dispatchers it spawns """
+
+    def __init__(self, queues, cycles, cron_period, burst, background_rate, duration, sigma, skew, startup, scan_cost, chunk, seed):
+        self.random = random.Random(seed)
+
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+
+        self.pending_tasks = deque()
+        self.user_queues = defaultdict(deque)
+        self.processes = []
+        self.by_queue = defaultdict(list)
+
+        # Dispatchers alive and those running a task
+        self.alive = 0
+        self.busy = 0
+
+        self.manager_busy = False
+        self.manager_busy_time = 0.0
+        self.ticking = False
+
+        # Clock of the manager while it handles a message, it runs ahead of the others when it blocks
+        self.manager_time = 0.0
+
+        self.duration, self.sigma, self.chunk = duration, sigma, chunk
+        self.startup, self.scan_cost = startup, scan_cost
+
+        self.stats = defaultdict(int)
+        self.delays = defaultdict(list)
+        self.peak_processes = 0
+        self.peak_busy = 0
+        self.peak_pending = 0
+        self.peak_scheduled = 0
+
+        self.queues = [f'DEBUG::Shopify.{index:024x}.simulated-{index}' for index in range(queues)]
+
+        # Few shops are huge, most are small, tasks take longer on the big ones
+        self.sizes = {queue: min(100.0, self.random.paretovariate(skew)) for queue in self.queues}
+
+        self.schedule_arrivals(cycles, cron_period, burst, background_rate)
+
+    def at(self, time, callback, *args):
+        heapq.heappush(self.events, (time, next(self.sequence), callback, args))
+
+    def schedule_arrivals(self, cycles, cron_period, burst, background_rate):
+        # Publisher crons go through every user within the burst
+        for cycle in range(cycles):
+            for queue in self.queues:
+                self.at(cycle * cron_period + self.random.uniform(0, burst), self.publish, queue)
+
+        # Webhooks and one-off tasks in between
+        time = 0.0
+        while background_rate and time < cycles * cron_period:
+            time += self.random.expovariate(background_rate)
+            self.at(time, self.publish, self.random.choice(self.queues))
+
+    def publish(self, queue):
+        """ ShopifyUserPublisher: the task to the user queue, its target to the pending tasks queue """
+
+        self.stats['published'] += 1
+
+        # When it was published, and the secs of work left for continuations of chunked tasks
+        self.user_queues[queue].append((self.now, None))
+
+        for process in self.consumers(queue):
+            self.start_tasks(process)
+
+        self.pending_tasks.append({'task': 'Reprice', 'target': queue})
+        self.peak_pending = max(self.peak_pending, len(self.pending_tasks))
+
+        self.wake_manager()
+
+    def wake_manager(self):
+        if not self.manager_busy and self.pending_tasks:
+            self.manager_busy = True
+            self.at(self.now, self.manage)
+
+    def manage(self):
+        payload = self.pending_tasks.popleft()
+        self.manager_time = self.now
+
+        # The process scans move the manager's clock forward, it takes the next message then
+        self.manager.handle(self.channel, SimpleNamespace(delivery_tag=self.stats['handled']), SimpleNamespace(headers={}), json.dumps(payload))
+        self.stats['handled'] += 1
+
+        self.peak_scheduled = max(self.peak_scheduled, len(self.manager.scheduler))
+
+        self.manager_busy_time += self.manager_time - self.now
+        self.at(self.manager_time, self.next_message)
+        self.start_ticking()
+
+    def next_message(self):
+        self.manager_busy = False
+        self.wake_manager()
+
+    def start_ticking(self):
+        if not self.ticking and len(self.manager.scheduler):
+            self.ticking = True
+            self.at(self.now + settings.APP.Scheduling.Interval, self.tick)
+
+    def tick(self):
+        """ The manager's timer, tasks held by the scheduler go as capacity frees up """
+
+        self.ticking = False
+        self.manager_time = self.now
+
+        self.manager.schedule(self.channel)
+
+        self.manager_busy_time += self.manager_time - self.now
+        self.start_ticking()
+
+    def requeue(self, exchange, routing_key, body, properties):
+        """ The manager publishing the rest of a chunked task to its user queue """
+
+        self.user_queues[routing_key].append((self.now, json.loads(body)['remaining']))
+
+        for process in self.consumers(routing_key):
+            self.start_tasks(process)
+
+    def spawn(self, queue):
+        # Popen reaps the exited children of the previous Popen calls first
+        for process in [x for x in self.processes if x.state == 'exited']:
+            process.wait()
+
+        process = SimulatedProcess(self, queue)
+
+        self.processes.append(process)
+        self.by_queue[queue].append(process)
+        self.stats['spawns'] += 1
+
+        self.alive += 1
+        self.peak_processes = max(self.peak_processes, self.alive)
+
+        self.at(self.manager_time + max(0.1, self.random.gauss(self.startup, self.startup / 5)), self.ready, process)
+
+        return process
+
+    def consumers(self, queue):
+        return [x for x in self.by_queue[queue] if x.state == 'consuming']
+
+    def ready(self, process):
+        # Exclusive consumer, a second dispatcher on the queue gives up right away
+        if self.consumers(process.queue):
+            self.stats['exclusive_failures'] += 1
+            return self.exit(process)
+
+        process.state = 'consuming'
+        self.start_tasks(process)
+        self.idle_check(process)
+
+    def start_tasks(self, process):
+        # Dispatchers run every message of their queue at once
+        while self.user_queues[process.queue]:
+            published_at, duration = self.user_queues[process.queue].popleft()
+
+            # Continuations aren't new work, the delay counts until the task first started
+            if duration is None:
+                self.delays[process.queue].append(self.now - published_at)
+                duration = self.random.lognormvariate(0, self.sigma) * self.duration * self.sizes[process.queue]
+
+            if not process.running:
+                self.busy += 1
+
+            process.running += 1
+            process.generation += 1
+
+            # A chunked task stops after its slice and hands the rest back to the manager
+            remaining = duration - self.chunk if self.chunk and duration > self.chunk else 0.0
+
+            self.at(self.now + duration - remaining, self.finish, process, remaining)
+
+        self.peak_busy = max(self.peak_busy, self.busy)
+
+    def finish(self, process, remaining=0.0):
+        process.running -= 1
+        process.last_task_time = self.now
+
+        if remaining:
+            self.stats['chunks'] += 1
+            self.pending_tasks.append({'task': 'Reprice', 'target': process.queue, 'payload': {'task': 'Reprice', 'remaining': remaining}})
+            self.wake_manager()
+        else:
+            self.stats['tasks'] += 1
+
+        if not process.running:
+            self.busy -= 1
+            self.idle_check(process)
+
+    def idle_check(self, process):
+        process.generation += 1
+        since = process.last_task_time if process.last_task_time is not None else process.started_at
+        timeout = IDLE_AFTER_TASK if process.last_task_time is not None else IDLE_AFTER_START
+
+        self.at(since + timeout, self.maybe_exit, process, process.generation)
+
+    def maybe_exit(self, process, generation):
+        if process.generation == generation and not process.running and process.state == 'consuming':
+            self.exit(process)
+
+    def exit(self, process):
+        # Zombie until the next Popen or the manager's cleanup reaps it
+        process.state = 'exited'
+        self.alive -= 1
+
+    def run(self, global_process_limit, consumer_per_queue):
+        self.manager = SimulatedConsumerManager(self, global_process_limit, consumer_per_queue)
+        self.channel = SimpleNamespace(basic_ack=lambda tag: None, basic_publish=self.requeue)
+
+        while self.events:
+            time, _, callback, args = heapq.heappop(self.events)
+
+            self.now = time
+            callback(*args)
+
+        return self.report()
+
+    def report(self):
+        delays = [delay for queue in self.delays.values() for delay in queue]
+
+        # Jain's index of the mean start delay per queue, 1.0 is every queue waiting alike
+        means = [sum(x) / len(x) for x in self.delays.values() if x]
+        fairness = sum(means) ** 2 / (len(means) * sum(x ** 2 for x in means)) if means and any(means) else 1.0
+
+        return {
+            'simulated_duration': round(self.now, 1),
+            'published': self.stats['published'],
+            'tasks': self.stats['tasks'],
+            'chunks': self.stats['chunks'],
+            'spawns': self.stats['spawns'],
+            'spawns_per_minute': round(self.stats['spawns'] / self.now * 60, 2) if self.now else None,
+            # Scheduling rounds stopped by the process limit
+            'rejections': self.manager.counters['rejections'],
+            'exclusive_failures': self.stats['exclusive_failures'],
+            'zombies_reaped': self.stats['reaped'],
+            'peak_processes': self.peak_processes,
+            'peak_busy_processes': self.peak_busy,
+            'peak_pending_tasks': self.peak_pending,
+            'peak_scheduled_tasks': self.peak_scheduled,
+            'manager_busy_share': round(self.manager_busy_time / self.now, 3) if self.now else None,
+            'start_delay_p50': round(percentile(delays, 0.5) or 0, 3),
+            'start_delay_p99': round(percentile(delays, 0.99) or 0, 3),
+            'start_delay_max': round(max(delays, default=0), 3),
+            'fairness': round(fairness, 3),
+            # Tasks left in a user queue whose consumer went away after the manager skipped the spawn
+            'stranded_tasks': sum(len(x) for x in self.user_queues.values()),
+        }
+
+
+def main(limits, per_queue, **options):
+    # Every rejection is logged by the manager
+    logger.remove()
+    logger.add(sys.stderr, level='ERROR')
+
+    results = []
+
+    for limit in limits:
+        # Same arrivals and durations for every policy
+        simulation = Simulation(**options)
+
+        results.append({
+            'global_process_limit': limit,
+            'consumer_per_queue': per_queue,
+            **simulation.run(global_process_limit=limit, consumer_per_queue=per_queue),
+        })
+
+    print(json.dumps({'config': options, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', [
+            'help', 'limits=', 'per-queue=', 'queues=', 'cycles=', 'cron-period=', 'burst=', 'background-rate=',
+            'duration=', 'sigma=', 'skew=', 'startup=', 'scan-cost=', 'chunk=', 'seed=',
+        ])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {
+        'limits': [settings.APP.ConsumerManager.GlobalProcessLimit],
+        'per_queue': settings.APP.ConsumerManager.ConsumerPerQueue,
+        'queues': 5000,
+        'cycles': 2,
+        'cron_period': 900.0,
+        'burst': 30.0,
+        # Messages per second besides the crons
+        'background_rate': 0.5,
+        # Task duration of a typical shop in secs, lognormal spread, pareto shape of shop sizes
+        'duration': 20.0,
+        'sigma': 0.5,
+        'skew': 1.5,
+        # Secs from Popen until a dispatcher consumes, secs psutil takes per child
+        'startup': 1.5,
+        'scan_cost': 0.0002,
+        # Secs of work per slice of a chunked task, 0 runs tasks whole
+        'chunk': 0.0,
+        'seed': 1,
+    }
+
+    for o, a in opts:
+        if o == "--limits":
+            options['limits'] = [int(x) for x in a.split(',')]
+        elif o in ("--per-queue", "--queues", "--cycles", "--seed"):
+            options[o[2:].replace('-', '_')] = int(a)
+        elif o in ("--cron-period", "--burst", "--background-rate", "--duration", "--sigma", "--skew", "--startup", "--scan-cost", "--chunk"):
+            options[o[2:].replace('-', '_')] = float(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
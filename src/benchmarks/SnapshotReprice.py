@@ -0,0 +1,126 @@
+import asyncio
+import getopt
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# Fakes are wired in through the benchmark environment of settings.yaml
+os.environ.setdefault('ENV_FOR_DYNACONF', 'benchmark')
+
+from loguru import logger
+from yarl import URL
+from dynaconf import settings
+from utils.Database import Database
+from utils.RateBudget import RateBudget
+from utils.CatalogSnapshot import CatalogSnapshot
+
+from ShopifyItemRepricer import ShopifyItemRepricer
+
+from FakeShopify import FakeShopify
+from Seed import seed
+
+DB = Database.instance()
+
+# Reprices a catalog once to build its snapshot, then again with nothing changed
+# with and without the snapshot, and with some fba items changed, which only
+# patches their rows into it, a chunk of them at a time when they don't fit in one. A run with the patched snapshot and one without it
+# afterwards must find nothing left to revise, exits 1 if not.
+
+
+async def reprice(user_id):
+    service = ShopifyItemRepricer()
+    payload = {'task': 'Reprice', 'user_id': user_id}
+
+    while payload:
+        payload = await service.process(payload)
+
+
+def run(shopify, user_id, snapshots):
+    CatalogSnapshot.ENABLED = snapshots
+
+    calls = shopify.calls_for()
+
+    tracemalloc.start()
+    started_at = time.perf_counter()
+
+    asyncio.get_event_loop().run_until_complete(reprice(user_id))
+
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'snapshots': snapshots,
+        'duration': round(elapsed, 3),
+        'calls': shopify.calls_for() - calls,
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+    }
+
+
+def change(count):
+    """ New Amazon prices for some of the listed fba items """
+
+    fba_item_ids = [x['fba_item_id'] for x in DB.ShopifyListings.find({}, {'fba_item_id': 1})]
+
+    for fba_item_id in random.sample(fba_item_ids, count):
+        DB.FbaItems.update_one({'_id': fba_item_id}, {'$inc': {'pricing_info.amazon_price': 100}})
+
+
+def main(listings, changed):
+    # Services are chatty, keep the benchmark output readable
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    shopify = FakeShopify(latency=0.01)
+    shopify.start(port=URL(settings.SHOPIFY.Endpoints.Products).port)
+
+    # Calls aren't what's measured here
+    FakeShopify.BUCKET_SIZE = RateBudget.BUCKET_SIZE = 10000
+    FakeShopify.LEAK_RATE = RateBudget.LEAK_RATE = 10000
+
+    random.seed(1)
+    seed(DB, shopify, users=1, listings=listings, unlisted=0, orders=0, change_ratio=0.3)
+
+    # Every change is sent right away, a held one would be looked at again on purpose
+    user_id = DB.users.find_one()['_id']
+    DB.users.update_one({'_id': user_id}, {'$set': {'settings.shopify_repricing_thresholds': {
+        'priceAbsolute': 0, 'pricePercent': 0, 'quantityAbsolute': 0, 'quantityPercent': 0, 'minInterval': 0,
+    }}})
+
+    results = {'first': run(shopify, user_id, True)}
+
+    results['unchanged'] = [run(shopify, user_id, False), run(shopify, user_id, True)]
+
+    change(changed)
+    results['changed'] = run(shopify, user_id, True)
+    results['patched'] = run(shopify, user_id, True)
+    results['left_over'] = run(shopify, user_id, False)
+
+    print(json.dumps({'listings': listings, 'changed': changed, 'results': results}, indent=2))
+
+    # Changed listings may go out in a few bulk operations, a call each isn't expected
+    if results['patched']['calls'] or results['left_over']['calls'] or not results['changed']['calls']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'listings=', 'changed='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    options = {'listings': 5000, 'changed': 50}
+
+    for o, a in opts:
+        if o in ("--listings", "--changed"):
+            options[o[2:]] = int(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(**options)
@@ -0,0 +1,59 @@
+import getopt
+import json
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from utils.Health import Health
+
+# Live stats of the manager and every dispatcher of the host, from their health sockets.
+# Exits 1 when the manager doesn't answer, so supervisor/cron checks can use it.
+
+
+def seconds(value):
+    return f'{value}s' if value is not None else '-'
+
+
+def main(as_json):
+    stats = Health.query_all()
+
+    if as_json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"{'process':<24} {'queue':<48} {'running':>8} {'backlog':>8} {'lag':>8} {'idle':>8}")
+
+        for process in stats:
+            queue = process.get('queue', {})
+
+            print("{name:<24} {target:<48} {running:>8} {backlog:>8} {lag:>8} {idle:>8}".format(
+                name=process['name'],
+                target=str(queue.get('target') or '-')[:48],
+                running=' '.join(f'{task}:{count}' for task, count in queue.get('running_by_task', {}).items()) or '0',
+                backlog=queue.get('backlog') if queue.get('backlog') is not None else '-',
+                lag=seconds(process.get('loop_lag', {}).get('last')),
+                idle=seconds(queue.get('idle_for')),
+            ))
+
+            if manager := process.get('manager'):
+                print(f"  {json.dumps(manager)}")
+
+    if not any(x['name'] == 'manager' for x in stats):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hj', ['help', 'json'])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    as_json = False
+    for o, a in opts:
+        if o in ("-j", "--json"):
+            as_json = True
+        else:
+            assert False, "Unhandled option"
+
+    main(as_json=as_json)
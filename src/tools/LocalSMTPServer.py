@@ -0,0 +1,103 @@
+import asyncio
+import getopt
+import sys
+import time
+
+from loguru import logger
+
+# Point EMAILS.Info.Host at this server to exercise ShopifyEmailSender locally.
+# It accepts every message, stores nothing and reports the throughput.
+
+
+class LocalSMTPServer:
+
+    def __init__(self, latency=0):
+        # Artificial delay per accepted message, in seconds
+        self.latency = latency
+
+        self.received = 0
+        self.connections = 0
+        self.first_message_at = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 localhost JoeLister SMTP stand-in")
+
+        while True:
+            line = await reader.readline()
+
+            if not line:
+                break
+
+            command = line.decode(errors='ignore').strip().upper()
+
+            if command.startswith(('EHLO', 'HELO')):
+                await reply("250 localhost")
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                await reply("250 OK")
+            elif command.startswith('DATA'):
+                await reply("354 End data with <CR><LF>.<CR><LF>")
+
+                while (await reader.readline()).rstrip(b'\r\n') != b'.':
+                    pass
+
+                await asyncio.sleep(self.latency)
+                self.accept()
+
+                await reply("250 OK queued")
+            elif command.startswith('QUIT'):
+                await reply("221 Bye")
+                break
+            else:
+                await reply("502 Command not implemented")
+
+        writer.close()
+
+    def accept(self):
+        now = time.time()
+
+        if not self.first_message_at:
+            self.first_message_at = now
+
+        self.received += 1
+
+        if self.received % 100 == 0:
+            logger.info(
+                "{received} message(s) over {connections} connection(s), {rate:.1f}/s",
+                received=self.received,
+                connections=self.connections,
+                rate=self.received / max(now - self.first_message_at, 0.001),
+            )
+
+
+async def main(port, latency):
+    server = LocalSMTPServer(latency=latency)
+
+    listener = await asyncio.start_server(server.handle, host='127.0.0.1', port=port)
+    logger.info("Listening on 127.0.0.1:{port}", port=port)
+
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hp:l:', ['help', 'port=', 'latency='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    port, latency = 2525, 0
+    for o, a in opts:
+        if o in ("-p", "--port"):
+            port = int(a)
+        elif o in ("-l", "--latency"):
+            latency = float(a)
+        else:
+            assert False, "Unhandled option"
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(port=port, latency=latency))
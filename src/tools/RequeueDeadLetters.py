@@ -0,0 +1,78 @@
+import getopt
+import json
+import os
+import sys
+import pika
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from loguru import logger
+from dynaconf import settings
+from utils.Tracing import Tracing
+from utils.Priority import Priority
+
+# Lists the tasks that ran out of attempts, or sends them back to their user queues
+# with a fresh attempt counter once the cause is fixed.
+
+
+def main(requeue, task, limit):
+    connection = pika.BlockingConnection(pika.URLParameters(settings.QUEUE.RabbitMQ.URL))
+    channel = connection.channel()
+
+    count = channel.queue_declare(queue=settings.SHOPIFY.Queue.DeadLetters, durable=True).method.message_count
+
+    # Held unacked until the end, rejected ones would come right back otherwise
+    skipped = []
+
+    for _ in range(min(count, limit) if limit else count):
+        method, properties, body = channel.basic_get(queue=settings.SHOPIFY.Queue.DeadLetters)
+
+        if not method:
+            break
+
+        letter = json.loads(body)
+
+        logger.info(
+            "{target} | {payload} | {attempts} attempt(s) | {error}",
+            target=letter['target'],
+            payload=letter['payload'],
+            attempts=letter['attempts'],
+            error=letter['error'],
+        )
+
+        if not requeue or (task and letter['payload'].get('task') != task):
+            skipped.append(method.delivery_tag)
+            continue
+
+        headers = Tracing.headers()
+
+        channel.basic_publish(exchange='', routing_key=letter['target'], body=json.dumps(letter['payload']), properties=pika.BasicProperties(headers=headers))
+        channel.basic_publish(exchange='', routing_key=settings.SHOPIFY.Queue.PendingTasks, body=json.dumps({'task': letter['payload'].get('task'), 'target': letter['target']}), properties=pika.BasicProperties(headers=headers, priority=Priority.level(letter['payload'].get('task'))))
+
+        channel.basic_ack(method.delivery_tag)
+
+    for delivery_tag in skipped:
+        channel.basic_nack(delivery_tag, requeue=True)
+
+    connection.close()
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hrt:l:', ['help', 'requeue', 'task=', 'limit='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    requeue, task, limit = False, None, 0
+    for o, a in opts:
+        if o in ("-r", "--requeue"):
+            requeue = True
+        elif o in ("-t", "--task"):
+            task = a
+        elif o in ("-l", "--limit"):
+            limit = int(a)
+        else:
+            assert False, "Unhandled option"
+
+    main(requeue=requeue, task=task, limit=limit)
@@ -0,0 +1,73 @@
+import getopt
+import socket
+import sys
+import time
+
+from collections import defaultdict
+
+# Point APP.Statsd at this listener to see what the services emit.
+# Prints every packet and an aggregate per stat every interval.
+
+
+def main(port, interval, quiet):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.bind(('127.0.0.1', port))
+    listener.settimeout(1)
+
+    print(f"Listening on 127.0.0.1:{port}")
+
+    stats = defaultdict(list)
+    reported_at = time.time()
+
+    while True:
+        try:
+            packet = listener.recv(65535).decode()
+        except socket.timeout:
+            packet = ''
+
+        # A packet may carry several metrics separated by new lines
+        for line in filter(None, packet.split('\n')):
+            if not quiet:
+                print(line)
+
+            name, _, rest = line.partition(':')
+            value, *flags = rest.split('|')
+            kind = flags[0] if flags else ''
+
+            # Sampled counters are scaled back up
+            rate = next((float(x[1:]) for x in flags[1:] if x.startswith('@')), 1)
+            stats[(name, kind)].append(float(value) / rate if kind == 'c' else float(value))
+
+        if time.time() - reported_at < interval:
+            continue
+
+        for (name, kind), values in sorted(stats.items()):
+            if kind == 'c':
+                print(f"{name:<70} count={sum(values):.0f} rate={sum(values) / interval:.2f}/s")
+            elif kind == 'ms':
+                values.sort()
+                print(f"{name:<70} n={len(values)} p50={values[len(values) // 2]:.1f}ms p99={values[int(len(values) * 0.99)]:.1f}ms")
+            else:
+                print(f"{name:<70} last={values[-1]}")
+
+        stats.clear()
+        reported_at = time.time()
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hp:i:q', ['help', 'port=', 'interval=', 'quiet'])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    port, interval, quiet = 8125, 10, False
+    for o, a in opts:
+        if o in ("-p", "--port"):
+            port = int(a)
+        elif o in ("-i", "--interval"):
+            interval = float(a)
+        elif o in ("-q", "--quiet"):
+            quiet = True
+        else:
+            assert False, "Unhandled option"
+
+    main(port=port, interval=interval, quiet=quiet)
@@ -0,0 +1,75 @@
+import getopt
+import json
+import os
+import sys
+
+from collections import defaultdict
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from dynaconf import settings
+
+# Latency breakdown of the spans recorded by utils/Tracing.py:
+# enqueue (publisher -> manager), spawn (Popen -> consumer ready),
+# queue_wait (publisher -> consumer) and processing (service run).
+# Tracing is off by default, see APP.Tracing of settings.yaml.
+
+STAGES = ['enqueue', 'spawn', 'queue_wait', 'processing']
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main(file, task):
+    durations = defaultdict(list)
+    traces = defaultdict(lambda: [None, None])
+
+    # Rotated spans first, a trace can start in one file and end in the other
+    files = [x for x in [f"{file}.1", file] if os.path.exists(x)]
+
+    for path in files:
+        with open(path) as spans:
+            for line in spans:
+                span = json.loads(line)
+
+                if task and span['attributes'].get('task') not in [None, task]:
+                    continue
+
+                durations[span['name']].append(span['duration'])
+
+                # End to end is from the earliest start to the latest end of the trace
+                trace = traces[span['trace_id']]
+                trace[0] = span['start'] if trace[0] is None else min(trace[0], span['start'])
+                trace[1] = span['end'] if trace[1] is None else max(trace[1], span['end'])
+
+    durations['end_to_end'] = [end - start for start, end in traces.values()]
+
+    print(f"{'stage':<12} {'count':>8} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}")
+
+    for name in STAGES + sorted(set(durations) - set(STAGES) - {'end_to_end'}) + ['end_to_end']:
+        values = sorted(durations.get(name, []))
+
+        if not values:
+            continue
+
+        print(f"{name:<12} {len(values):>8} {percentile(values, 0.5):>9.2f}s {percentile(values, 0.95):>9.2f}s {percentile(values, 0.99):>9.2f}s {values[-1]:>9.2f}s")
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hf:t:', ['help', 'file=', 'task='])
+    except getopt.GetoptError as err:
+        print(str(err))
+
+    file, task = settings.APP.Tracing.File, None
+    for o, a in opts:
+        if o in ("-f", "--file"):
+            file = a
+        elif o in ("-t", "--task"):
+            task = a
+        else:
+            assert False, "Unhandled option"
+
+    main(file=file, task=task)
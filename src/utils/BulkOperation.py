@@ -0,0 +1,209 @@
+import asyncio
+import aiohttp
+import json
+import os
+import tempfile
+import time
+
+from loguru import logger
+from dynaconf import settings
+from utils.Metrics import Metrics
+
+
+class BulkOperationError(Exception):
+    """ Bulk operation could not be submitted or did not complete """
+
+
+class BulkOperation:
+    """ Shopify GraphQL bulk operations, mutations send a JSONL file of inputs, both kinds return a JSONL file of results """
+
+    # Revisions of a run from which they are sent as bulk mutations instead of one REST call each, 0 never does
+    THRESHOLD = settings.SHOPIFY.Bulk.Threshold
+
+    # Secs between two status checks and until a running operation is given up on
+    POLL_INTERVAL = settings.SHOPIFY.Bulk.PollInterval
+    TIMEOUT = settings.SHOPIFY.Bulk.Timeout
+
+    # One mutation per operation, every line of the file holds its variables
+    MUTATIONS = {
+        'VariantPrices': """
+            mutation call($input: ProductVariantInput!) {
+                productVariantUpdate(input: $input) {
+                    productVariant { id price compareAtPrice }
+                    userErrors { field message }
+                }
+            }
+        """,
+        'InventoryLevels': """
+            mutation call($input: InventorySetQuantitiesInput!) {
+                inventorySetQuantities(input: $input) {
+                    inventoryAdjustmentGroup { id }
+                    userErrors { field message }
+                }
+            }
+        """,
+    }
+
+    FINISHED = ['COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED']
+
+    def gid(resource, id):
+        return f"gid://shopify/{resource}/{id}"
+
+    def id_of(gid):
+        """ REST id of a GraphQL global id """
+
+        return int(gid.rsplit('/', 1)[-1])
+
+    async def graphql(session, domain, query, variables=None):
+        """ Data of a GraphQL call, raises on errors """
+
+        request = await session.post(
+            url=settings.SHOPIFY.Endpoints.GraphQL.format(domain=domain),
+            json={'query': query, 'variables': variables or {}},
+        )
+
+        try:
+            response = await request.json()
+        except aiohttp.client_exceptions.ContentTypeError as e:
+            raise BulkOperationError(f"{request.status} Status Code | {e}")
+
+        if request.status != 200 or response.get('errors'):
+            raise BulkOperationError(f"{request.status} Status Code | {response.get('errors')}")
+
+        return response['data']
+
+    async def upload(session, domain, path):
+        """ Staged upload of the variables file, its path for the mutation """
+
+        data = await BulkOperation.graphql(session, domain, """
+            mutation {
+                stagedUploadsCreate(input: {resource: BULK_MUTATION_VARIABLES, filename: "variables.jsonl", mimeType: "text/jsonl", httpMethod: POST}) {
+                    stagedTargets { url resourceUrl parameters { name value } }
+                    userErrors { field message }
+                }
+            }
+        """)
+
+        if data['stagedUploadsCreate']['userErrors']:
+            raise BulkOperationError(data['stagedUploadsCreate']['userErrors'])
+
+        target = data['stagedUploadsCreate']['stagedTargets'][0]
+        parameters = {x['name']: x['value'] for x in target['parameters']}
+
+        form = aiohttp.FormData()
+
+        for name, value in parameters.items():
+            form.add_field(name, value)
+
+        # Storage doesn't get the shop's token, the file goes last
+        async with aiohttp.ClientSession() as storage:
+            with open(path, 'rb') as file:
+                form.add_field('file', file, filename='variables.jsonl', content_type='text/jsonl')
+
+                async with storage.post(target['url'], data=form) as request:
+                    if request.status >= 300:
+                        raise BulkOperationError(f"{request.status} Status Code | Staged upload failed")
+
+        return parameters['key']
+
+    async def wait(session, domain, operation_id):
+        """ Polls the operation until it's over, returns it """
+
+        started_at = time.monotonic()
+
+        while True:
+            data = await BulkOperation.graphql(session, domain, """
+                query call($id: ID!) {
+                    node(id: $id) {
+                        ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+                    }
+                }
+            """, {'id': operation_id})
+
+            operation = data['node']
+
+            if operation['status'] in BulkOperation.FINISHED:
+                Metrics.timing("shopify.bulk.duration", (time.monotonic() - started_at) * 1000, rate=1)
+                return operation
+
+            if time.monotonic() - started_at > BulkOperation.TIMEOUT:
+                raise BulkOperationError(f"{operation_id} | Still {operation['status']} after {BulkOperation.TIMEOUT} secs")
+
+            await asyncio.sleep(BulkOperation.POLL_INTERVAL)
+
+    async def results(url):
+        """ Lines of the results file one at a time, the file is never held in memory """
+
+        if not url:
+            return
+
+        async with aiohttp.ClientSession() as storage:
+            async with storage.get(url) as request:
+                async for line in request.content:
+                    if line.strip():
+                        yield json.loads(line)
+
+    async def mutate(session, domain, name, lines):
+        """ Runs a bulk mutation over the variables of every line, yields its results with the line they belong to """
+
+        file, path = tempfile.mkstemp(suffix='.jsonl')
+
+        try:
+            with os.fdopen(file, 'w') as variables:
+                for line in lines:
+                    variables.write(json.dumps(line) + "\n")
+
+            staged_upload_path = await BulkOperation.upload(session, domain, path)
+        finally:
+            os.remove(path)
+
+        data = await BulkOperation.graphql(session, domain, """
+            mutation call($mutation: String!, $stagedUploadPath: String!) {
+                bulkOperationRunMutation(mutation: $mutation, stagedUploadPath: $stagedUploadPath) {
+                    bulkOperation { id status }
+                    userErrors { field message }
+                }
+            }
+        """, {'mutation': BulkOperation.MUTATIONS[name], 'stagedUploadPath': staged_upload_path})
+
+        if data['bulkOperationRunMutation']['userErrors']:
+            raise BulkOperationError(data['bulkOperationRunMutation']['userErrors'])
+
+        operation = await BulkOperation.wait(session, domain, data['bulkOperationRunMutation']['bulkOperation']['id'])
+
+        logger.debug("{name} | Bulk operation {status} with {count} object(s)", name=name, status=operation['status'], count=operation['objectCount'])
+        Metrics.incr(f"shopify.bulk.{operation['status'].lower()}", rate=1)
+
+        # Lines of a failed one that went through are in the partial data
+        async for result in BulkOperation.results(operation['url'] or operation['partialDataUrl']):
+            yield result['__lineNumber'], result.get('data') or {}
+
+        if operation['status'] != 'COMPLETED':
+            raise BulkOperationError(f"{operation['id']} | {operation['status']} {operation['errorCode']}")
+
+    async def query(session, domain, query):
+        """ Runs a bulk query, yields the objects of its export one at a time """
+
+        data = await BulkOperation.graphql(session, domain, """
+            mutation call($query: String!) {
+                bulkOperationRunQuery(query: $query) {
+                    bulkOperation { id status }
+                    userErrors { field message }
+                }
+            }
+        """, {'query': query})
+
+        if data['bulkOperationRunQuery']['userErrors']:
+            raise BulkOperationError(data['bulkOperationRunQuery']['userErrors'])
+
+        operation = await BulkOperation.wait(session, domain, data['bulkOperationRunQuery']['bulkOperation']['id'])
+
+        logger.debug("Bulk query {status} with {count} object(s)", status=operation['status'], count=operation['objectCount'])
+        Metrics.incr(f"shopify.bulk.{operation['status'].lower()}", rate=1)
+
+        # Part of an export can't tell what's missing from the shop
+        if operation['status'] != 'COMPLETED':
+            raise BulkOperationError(f"{operation['id']} | {operation['status']} {operation['errorCode']}")
+
+        async for line in BulkOperation.results(operation['url']):
+            yield line
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import time
+import numpy as np
+
+from datetime import datetime, timedelta
+from dynaconf import settings
+from utils.Database import Database
+from utils.Helpers import Helpers
+from utils.Pricing import Pricing
+
+# Get DB instance
+DB = Database.instance()
+
+
+class CatalogSnapshot:
+    """ Last applied price, compare at price and quantity of every active listing of a user, with a hash of what they were computed from """
+    """ Kept as binary columns in Mongo, a Reprice only reads the listings whose hash no longer matches """
+
+    ENABLED = settings.APP.Repricer.Snapshots.Enabled
+
+    # Rows per Mongo document, documents can't be larger than 16MB
+    PART_SIZE = settings.APP.Repricer.Snapshots.PartSize
+
+    # Secs after which the snapshot is ignored and the whole catalog is read again
+    MAX_AGE = settings.APP.Repricer.Snapshots.MaxAge
+
+    # Fba items are written with updated_at by whatever changes their prices and quantities, only those changed are read
+    TRUST_UPDATED_AT = settings.APP.Repricer.Snapshots.TrustUpdatedAt
+
+    # Listings read at once while building
+    BATCH_SIZE = 1000
+
+    # What the repricer reads of both collections, the hash covers all of it
+    LISTING_FIELDS = {'fba_item_id': 1, 'price': 1, 'compare_at_price': 1, 'quantity': 1, 'active': 1}
+    FBA_ITEM_FIELDS = {'pricing_info': 1, 'sales_price': 1, 'amazon_price': 1, 'amazon_quantity': 1, 'merchant_quantity': 1}
+
+    COLUMNS = ['ids', 'fba_item_ids', 'price', 'compare_at_price', 'quantity', 'hash']
+
+    def formula_hash(formula):
+        return hashlib.md5(json.dumps(formula, sort_keys=True, default=str).encode()).hexdigest()
+
+    def fba_columns(fba_items):
+        """ Repricer inputs of the fba items as arrays, rows with values it handles in another way aren't valid """
+
+        prices, has_price, quantities, valid = [], [], [], []
+
+        for fba_item in fba_items:
+            amazon_price = Helpers.get_amazon_price(fba_item) if fba_item else None
+            quantity = (fba_item.get('amazon_quantity', 0), fba_item.get('merchant_quantity', 0)) if fba_item else (0, 0)
+
+            valid.append(bool(fba_item) and all(type(x) is int for x in quantity) and (
+                not fba_item.get('pricing_info') or (Pricing.number(amazon_price) and amazon_price > 0)
+            ))
+
+            prices.append(amazon_price if Pricing.number(amazon_price) else 0)
+            has_price.append(bool(fba_item and fba_item.get('pricing_info')))
+            quantities.append(quantity if all(type(x) is int for x in quantity) else (0, 0))
+
+        return {
+            'amazon_price': np.array(prices, dtype=np.float64),
+            'has_price': np.array(has_price, dtype=np.int64),
+            'quantity': np.array(quantities, dtype=np.int64).reshape(len(valid), 2),
+            'valid': np.array(valid, dtype=bool),
+        }
+
+    def hashes(fba, price, compare_at_price, quantity):
+        """ FNV-1a over the words of every row, 0 is left for the rows that always need a look """
+
+        words = [
+            fba['amazon_price'].view(np.uint64),
+            fba['has_price'].view(np.uint64),
+            fba['quantity'][:, 0].copy().view(np.uint64),
+            fba['quantity'][:, 1].copy().view(np.uint64),
+            price.view(np.uint64),
+            compare_at_price.view(np.uint64),
+            quantity.view(np.uint64),
+        ]
+
+        hashes = np.full(len(price), 0xcbf29ce484222325, dtype=np.uint64)
+
+        for word in words:
+            hashes ^= word
+            hashes *= np.uint64(0x100000001b3)
+
+        return hashes | np.uint64(1)
+
+    async def build(user, unchanged):
+        """ Snapshot of the listings as they are now, rows the repricer would still revise get a 0 hash """
+        """ unchanged(shopify_item, fba_item) decides the rows too close to call for utils/Pricing.py """
+
+        built_at = datetime.utcnow()
+        formula = user['settings'].get('shopify_pricing_formulas', {})
+        columns = {x: [] for x in CatalogSnapshot.COLUMNS}
+
+        listings = DB.ShopifyListings.find({'user_id': user['_id'], 'active': True}, CatalogSnapshot.LISTING_FIELDS)
+        batch = []
+
+        for listing in listings:
+            batch.append(listing)
+
+            if len(batch) == CatalogSnapshot.BATCH_SIZE:
+                await CatalogSnapshot.add_rows(columns, batch, formula, unchanged)
+                batch = []
+
+        await CatalogSnapshot.add_rows(columns, batch, formula, unchanged)
+
+        # Catalog without active listings still gets one, nothing to read until something is listed
+        empty = {'ids': 'S1', 'fba_item_ids': 'S1', 'hash': np.uint64}
+
+        CatalogSnapshot.save(user['_id'], {
+            key: np.concatenate(value) if value else np.array([], dtype=empty.get(key, np.int64))
+            for key, value in columns.items()
+        }, CatalogSnapshot.formula_hash(formula), built_at)
+
+    async def add_rows(columns, listings, formula, unchanged):
+        if not listings:
+            return
+
+        fba_items = {x['_id']: x for x in DB.FbaItems.find({'_id': {'$in': [x['fba_item_id'] for x in listings]}}, CatalogSnapshot.FBA_ITEM_FIELDS)}
+        rows = [(x, fba_items.get(x['fba_item_id'])) for x in listings]
+
+        # Listings the repricer would change, or that only the one by one path decides, are never skipped
+        changed, undecided = Pricing.diff(rows, formula)
+
+        fba = CatalogSnapshot.fba_columns([x[1] for x in rows])
+        price = Pricing.stored_cents([x.get('price') for x in listings]).astype(np.int64)
+        compare_at_price = Pricing.stored_cents([x.get('compare_at_price') for x in listings]).astype(np.int64)
+        quantity = np.array([x.get('quantity') if type(x.get('quantity')) is int else -1 for x in listings], dtype=np.int64)
+
+        settled = fba['valid'] & (price >= 0) & (compare_at_price >= 0) & (quantity >= 0)
+
+        # Prices landing on half a cent are common with percent margins, they'd be read on every run otherwise
+        for i in np.flatnonzero(settled & undecided):
+            try:
+                settled[i] = await unchanged(*rows[i])
+            except Exception:
+                # Whatever the repricer makes of it, it gets to see it every time
+                settled[i] = False
+
+        settled &= ~changed
+
+        columns['ids'].append(np.array([str(x['_id']) for x in listings], dtype='S'))
+        columns['fba_item_ids'].append(np.array([str(x['fba_item_id']) for x in listings], dtype='S'))
+        columns['price'].append(price)
+        columns['compare_at_price'].append(compare_at_price)
+        columns['quantity'].append(quantity)
+        columns['hash'].append(np.where(settled, CatalogSnapshot.hashes(fba, price, compare_at_price, quantity), np.uint64(0)))
+
+    def save(user_id, columns, formula_hash, built_at, patched_at=None):
+        rows = len(columns['ids'])
+        parts = max(1, -(-rows // CatalogSnapshot.PART_SIZE))
+
+        # Parts carry the version of their snapshot, a half written one is never read
+        version = time.time()
+
+        for part in range(parts):
+            start, end = part * CatalogSnapshot.PART_SIZE, (part + 1) * CatalogSnapshot.PART_SIZE
+
+            DB.ShopifyCatalogSnapshots.replace_one({'_id': f"{user_id}|{part}"}, {
+                'user_id': user_id,
+                'part': part,
+                'version': version,
+                'columns': {
+                    key: {'dtype': value.dtype.str, 'data': value[start:end].tobytes()} for key, value in columns.items()
+                },
+            }, upsert=True)
+
+        DB.ShopifyCatalogSnapshots.delete_many({'user_id': user_id, 'part': {'$gte': parts}})
+
+        DB.ShopifyCatalogSnapshots.replace_one({'_id': user_id}, {
+            'built_at': built_at,
+            # Rows are current as of here, a patched snapshot still ages from its last whole build
+            'patched_at': patched_at or built_at,
+            'formula': formula_hash,
+            'rows': rows,
+            'parts': parts,
+            'version': version,
+        }, upsert=True)
+
+    def load(user):
+        """ Meta and columns of the user's snapshot, None when there is none to trust """
+
+        formula_hash = CatalogSnapshot.formula_hash(user['settings'].get('shopify_pricing_formulas', {}))
+        meta = DB.ShopifyCatalogSnapshots.find_one({'_id': user['_id']})
+
+        if not meta or meta['formula'] != formula_hash or meta['built_at'] < datetime.utcnow() - timedelta(seconds=CatalogSnapshot.MAX_AGE):
+            return None
+
+        columns = {x: [] for x in CatalogSnapshot.COLUMNS}
+
+        for part in DB.ShopifyCatalogSnapshots.find({'user_id': user['_id'], 'part': {'$lt': meta['parts']}}).sort('part', 1):
+            if part['version'] != meta['version']:
+                return None
+
+            for key, value in part['columns'].items():
+                columns[key].append(np.frombuffer(value['data'], dtype=value['dtype']))
+
+        if any(len(x) != meta['parts'] for x in columns.values()):
+            return None
+
+        return meta, {key: np.concatenate(value) for key, value in columns.items()}
+
+    def dirty(user, snapshot):
+        """ Ids of the listings to read again, None when the whole catalog has to be """
+
+        if not snapshot:
+            return None
+
+        meta, columns = snapshot
+
+        # Only the fba items behind the rows, or only those changed since when their updated_at can be trusted
+        if CatalogSnapshot.TRUST_UPDATED_AT:
+            queries = [{'user_id': user['_id'], 'updated_at': {'$gt': meta['patched_at']}}]
+        else:
+            ids = [x.decode() for x in np.unique(columns['fba_item_ids'])]
+            queries = [{'_id': {'$in': ids[i:i + CatalogSnapshot.BATCH_SIZE]}} for i in range(0, len(ids), CatalogSnapshot.BATCH_SIZE)]
+
+        fba_item_ids, fba, batch = [], [], []
+
+        for query in queries:
+            for fba_item in DB.FbaItems.find(query, CatalogSnapshot.FBA_ITEM_FIELDS):
+                fba_item_ids.append(str(fba_item['_id']))
+                batch.append(fba_item)
+
+                if len(batch) == CatalogSnapshot.BATCH_SIZE:
+                    fba.append(CatalogSnapshot.fba_columns(batch))
+                    batch = []
+
+        fba.append(CatalogSnapshot.fba_columns(batch))
+        fba = {key: np.concatenate([x[key] for x in fba]) for key in fba[0]}
+
+        # Lined up with the rows by id
+        fba_item_ids = np.array(fba_item_ids, dtype='S')
+        order = np.argsort(fba_item_ids)
+        positions = np.searchsorted(fba_item_ids[order], columns['fba_item_ids'])
+        positions = order[np.minimum(positions, len(order) - 1)] if len(order) else np.zeros(len(positions), dtype=np.int64)
+        found = (fba_item_ids[positions] == columns['fba_item_ids']) if len(order) else np.zeros(len(positions), dtype=bool)
+
+        fba = {key: value[positions] if len(order) else np.zeros((len(positions),) + value.shape[1:], dtype=value.dtype) for key, value in fba.items()}
+        fba['valid'] &= found
+
+        hashes = CatalogSnapshot.hashes(fba, columns['price'], columns['compare_at_price'], columns['quantity'])
+
+        # Rows whose fba item is gone aren't valid, unless only the changed ones were read
+        stale = (hashes != columns['hash']) | ~fba['valid']
+
+        if CatalogSnapshot.TRUST_UPDATED_AT:
+            stale &= found
+
+        dirty = {x.decode() for x in columns['ids'][stale]}
+
+        # Listed, revised, published or reconciled since, the snapshot has older values of them
+        dirty |= CatalogSnapshot.touched(user, meta['patched_at'], active=True)
+
+        return sorted(dirty)
+
+    def touched(user, since, active=None):
+        """ Ids of the listings written to after since """
+
+        query = {
+            'user_id': user['_id'],
+            '$or': [
+                {'_created_at': {'$gt': since}},
+                {'updated_at': {'$gt': since}},
+                {'reconciled_at': {'$gt': since}},
+            ],
+        }
+
+        if active is not None:
+            query['active'] = active
+
+        return {str(x['_id']) for x in DB.ShopifyListings.find(query, {'_id': 1})}
+
+    async def patch(user, snapshot, ids, unchanged):
+        """ Rows of the given listings read again into the snapshot dirty() loaded, the others it found current """
+
+        meta, columns = snapshot
+        patched_at = datetime.utcnow()
+        formula = user['settings'].get('shopify_pricing_formulas', {})
+
+        # Written to while the run went on, or unpublished since, they are read again as well
+        ids = sorted(set(ids) | CatalogSnapshot.touched(user, meta['patched_at']))
+
+        keep = ~np.isin(columns['ids'], np.array(ids, dtype='S'))
+        patched = {key: [value[keep]] for key, value in columns.items()}
+
+        listings = list(DB.ShopifyListings.find({'_id': {'$in': ids}, 'user_id': user['_id'], 'active': True}, CatalogSnapshot.LISTING_FIELDS))
+
+        for start in range(0, len(listings), CatalogSnapshot.BATCH_SIZE):
+            await CatalogSnapshot.add_rows(patched, listings[start:start + CatalogSnapshot.BATCH_SIZE], formula, unchanged)
+
+        CatalogSnapshot.save(user['_id'], {
+            key: np.concatenate(value) for key, value in patched.items()
+        }, meta['formula'], meta['built_at'], patched_at)
@@ -0,0 +1,66 @@
+import time
+
+from datetime import datetime
+from dynaconf import settings
+from utils.Database import Database
+
+# Get DB instance
+DB = Database.instance()
+
+
+class Checkpoint:
+    """ Cursor of a catalog run kept in Mongo, the next run of the task picks up after the last item done """
+
+    # Items between two saves, a crashed run redoes at most that many
+    EVERY = settings.APP.Checkpoints.Every
+
+    # Secs after which a checkpoint is ignored and the catalog is gone through from the start again
+    MAX_AGE = settings.APP.Checkpoints.MaxAge
+
+    def key(user_id, task, slice=None):
+        if slice:
+            return f"{user_id}|{task}|{slice[0]}/{slice[1]}"
+
+        return f"{user_id}|{task}"
+
+    def bounds(slice):
+        """ Id range of a slice, [index, count] splits the hex id space evenly so slices can run side by side """
+
+        if not slice:
+            return None, None
+
+        index, count = slice
+
+        lower = '%024x' % (16 ** 24 * index // count) if index else None
+        upper = '%024x' % (16 ** 24 * (index + 1) // count) if index + 1 < count else None
+
+        return lower, upper
+
+    def load(user_id, task, slice=None):
+        """ Id of the last item done by a previous run, None to start from the beginning """
+
+        checkpoint = DB.ShopifyCheckpoints.find_one({'_id': Checkpoint.key(user_id, task, slice)})
+
+        if not checkpoint or checkpoint['updated_at'] < time.time() - Checkpoint.MAX_AGE:
+            return None
+
+        return checkpoint['cursor']
+
+    def save(user_id, task, cursor, processed, slice=None, state='running'):
+        DB.ShopifyCheckpoints.update_one({'_id': Checkpoint.key(user_id, task, slice)}, {
+            '$set': {
+                'user_id': user_id,
+                'task': task,
+                'slice': slice,
+                'cursor': cursor,
+                'state': state,
+                'updated_at': time.time(),
+            },
+            '$inc': {'processed': processed},
+            '$setOnInsert': {'started_at': datetime.utcnow()},
+        }, upsert=True)
+
+    def clear(user_id, task, slice=None):
+        """ Run went through the whole catalog """
+
+        DB.ShopifyCheckpoints.delete_one({'_id': Checkpoint.key(user_id, task, slice)})
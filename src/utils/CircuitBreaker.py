@@ -0,0 +1,133 @@
+import socket
+import time
+
+from datetime import datetime
+from loguru import logger
+from dynaconf import settings
+from yarl import URL
+from utils.Database import Database
+from utils.Metrics import Metrics
+
+# Get DB instance
+DB = Database.instance()
+
+
+class CircuitBreaker:
+    """ Per shop breaker, kept in Mongo so every process and the publisher skip a shop that keeps failing hard """
+
+    # Revoked token, frozen/unpaid store, store closed or gone
+    HARD_FAILURES = settings.SHOPIFY.CircuitBreaker.HardFailures
+
+    # Consecutive hard failures before the breaker opens
+    THRESHOLD = settings.SHOPIFY.CircuitBreaker.Threshold
+
+    # Secs until the first probe of an open shop, doubled after every failed probe up to the max
+    PROBE_INTERVAL = settings.SHOPIFY.CircuitBreaker.ProbeInterval
+    MAX_PROBE_INTERVAL = settings.SHOPIFY.CircuitBreaker.MaxProbeInterval
+
+    # Shops this process saw failing, so successful calls only write to Mongo when there is something to reset
+    FAILING = set()
+
+    def allow(domain, probe=False):
+        """ Whether the shop can be called, with probe the caller is the one task trying it again """
+
+        breaker = DB.ShopifyCircuitBreakers.find_one({'_id': domain})
+
+        if not breaker:
+            return True
+
+        # Failures to reset once a call goes through, whichever process counted them
+        CircuitBreaker.FAILING.add(domain)
+
+        if breaker['state'] == 'closed':
+            return True
+
+        if breaker['next_probe_at'] > time.time():
+            return False
+
+        if not probe:
+            return True
+
+        # Only one task probes per interval, the others keep skipping
+        claimed = DB.ShopifyCircuitBreakers.find_one_and_update({
+            '_id': domain,
+            'next_probe_at': breaker['next_probe_at'],
+        }, {
+            '$set': {
+                'state': 'half_open',
+                'next_probe_at': time.time() + breaker['probe_interval'],
+            },
+        })
+
+        return claimed is not None
+
+    def blocked():
+        """ Shops that are open and not due for a probe """
+
+        return {x['_id'] for x in DB.ShopifyCircuitBreakers.find({
+            'state': {'$ne': 'closed'},
+            'next_probe_at': {'$gt': time.time()},
+        }, {'_id': 1})}
+
+    def failure(domain, reason):
+        CircuitBreaker.FAILING.add(domain)
+
+        breaker = DB.ShopifyCircuitBreakers.find_one_and_update({'_id': domain}, {
+            '$inc': {'failures': 1},
+            '$set': {'last_error': reason, 'updated_at': datetime.utcnow()},
+            '$setOnInsert': {'state': 'closed', 'probe_interval': 0, 'next_probe_at': 0},
+        }, upsert=True, return_document=True)
+
+        # A failed probe opens it again right away
+        if breaker['state'] == 'half_open' or (breaker['state'] == 'closed' and breaker['failures'] >= CircuitBreaker.THRESHOLD):
+            interval = min(CircuitBreaker.MAX_PROBE_INTERVAL, breaker['probe_interval'] * 2 or CircuitBreaker.PROBE_INTERVAL)
+
+            DB.ShopifyCircuitBreakers.update_one({'_id': domain}, {
+                '$set': {
+                    'state': 'open',
+                    'probe_interval': interval,
+                    'next_probe_at': time.time() + interval,
+                    'opened_at': breaker.get('opened_at') or datetime.utcnow(),
+                },
+            })
+
+            Metrics.incr("shopify.breaker.opened", rate=1)
+            logger.warning("{domain} | Circuit open after {reason}, next probe in {interval} secs", domain=domain, reason=reason, interval=interval)
+
+    def success(domain):
+        if domain not in CircuitBreaker.FAILING:
+            return
+
+        CircuitBreaker.FAILING.discard(domain)
+
+        breaker = DB.ShopifyCircuitBreakers.find_one_and_delete({'_id': domain})
+
+        if breaker and breaker['state'] != 'closed':
+            Metrics.incr("shopify.breaker.closed", rate=1)
+            logger.info("{domain} | Circuit closed", domain=domain)
+
+    def observe(method, url, status, exception, **kwargs):
+        """ Shopify request observer """
+
+        domain = URL(str(url)).host
+
+        if status in CircuitBreaker.HARD_FAILURES:
+            return CircuitBreaker.failure(domain, f'{status} status code')
+
+        # Domain doesn't resolve, the store is gone
+        if exception is not None and isinstance(getattr(exception, 'os_error', None), socket.gaierror):
+            return CircuitBreaker.failure(domain, 'DNS failure')
+
+        if status and 200 <= status < 300:
+            CircuitBreaker.success(domain)
+
+    def summary():
+        """ Shops with an open breaker, for the health endpoint """
+
+        return [{
+            'domain': x['_id'],
+            'state': x['state'],
+            'failures': x['failures'],
+            'last_error': x.get('last_error'),
+            'next_probe_in': round(x['next_probe_at'] - time.time()),
+        } for x in DB.ShopifyCircuitBreakers.find({'state': {'$ne': 'closed'}})]
@@ -1,6 +1,7 @@
 import pymongo
 
 from dynaconf import settings
+from utils.Metrics import MongoMetrics
 
 
 class MetaClass(type):
@@ -16,9 +17,22 @@ class MetaClass(type):
 class Database(metaclass=MetaClass):
     """ MongoDB connector """
 
-    def instance(driver='Mongo'):
-        client = pymongo.MongoClient(
-            host=settings.DATABASE.Mongo.URL,
-        )
-
-        return client.get_database()
+    # One client (and connection pool) per process
+    CLIENT = None
+
+    def instance(driver=None):
+        if Database.CLIENT is None:
+            if (driver or settings.DATABASE.Driver) == 'Mongomock':
+                # In-memory database for benchmarks, see benchmarks/requirements.txt
+                import mongomock
+
+                Database.CLIENT = mongomock.MongoClient(
+                    host=settings.DATABASE.Mongo.URL,
+                )
+            else:
+                Database.CLIENT = pymongo.MongoClient(
+                    host=settings.DATABASE.Mongo.URL,
+                    event_listeners=[MongoMetrics()],
+                )
+
+        return Database.CLIENT.get_database()
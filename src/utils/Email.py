@@ -1,7 +1,17 @@
 import emails
+import functools
+import smtplib
+import socket
+import queue
 
+from datetime import datetime, timedelta
 from dynaconf import settings
 from loguru import logger
+from utils.Database import Database
+from utils.Helpers import Helpers
+
+# Get DB instance
+DB = Database.instance()
 
 
 class Email:
@@ -31,3 +41,166 @@ class Email:
             )
         except Exception:
             logger.error("Error occured when sending email")
+
+    def notify(self, user, template, **fields):
+        """ Send a templated notification, or hold it for the digest if the user opted in """
+
+        subject, body = Email.template(template)
+
+        if template in settings.EMAILS.Digest.Templates and Helpers.get_shopify_options(user['settings'], 'email_digest', 'on'):
+            DB.EmailDigestItems.insert_one({
+                '_id': Helpers.generate_mongo_id(),
+                'user_id': user['_id'],
+                'line': Email.template(f'Digest.Lines.{template}')[1].format(**fields),
+                'created_at': datetime.utcnow(),
+            })
+            return
+
+        self.enqueue(
+            to=user['emails'][0]['address'],
+            subject=subject,
+            html=body.format(**fields),
+        )
+
+    def flush_digest(self, user):
+        """ Collapse held notifications of the user into a single summary email """
+
+        items = list(DB.EmailDigestItems.find({
+            'user_id': user['_id'],
+        }, sort=[('created_at', 1)]))
+
+        if not items:
+            return
+
+        # Keep collecting until the oldest notification has waited for the whole window
+        if items[0]['created_at'] > datetime.utcnow() - timedelta(seconds=settings.EMAILS.Digest.Window):
+            return
+
+        subject, body = Email.template('Digest')
+
+        self.enqueue(
+            to=user['emails'][0]['address'],
+            subject=subject.format(count=len(items)),
+            html=body.format(count=len(items), lines=''.join(x['line'] for x in items)),
+        )
+
+        DB.EmailDigestItems.delete_many({
+            '_id': {'$in': [x['_id'] for x in items]},
+        })
+
+        logger.info("{count} notification(s) sent as a digest", count=len(items))
+
+    def enqueue(self, to, subject, html):
+        """ Put an already rendered email into the outbox """
+
+        DB.EmailOutbox.insert_one({
+            '_id': Helpers.generate_mongo_id(),
+            'to': to,
+            'subject': subject,
+            'html': html,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': datetime.utcnow(),
+            'created_at': datetime.utcnow(),
+        })
+
+    @functools.lru_cache(maxsize=None)
+    def template(path):
+        """ Subject and HTML body of an EMAILS template, converted once per process """
+
+        template = settings.EMAILS
+        for key in path.split('.'):
+            template = template[key]
+
+        if isinstance(template, str):
+            return None, template.replace('\n', '<br>\n')
+
+        return template.get('Subject'), template['Body'].replace('\n', '<br>\n')
+
+    def compose(to, subject, html):
+        """ Build the MIME message of an outbox entry """
+
+        return emails.html(
+            html=html,
+            subject=subject,
+            mail_from=(
+                settings.EMAILS.Info.From[0],
+                settings.EMAILS.Info.From[1],
+            ),
+            mail_to=to,
+        ).as_string()
+
+
+class SMTPConnection:
+    """ Persistent SMTP session that reconnects when the server drops it """
+
+    def __init__(self):
+        self.smtp = None
+
+    def open(self):
+        self.smtp = smtplib.SMTP(
+            host=settings.EMAILS.Info.Host[0],
+            port=settings.EMAILS.Info.Host[1],
+            timeout=30,
+        )
+
+        self.smtp.ehlo()
+
+        # Local stand-ins usually don't speak TLS
+        if self.smtp.has_extn('starttls'):
+            self.smtp.starttls()
+            self.smtp.ehlo()
+
+        if self.smtp.has_extn('auth'):
+            self.smtp.login(
+                settings.EMAILS.Info.Credentials[0],
+                settings.EMAILS.Info.Credentials[1],
+            )
+
+    def send(self, to, message):
+        # Second attempt is made on a fresh connection
+        for attempt in [1, 2]:
+            try:
+                if not self.smtp:
+                    self.open()
+
+                return self.smtp.sendmail(settings.EMAILS.Info.From[1], to, message)
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                self.close()
+
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if not self.smtp:
+            return
+
+        try:
+            self.smtp.quit()
+        except Exception:
+            pass
+
+        self.smtp = None
+
+
+class SMTPPool:
+    """ Fixed number of SMTP connections shared by the sender threads """
+
+    def __init__(self, size):
+        self.size = size
+        self.connections = queue.Queue()
+
+        for _ in range(size):
+            self.connections.put(SMTPConnection())
+
+    def send(self, to, message):
+        connection = self.connections.get()
+
+        try:
+            return connection.send(to, message)
+        finally:
+            self.connections.put(connection)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
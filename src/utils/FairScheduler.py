@@ -0,0 +1,97 @@
+import heapq
+import itertools
+
+from collections import Counter
+
+from dynaconf import settings
+from utils.Priority import Priority
+
+
+class FairScheduler:
+    """ Start-time fair queuing of pending tasks across shops, a shop with weight 2 gets twice the dispatches of one with 1 """
+
+    # Plan of the user => weight, plans not listed get the default
+    WEIGHTS = settings.APP.Scheduling.Weights
+
+    # Task => items per chunk, chunked tasks hand the rest of their work back to the scheduler
+    CHUNK_SIZES = settings.APP.Scheduling.ChunkSizes
+
+    # Task => secs a chunk may take, it stops after the item at hand once they are up
+    TIME_BUDGETS = settings.APP.Scheduling.TimeBudgets
+
+    def __init__(self):
+        # Start tag of the last dispatch, a shop coming back from idle starts here instead of at its old tags
+        self.virtual_time = 0.0
+
+        # Shop => finish tag of its last queued item
+        self.finish = {}
+        self.queued = Counter()
+
+        # (class rank, start tag, sequence, shop, item), order tasks go first whatever their tag
+        self.heap = []
+        self.sequence = itertools.count()
+
+        # Entries skipped over during a scan, they go back with their tags
+        self.aside = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, shop, item, task, weight=1, cost=1):
+        start = max(self.virtual_time, self.finish.get(shop, 0.0))
+        self.finish[shop] = start + cost / max(weight, 0.001)
+
+        self.queued[shop] += 1
+
+        rank = 0 if Priority.of(task) == 'order' else 1
+
+        heapq.heappush(self.heap, (rank, start, next(self.sequence), shop, item))
+
+    def peek(self):
+        return self.heap[0][4] if self.heap else None
+
+    def pop(self):
+        rank, start, _, shop, item = heapq.heappop(self.heap)
+        self.virtual_time = max(self.virtual_time, start)
+
+        self.queued[shop] -= 1
+
+        # Nothing left for the shop, forget it so the maps don't grow with every shop ever seen
+        if not self.queued[shop]:
+            del self.queued[shop]
+            self.finish.pop(shop, None)
+
+        return item
+
+    def set_aside(self):
+        """ Skip the head item for now, put_back() returns it to its place """
+
+        entry = heapq.heappop(self.heap)
+        self.aside.append(entry)
+
+        return entry[4]
+
+    def put_back(self):
+        for entry in self.aside:
+            heapq.heappush(self.heap, entry)
+
+        self.aside = []
+
+    def stats(self):
+        return {
+            'queued': len(self.heap),
+            'shops': len(self.queued),
+            'orders': len([x for x in self.heap if x[0] == 0]),
+            'virtual_time': round(self.virtual_time, 3),
+        }
+
+    def weight(user):
+        """ Weight of a user's shop by their plan """
+
+        return FairScheduler.WEIGHTS.get(str(user.get('plan')), FairScheduler.WEIGHTS['default'])
+
+    def chunk_size(task):
+        return FairScheduler.CHUNK_SIZES.get(task)
+
+    def time_budget(task):
+        return FairScheduler.TIME_BUDGETS.get(task)
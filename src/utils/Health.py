@@ -0,0 +1,168 @@
+import asyncio
+import glob
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from loguru import logger
+from dynaconf import settings
+from yarl import URL
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=1):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Health:
+    """ Live stats of a process served as JSON on a Unix socket, `curl --unix-socket <path> http://localhost/` """
+
+    ENABLED = settings.APP.Health.Enabled
+
+    # Every process has its socket here, tools/HealthCheck.py reads them all
+    DIRECTORY = settings.APP.Health.Directory
+
+    # Shops seen by this process => their Shopify call limit and throttles
+    SHOPS = {}
+
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(self.DIRECTORY, f'{name}.sock')
+        self.started_at = time.time()
+        self.server = None
+
+        # Section name => callable returning its stats
+        self.providers = {}
+
+        self.loop_lag = {'last': None, 'max': 0.0}
+
+    def add(self, section, provider):
+        self.providers[section] = provider
+
+    def stats(self):
+        stats = {
+            'name': self.name,
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started_at, 1),
+        }
+
+        # Providers read state the event loop thread keeps changing, a section is serialised right away
+        # so a dict that grows meanwhile fails only its own section, not the whole response
+        for section, provider in list(self.providers.items()):
+            try:
+                stats[section] = json.loads(json.dumps(provider(), default=str))
+            except Exception as e:
+                stats[section] = {'error': str(e)}
+
+        return stats
+
+    def start(self):
+        """ Serve on a background thread, blocking code of the process won't stall it """
+
+        if not self.ENABLED:
+            return
+
+        health = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(health.stats(), default=str).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+
+        # Left behind by a crashed process, or by this one before it recycled itself
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        try:
+            self.server = Server(self.path, Handler)
+        except OSError as e:
+            return logger.warning("Health endpoint unavailable: {error}", error=e)
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if not self.server:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def watch_loop(self, interval=1.0):
+        """ How late the event loop wakes up, blocking calls in coroutines show up here """
+
+        loop = asyncio.get_event_loop()
+
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+
+            lag = max(0.0, loop.time() - expected)
+
+            self.loop_lag['last'] = round(lag, 4)
+            self.loop_lag['max'] = round(max(self.loop_lag['max'], lag), 4)
+
+    def shopify(method, url, status, elapsed, headers, **kwargs):
+        """ Shopify request observer, keeps the leaky bucket level each shop reported last """
+
+        shop = Health.SHOPS.setdefault(URL(str(url)).host, {'call_limit': None, 'throttled': 0, 'requests': 0})
+
+        shop['requests'] += 1
+        shop['last_request_at'] = time.time()
+
+        if call_limit := headers.get('X-Shopify-Shop-Api-Call-Limit'):
+            shop['call_limit'] = call_limit
+
+        if status == 429:
+            shop['throttled'] += 1
+
+    def query(path):
+        """ Stats of another process by its socket """
+
+        connection = UnixHTTPConnection(path)
+
+        try:
+            connection.request('GET', '/')
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+    def query_all(pattern='*'):
+        """ Stats of every process of the host, unreachable sockets are skipped """
+
+        stats = []
+
+        for path in sorted(glob.glob(os.path.join(Health.DIRECTORY, f'{pattern}.sock'))):
+            try:
+                stats.append(Health.query(path))
+            except (OSError, ValueError):
+                continue
+
+        return stats
@@ -1,11 +1,12 @@
 import aiohttp
-import sys
 import random
-import inspect
-import os
 
 from loguru import logger
+from dynaconf import settings
 from utils.Database import Database
+from utils.Logging import Logging
+from utils.Shopify import Shopify
+from utils.CircuitBreaker import CircuitBreaker
 from decimal import Decimal
 
 DB = Database.instance()
@@ -13,26 +14,21 @@ DB = Database.instance()
 
 class Helpers:
 
-    def configure_logger(user):
+    def configure_logger(user, service):
+        """ Tag the messages of the current task with the service and user """
 
-        try:
-            filename = os.path.splitext(os.path.basename(inspect.stack()[1][0].f_code.co_filename))[0]
-        except Exception:
-            filename = 'undefined'
+        Logging.bind(service=service, user=str(user))
 
-        # TODO: whitelist but not like that fucked up
-        if filename not in ['ShopifyItemLister', 'ShopifyItemUnpublisher', 'ShopifyItemPublisher', 'ShopifyItemRepricer', 'ShopifyOrderFulfiller', 'ShopifyOrderTracker']:
-            return
+    def shop_available(user):
+        """ Whether the task may call the user's shop, while it keeps failing hard only a probe gets through now and then """
+        """ Call it right before the first Shopify call, a task returning before that would use up the probe """
+
+        if CircuitBreaker.allow(user['settings']['shopify_creds'].get('domain'), probe=True):
+            return True
+
+        logger.warning("{user_id} | Shopify circuit open, skipping", user_id=user['_id'])
 
-        return logger.configure(
-            handlers=[
-                {'sink': sys.stderr, 'format': filename + ' | <fg #fff>' + user + '</fg #fff> | {time:YYYY-MM-DD HH:mm:ss} | <level>{message}</level> <fg #444>@:{line}</fg #444>'},
-                {'sink': f'logs/{filename}.log', 'rotation': '10 MB', 'format': filename + ' | <fg #fff>' + user + '</fg #fff> | {time:YYYY-MM-DD HH:mm:ss} | <level>{message}</level> <fg #444>@:{line}</fg #444>'},
-            ],
-            levels=[
-                {"name": "DEBUG", "color": ""},
-            ]
-        )
+        return False
 
     def generate_mongo_id():
         return('%024x' % random.randrange(16**24))
@@ -164,12 +160,9 @@ class Helpers:
     async def fetch_shopify_settings(domain, headers):
         """ Get Shopify shop settings """
 
-        SHOP_URL = (
-            f"https://{domain}/admin/api/2019-10/"
-            f"shop.json"
-        )
+        SHOP_URL = settings.SHOPIFY.Endpoints.Shop.format(domain=domain)
 
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with Shopify.session(headers=headers) as session:
             try:
                 response = await(await session.get(SHOP_URL)).json()
 
@@ -0,0 +1,79 @@
+from datetime import datetime
+from dynaconf import settings
+from utils.Database import Database
+from utils.Metrics import Metrics
+
+# Get DB instance
+DB = Database.instance()
+
+
+class Hysteresis:
+    """ Holds back listing revisions too small or too soon to be worth a Shopify write """
+
+    # Defaults of users.settings.shopify_repricing_thresholds, thresholds of 0 hold nothing back
+    DEFAULTS = {
+        'priceAbsolute': settings.APP.Repricer.Hysteresis.PriceAbsolute,
+        'pricePercent': settings.APP.Repricer.Hysteresis.PricePercent,
+        'quantityAbsolute': settings.APP.Repricer.Hysteresis.QuantityAbsolute,
+        'quantityPercent': settings.APP.Repricer.Hysteresis.QuantityPercent,
+        'minInterval': settings.APP.Repricer.Hysteresis.MinInterval,
+    }
+
+    def thresholds(user):
+        return {**Hysteresis.DEFAULTS, **user['settings'].get('shopify_repricing_thresholds', {})}
+
+    def significant(old, new, absolute, percent):
+        """ Change at least as big as the larger of the absolute and the percent threshold """
+
+        return abs(new - old) >= max(absolute, abs(old) * percent / 100)
+
+    def cents(price):
+        return round(float(price) * 100)
+
+    def hold(user, shopify_item, update):
+        """ Why the revision waits, None to send it """
+
+        thresholds = Hysteresis.thresholds(user)
+
+        try:
+            old_quantity, new_quantity = int(shopify_item['quantity']), int(update['inventory_quantity'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        # Going out of stock or back in stock can't wait
+        if (old_quantity > 0) != (new_quantity > 0):
+            return None
+
+        updated_at = shopify_item.get('updated_at')
+
+        if thresholds['minInterval'] and isinstance(updated_at, datetime) and (datetime.utcnow() - updated_at).total_seconds() < thresholds['minInterval']:
+            return 'interval'
+
+        try:
+            changes = [
+                Hysteresis.significant(int(shopify_item[key]), Hysteresis.cents(update[key]), thresholds['priceAbsolute'] * 100, thresholds['pricePercent'])
+                for key in ['price', 'compare_at_price']
+            ]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        changes.append(Hysteresis.significant(old_quantity, new_quantity, thresholds['quantityAbsolute'], thresholds['quantityPercent']))
+
+        return None if any(changes) else 'threshold'
+
+    def record(shopify_item, update, reason):
+        """ Keep the held revision on the listing, later runs send it once it's due or has grown past the thresholds """
+
+        Metrics.incr(f"reprice.held.{reason}", rate=1)
+
+        held = shopify_item.get('held_revision') or {}
+
+        # Same revision held for the same reason already
+        if held.get('reason') == reason and all(held.get(key) == value for key, value in update.items()):
+            return
+
+        DB.ShopifyListings.update_one({'_id': shopify_item['_id']}, {
+            '$set': {
+                'held_revision': {**update, 'reason': reason, 'held_at': datetime.utcnow()},
+            },
+        })
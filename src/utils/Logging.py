@@ -0,0 +1,115 @@
+import contextvars
+import sys
+import time
+
+from loguru import logger
+from dynaconf import settings
+
+# Context of the task being processed, event loop gives every task its own copy
+CONTEXT = contextvars.ContextVar('log_context', default={})
+
+# Counters of the sampled messages of the current task
+SAMPLES = contextvars.ContextVar('log_samples', default=None)
+
+FORMAT = '{extra[service]} | <fg #fff>{extra[user]}</fg #fff> | {time:YYYY-MM-DD HH:mm:ss} | <level>{message}</level> <fg #444>@:{line}</fg #444>'
+
+
+class Logging:
+    # Levels that are sampled in hot loops, others are always logged
+    # Every: log 1 in N messages of the same key, PerSecond: at most K of them per second
+    SAMPLING = settings.APP.Logging.Sampling
+
+    def setup(services, directory='logs', stream=sys.stderr):
+        """ Configure sinks once per process, each service writes to its own file """
+
+        def patch(record):
+            record['extra'].update(CONTEXT.get())
+
+        def only(service):
+            return lambda record: record['extra'].get('service') == service
+
+        handlers = [{'sink': stream, 'format': FORMAT}]
+
+        for service in services:
+            handlers.append({
+                'sink': f'{directory}/{service}.log',
+                'rotation': '10 MB',
+                'format': FORMAT,
+                'filter': only(service),
+                # File writes happen on a background thread
+                'enqueue': True,
+            })
+
+        return logger.configure(
+            handlers=handlers,
+            levels=[
+                {"name": "DEBUG", "color": ""},
+            ],
+            extra={
+                'service': 'undefined',
+                'user': '-',
+                'queue': '-',
+            },
+            patcher=patch,
+        )
+
+    def bind(**context):
+        """ Attach fields to every message logged by the current task """
+
+        CONTEXT.set({**CONTEXT.get(), **context})
+
+    def shutdown():
+        """ Flush enqueued messages before the process exits """
+
+        logger.remove()
+
+    def start_sampling():
+        """ Reset the sampling counters for the task that is about to run """
+
+        SAMPLES.set({})
+
+    def sampled(level, message, key=None, **kwargs):
+        """ Log the message unless the same key was logged too often in this task """
+
+        samples = SAMPLES.get()
+        rule = Logging.SAMPLING.get(level)
+
+        if samples is None or not rule:
+            return logger.opt(depth=1).log(level, message, **kwargs)
+
+        now = int(time.monotonic())
+        counter = samples.setdefault((level, key or message), {
+            'seen': 0,
+            'logged': 0,
+            'second': now,
+            'in_second': 0,
+        })
+
+        counter['seen'] += 1
+
+        if counter['second'] != now:
+            counter['second'], counter['in_second'] = now, 0
+
+        if (counter['seen'] - 1) % rule.Every or counter['in_second'] >= rule.PerSecond:
+            return
+
+        counter['in_second'] += 1
+        counter['logged'] += 1
+
+        logger.opt(depth=1).log(level, message, **kwargs)
+
+    def summary():
+        """ Report how many messages sampling held back in the finished task """
+
+        samples = SAMPLES.get()
+
+        if not samples:
+            return
+
+        for (level, key), counter in samples.items():
+            if counter['seen'] == counter['logged']:
+                continue
+
+            logger.log(level, "Sampled: {seen} x '{key}', {logged} logged", seen=counter['seen'], key=key, logged=counter['logged'])
+
+        SAMPLES.set(None)
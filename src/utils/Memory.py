@@ -0,0 +1,103 @@
+import psutil
+import tracemalloc
+
+from collections import defaultdict
+from loguru import logger
+from dynaconf import settings
+from utils.Metrics import Metrics
+
+
+class Memory:
+    """ Per task memory instrumentation and the worker recycle policy """
+
+    # Record RSS per task type, tracemalloc adds the top allocators but slows everything down
+    ENABLED = settings.APP.Memory.Enabled
+    TRACEMALLOC = settings.APP.Memory.Tracemalloc
+    TOP_ALLOCATORS = settings.APP.Memory.TopAllocators
+
+    # Tasks leaving more than this behind (MB) are reported
+    RETAINED_THRESHOLD = settings.APP.Memory.RetainedThreshold
+
+    # Worker restarts itself after this many tasks or above this RSS (MB), 0 turns them off
+    RECYCLE_AFTER_TASKS = settings.APP.Memory.RecycleAfterTasks
+    RECYCLE_ABOVE = settings.APP.Memory.RecycleAbove
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.tasks = 0
+
+        # Task type => count, total retained bytes and peak RSS seen
+        self.stats = defaultdict(lambda: {'count': 0, 'retained': 0, 'peak_rss': 0})
+
+        if self.ENABLED and self.TRACEMALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def rss(self):
+        return self.process.memory_info().rss
+
+    async def run(self, coroutine, payload):
+        if not self.ENABLED:
+            try:
+                return await coroutine
+            finally:
+                self.tasks += 1
+
+        task = payload.get('task', 'unknown')
+
+        # Tasks overlapping this one share the process, so the numbers are an upper bound
+        rss_before = self.rss()
+        snapshot_before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+        try:
+            return await coroutine
+        finally:
+            self.tasks += 1
+
+            rss_after = self.rss()
+            retained = rss_after - rss_before
+
+            stats = self.stats[task]
+            stats['count'] += 1
+            stats['retained'] += retained
+            stats['peak_rss'] = max(stats['peak_rss'], rss_after)
+
+            Metrics.gauge(f"memory.{task}.retained", retained)
+            Metrics.gauge("memory.rss", rss_after)
+
+            if retained > self.RETAINED_THRESHOLD * 1024 * 1024:
+                logger.warning(
+                    "{task} | Retained {retained:.1f} MB, RSS is {rss:.1f} MB",
+                    task=task,
+                    retained=retained / 1024 / 1024,
+                    rss=rss_after / 1024 / 1024,
+                )
+
+                if snapshot_before:
+                    self.report_allocators(snapshot_before)
+
+    def report_allocators(self, snapshot_before):
+        """ Log the lines that allocated the most since the task started """
+
+        differences = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')
+
+        for difference in differences[:self.TOP_ALLOCATORS]:
+            logger.warning("{difference}", difference=difference)
+
+    def should_recycle(self):
+        if self.RECYCLE_AFTER_TASKS and self.tasks >= self.RECYCLE_AFTER_TASKS:
+            return True
+
+        if self.RECYCLE_ABOVE and self.rss() > self.RECYCLE_ABOVE * 1024 * 1024:
+            return True
+
+        return False
+
+    def summary(self):
+        for task, stats in self.stats.items():
+            logger.info(
+                "{task} | {count} task(s), {retained:.1f} MB retained on average, peak RSS {peak:.1f} MB",
+                task=task,
+                count=stats['count'],
+                retained=stats['retained'] / stats['count'] / 1024 / 1024,
+                peak=stats['peak_rss'] / 1024 / 1024,
+            )
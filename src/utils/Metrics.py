@@ -0,0 +1,86 @@
+import contextlib
+import re
+import time
+import types
+import statsd
+
+from dynaconf import settings
+from pymongo import monitoring
+
+
+class Metrics:
+    """ StatsD metrics, a no-op when disabled in settings """
+
+    CLIENT = None
+
+    # Sample rate of the high volume stats, gauges are always sent
+    RATE = settings.APP.Statsd.SampleRate
+
+    def client():
+        if Metrics.CLIENT is None and settings.APP.Statsd.Enabled:
+            Metrics.CLIENT = statsd.StatsClient(
+                host=settings.APP.Statsd.Host,
+                port=settings.APP.Statsd.Port,
+                prefix=settings.APP.Statsd.Prefix,
+            )
+
+        return Metrics.CLIENT
+
+    def incr(stat, count=1, rate=None):
+        if client := Metrics.client():
+            client.incr(stat, count, rate=Metrics.RATE if rate is None else rate)
+
+    def timing(stat, seconds, rate=None):
+        if client := Metrics.client():
+            client.timing(stat, seconds * 1000, rate=Metrics.RATE if rate is None else rate)
+
+    def gauge(stat, value, delta=False):
+        if client := Metrics.client():
+            client.gauge(stat, value, delta=delta)
+
+    @contextlib.contextmanager
+    def timer(stat):
+        started_at = time.monotonic()
+
+        # Elapsed is also available to the caller once the block is over
+        timer = types.SimpleNamespace(elapsed=None)
+
+        try:
+            yield timer
+        finally:
+            timer.elapsed = time.monotonic() - started_at
+            Metrics.timing(stat, timer.elapsed)
+
+    def endpoint(url):
+        """ Stat friendly name of a Shopify Admin API url, ids are masked """
+
+        path = re.sub(r'^.*/admin/api/[^/]+/', '', url.path if hasattr(url, 'path') else str(url))
+        path = re.sub(r'\.json$', '', path)
+        path = re.sub(r'/\d+', '/id', path)
+
+        return path.replace('/', '_') or 'unknown'
+
+    def shopify(method, url, status, elapsed, **kwargs):
+        """ Latency and status code of each Shopify call """
+
+        endpoint = f"shopify.{method.lower()}.{Metrics.endpoint(url)}"
+
+        Metrics.timing(f"{endpoint}.latency", elapsed)
+        Metrics.incr(f"{endpoint}.status.{status or 'error'}")
+
+        if status == 429:
+            Metrics.incr("shopify.throttled")
+
+
+class MongoMetrics(monitoring.CommandListener):
+    """ Timing of every command sent to MongoDB """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        Metrics.timing(f"mongo.{event.command_name}", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        Metrics.timing(f"mongo.{event.command_name}", event.duration_micros / 1e6)
+        Metrics.incr(f"mongo.{event.command_name}.failed")
@@ -0,0 +1,120 @@
+import numbers
+import numpy as np
+
+from utils.Helpers import Helpers
+
+
+class Pricing:
+    """ Price and quantity diffs of a batch of listings in one pass over columns, same answers as ShopifyItemRepricer.compare_* """
+
+    # Half a cent closer than this can round either way in float, Decimal decides those rows one by one
+    TIE = 1e-6
+
+    # Beyond this float cents lose the precision the tie check relies on
+    MAX_PRICE = 1e9
+
+    # Formula keys of both price types, see Helpers.get_price_by_formula
+    FORMULAS = {
+        'sale_price': ('radioGroupShopifyPricing', 'shopifyPercentMargin', 'shopifyFixedMargin'),
+        'compare_at_price': ('radioGroupComparePricing', 'comparePercentMargin', 'compareFixedMargin'),
+    }
+
+    def number(value):
+        """ Plain ints and floats only, anything else takes the one by one path with its own errors """
+
+        return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+    def apply(prices, formula, price_type):
+        """ Helpers.get_price_by_formula over an array, the same float operations in the same order """
+
+        option_key, percent_key, fixed_key = Pricing.FORMULAS[price_type]
+        option = formula.get(option_key, 'equal')
+
+        if option == 'percent':
+            return prices * (1 + formula.get(percent_key, 0) / 100)
+
+        if option == 'fixed':
+            return prices + formula.get(fixed_key, 0)
+
+        return prices.copy()
+
+    def round_cents(prices):
+        """ Cents of round(Decimal(price), 2), and the rows too close to a half cent to trust """
+
+        cents = prices * 100
+        fraction = cents - np.floor(cents)
+
+        undecided = (np.abs(fraction - 0.5) < Pricing.TIE) | (np.abs(prices) > Pricing.MAX_PRICE) | ~np.isfinite(prices)
+
+        return np.rint(np.where(undecided, 0, cents)), undecided
+
+    def price(prices, formula, price_type):
+        """ Price the formula gives, as float(Helpers.get_price_by_formula(...)) """
+
+        prices = Pricing.apply(prices, formula, price_type)
+        cents, undecided = Pricing.round_cents(prices)
+
+        # Negative prices become 0
+        return np.where(prices < 0, 0.0, cents / 100.0), undecided & ~(prices < 0)
+
+    def stored_cents(values):
+        """ Cents kept on the listings as strings, those str(round(Decimal(...))) would never give are -1 """
+
+        return np.array([int(x) if isinstance(x, str) and x.isdigit() and str(int(x)) == x else -1 for x in values], dtype=np.float64)
+
+    def diff(rows, formula):
+        """ Rows of (shopify_item, fba_item) that need a revision, and those left to the one by one path """
+
+        size = len(rows)
+
+        # Margins of another type raise or behave differently in the scalar path, leave the batch to it
+        if any(not Pricing.number(formula.get(key, 0)) for keys in Pricing.FORMULAS.values() for key in keys[1:]):
+            return np.zeros(size, dtype=bool), np.ones(size, dtype=bool)
+
+        # Columns are built as lists, setting numpy items one at a time costs more than the math saves
+        amazon_prices, has_price, quantities, skipped = [], [], [], []
+
+        for shopify_item, fba_item in rows:
+            amazon_price, quantity = 0, (0, 0, 0)
+
+            # Missing fba items and inactive listings are logged or skipped there
+            if not fba_item or not shopify_item.get('active'):
+                skip = True
+            else:
+                skip = False
+
+                if fba_item.get('pricing_info'):
+                    amazon_price = Helpers.get_amazon_price(fba_item)
+
+                    # Missing price is logged there
+                    if type(amazon_price) not in (int, float) or amazon_price <= 0:
+                        amazon_price, skip = 0, True
+
+                quantity = (fba_item.get('amazon_quantity', 0), fba_item.get('merchant_quantity', 0), shopify_item.get('quantity'))
+
+                if type(quantity[0]) is not int or type(quantity[1]) is not int or type(quantity[2]) is not int:
+                    quantity, skip = (0, 0, 0), True
+
+            amazon_prices.append(amazon_price)
+            has_price.append(amazon_price != 0)
+            quantities.append(quantity)
+            skipped.append(skip)
+
+        amazon_prices = np.array(amazon_prices, dtype=np.float64)
+        has_price = np.array(has_price, dtype=bool)
+        quantities = np.array(quantities, dtype=np.float64).reshape(size, 3)
+        undecided = np.array(skipped, dtype=bool)
+
+        sale_prices, sale_undecided = Pricing.price(amazon_prices / 100.0, formula, 'sale_price')
+        compare_at_prices, compare_at_undecided = Pricing.price(sale_prices, formula, 'compare_at_price')
+
+        # Both sides are compared as strings of cents
+        price_changed = (np.rint(sale_prices * 100) != Pricing.stored_cents([x.get('price') for x, _ in rows])) | \
+            (np.rint(compare_at_prices * 100) != Pricing.stored_cents([x.get('compare_at_price') for x, _ in rows]))
+
+        quantity_changed = quantities[:, 0] + quantities[:, 1] != quantities[:, 2]
+
+        undecided |= has_price & (sale_undecided | compare_at_undecided)
+        changed = ~undecided & ((has_price & price_changed) | quantity_changed)
+
+        return changed, undecided
@@ -0,0 +1,29 @@
+from dynaconf import settings
+
+
+class Priority:
+    """ Order tasks go ahead of catalog tasks in the pending tasks queue and keep spare capacity """
+
+    # Task => class, class => AMQP priority
+    CLASSES = settings.APP.Priorities.Classes
+    LEVELS = settings.APP.Priorities.Levels
+
+    # x-max-priority of the pending tasks queue
+    MAX = settings.APP.Priorities.Max
+
+    # Processes only order tasks may take, catalog tasks stop below GlobalProcessLimit minus this
+    RESERVED = settings.APP.Priorities.ReservedForOrders
+
+    def of(task):
+        return Priority.CLASSES.get(task, 'catalog')
+
+    def level(task):
+        return Priority.LEVELS[Priority.of(task)]
+
+    def arguments(target):
+        """ Arguments a queue is declared with, they must match wherever it is declared """
+
+        if target == settings.SHOPIFY.Queue.PendingTasks:
+            return {'x-max-priority': Priority.MAX}
+
+        return None
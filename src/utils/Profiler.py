@@ -0,0 +1,81 @@
+import cProfile
+import os
+import time
+
+from datetime import datetime
+from loguru import logger
+from dynaconf import settings
+
+
+class Profiler:
+    """ Profiles service runs and keeps the slow ones on disk """
+
+    # Directory of the .prof files, read them with `python -m pstats <file>`
+    DIRECTORY = settings.APP.Profiling.Directory
+
+    # Only runs taking longer than this (secs) are kept, unless the payload asked for a profile
+    MIN_DURATION = settings.APP.Profiling.MinDuration
+
+    # Oldest profiles are removed once the directory grows over this size (MB)
+    MAX_DIRECTORY_SIZE = settings.APP.Profiling.MaxDirectorySize
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled or settings.APP.Profiling.Enabled
+
+        # cProfile can't nest, tasks overlapping a profiled one run as usual
+        self.active = False
+
+    def wants(self, payload):
+        return self.enabled or bool(payload.get('profile'))
+
+    async def run(self, coroutine, payload):
+        if self.active:
+            return await coroutine
+
+        self.active = True
+
+        # Deterministic profiler is process wide, other tasks running meanwhile show up too
+        profile = cProfile.Profile()
+        started_at = time.time()
+        profile.enable()
+
+        try:
+            return await coroutine
+        finally:
+            profile.disable()
+            self.active = False
+
+            duration = time.time() - started_at
+
+            if payload.get('profile') or duration >= self.MIN_DURATION:
+                self.save(profile, payload, duration)
+
+    def save(self, profile, payload, duration):
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+
+        filename = "{task}-{owner}-{duration:.1f}s-{time}.prof".format(
+            task=payload.get('task', 'unknown'),
+            owner=payload.get('user_id') or payload.get('fba_item_id') or 'unknown',
+            duration=duration,
+            time=datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+        )
+
+        profile.dump_stats(os.path.join(self.DIRECTORY, filename))
+        logger.info("Profile of {duration:.1f}s run saved as {filename}", duration=duration, filename=filename)
+
+        self.enforce_size_cap()
+
+    def enforce_size_cap(self):
+        """ Drop the oldest profiles until the directory fits the cap """
+
+        files = sorted(
+            (os.path.join(self.DIRECTORY, x) for x in os.listdir(self.DIRECTORY) if x.endswith('.prof')),
+            key=os.path.getmtime,
+        )
+
+        total = sum(os.path.getsize(x) for x in files)
+
+        while files and total > self.MAX_DIRECTORY_SIZE * 1024 * 1024:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
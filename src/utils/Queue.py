@@ -3,11 +3,19 @@ import aio_pika
 import aiormq.exceptions
 import time
 import json
+import traceback
 import bugsnag
 
+from collections import Counter, deque
 from loguru import logger
 from dynaconf import settings
-from utils.Retry import TooManyRequestsException
+from utils.Retry import Retry, RETRYABLE
+from utils.Logging import Logging
+from utils.Metrics import Metrics
+from utils.Tracing import Tracing
+from utils.Recorder import Recorder
+from utils.TaskRegistry import TaskRegistry
+from utils.Priority import Priority
 
 class Queue:
     """ Queue helper for most common methods """
@@ -19,20 +27,37 @@ class Queue:
         self.last_task_time = None
         self.start_time = time.time()
         self.exclusive_failed = False
+        self.recycling = False
+
+        # Live stats served by the health endpoint
+        self.running_by_task = Counter()
+        self.recent_tasks = deque(maxlen=settings.APP.Health.RecentTasks)
+        self.backlog = None
+        self.backlog_updated_at = None
+
+        # Task key => when the running one started and the identical one that came in meanwhile, if any
+        self.coalescing = {}
+
+        # Delay => exchange of the delayed retry queues, declared on first use
+        self.retry_exchanges = {}
 
     async def connect(self, target, loop):
         self.loop = loop
+        self.target = target
         self.connection = await aio_pika.connect_robust(url=self.URL, loop=self.loop)
         self.channel = await self.connection.channel()
 
         self.queue = await self.channel.declare_queue(
             name=target,
             durable=True,
+            arguments=Priority.arguments(target),
         )
 
-    async def publish(self, routing_key, message):
+    async def publish(self, routing_key, message, headers=None, priority=None):
         message = aio_pika.Message(
-            body=message.encode()
+            body=message.encode(),
+            headers=headers,
+            priority=priority,
         )
 
         await self.channel.default_exchange.publish(
@@ -42,7 +67,9 @@ class Queue:
 
     async def consume(self, callback):
         try:
-            async for message in self.queue.iterator(exclusive=True):
+            self.iterator = self.queue.iterator(exclusive=True)
+
+            async for message in self.iterator:
                 self.loop.create_task(self.handle_message(message, callback))
         except aiormq.exceptions.ChannelAccessRefused:  # could not get exclusive access
             logger.error("Unable to get exclusive access to queue, shutting down")
@@ -63,23 +90,182 @@ class Queue:
 
                 return result
 
+            # Runs in its own task, so the context doesn't leak into other messages
+            Logging.bind(queue=self.target)
+            Logging.start_sampling()
+
             async with message.process():
-                self.last_task_time = time.time()
+                payload = fetch(message.body)
+                task = payload.get('task') or 'unknown'
+
+                Recorder.task(self.target, payload)
+
+                # Out of the queue, the publisher may queue an identical one again
+                TaskRegistry.release(self.target, payload)
+
+                # Time spent in the user queue since the publisher sent it
+                trace_id, published_at = Tracing.read(message.headers)
+                Tracing.span(trace_id, 'queue_wait', start=published_at, queue=self.target, task=task)
+
+                # Identical task running already: covered if published before it started, else it runs once more after it
+                # A continuation never asks for that, the chain it belongs to goes on by itself
+                key = TaskRegistry.key(self.target, payload)
+
+                if key in self.coalescing:
+                    if 'after' not in payload and (published_at is None or published_at > self.coalescing[key]['started_at']):
+                        self.coalescing[key]['rerun'] = payload
+
+                    Metrics.incr(f"tasks.{task}.coalesced", rate=1)
+                    return logger.debug("{task} | Identical task running, merged into it", task=task)
+
+                started_at = self.last_task_time = time.time()
                 self.running_tasks += 1
+                self.running_by_task[task] += 1
+
+                if key:
+                    self.coalescing[key] = {'started_at': started_at, 'rerun': None}
+
+                Metrics.incr(f"tasks.{task}.received")
+                # Deltas, so the dispatchers of the host add up
+                Metrics.gauge("tasks.running", 1, delta=True)
 
                 try:
-                    await callback(fetch(message.body))
+                    with Metrics.timer(f"tasks.{task}.duration"):
+                        # Chunked tasks return the payload of their next chunk
+                        continuation = await callback(payload)
+
+                        # Latest of the identical tasks that came in meanwhile, from the start as it was published
+                        # A chunk that handed on the rest doesn't, its next chunks read the catalog as it is by then
+                        while key and self.coalescing[key]['rerun'] and not isinstance(continuation, dict):
+                            rerun = self.coalescing[key]['rerun']
+                            self.coalescing[key] = {'started_at': time.time(), 'rerun': None}
+                            continuation = await callback(rerun)
+
+                    if isinstance(continuation, dict):
+                        await self.defer(continuation, trace_id)
                     await asyncio.sleep(0.1)
+                except Exception as e:
+                    Metrics.incr(f"tasks.{task}.failed", rate=1)
+
+                    # Acked once it waits in the broker for another attempt, or in the dead letters
+                    await self.reroute(message, payload, e)
                 finally:
+                    Tracing.span(trace_id, 'processing', start=started_at, queue=self.target, task=task, user=payload.get('user_id'))
+
                     self.running_tasks -= 1
-        except TooManyRequestsException as e:
-            logger.error("Out of retries !")
+                    self.running_by_task[task] -= 1
+                    self.coalescing.pop(key, None)
+                    self.recent_tasks.append((task, round(time.time() - started_at, 3)))
+
+                    Metrics.gauge("tasks.running", -1, delta=True)
+                    Logging.summary()
         except Exception as e:
             logger.exception("Exception processing message")
             bugsnag.notify(e)
 
-    async def should_live(self):
+    async def defer(self, payload, trace_id=None):
+        """ Next chunk of a task goes through the manager, so other shops get their turn in between """
+
+        # Identical task queued meanwhile, it covers the rest from the start
+        if not TaskRegistry.claim(self.target, payload):
+            return logger.debug("{task} | Identical task queued, dropping the next chunk", task=payload.get('task'))
+
+        await self.channel.default_exchange.publish(routing_key=settings.SHOPIFY.Queue.PendingTasks, message=aio_pika.Message(
+            body=json.dumps({'task': payload.get('task'), 'target': self.target, 'payload': payload}).encode(),
+            headers=Tracing.headers(trace_id),
+            priority=Priority.level(payload.get('task')),
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        ))
+
+        Metrics.incr(f"tasks.{payload.get('task')}.chunked", rate=1)
+
+    async def retry_exchange(self, delay):
+        """ Messages published here wait delay secs, then dead-letter back to the queue named by their routing key """
+
+        if delay not in self.retry_exchanges:
+            name = f"{settings.SHOPIFY.Queue.Retry}.{delay}s"
+
+            exchange = await self.channel.declare_exchange(name, aio_pika.ExchangeType.FANOUT, durable=True)
+            queue = await self.channel.declare_queue(name, durable=True, arguments={
+                'x-message-ttl': delay * 1000,
+                'x-dead-letter-exchange': '',
+            })
+
+            await queue.bind(exchange)
+            self.retry_exchanges[delay] = exchange
+
+        return self.retry_exchanges[delay]
+
+    async def reroute(self, message, payload, error):
+        """ Failed task goes to the delayed retry queue of its attempt, or to the dead letters once out of attempts """
+
+        headers = dict(message.headers or {})
+        attempt = int(headers.get('x-attempt') or 0) + 1
+        trace_id, _ = Tracing.read(headers)
+
+        if isinstance(error, RETRYABLE) and attempt <= len(Retry.DELAYS):
+            delay = Retry.DELAYS[attempt - 1]
+            exchange = await self.retry_exchange(delay)
+
+            logger.warning(
+                "{task} | {error} , retrying in {delay} secs, attempt {attempt} of {attempts}",
+                task=payload.get('task'),
+                error=error.__class__.__name__,
+                delay=delay,
+                attempt=attempt,
+                attempts=len(Retry.DELAYS),
+            )
+
+            await exchange.publish(routing_key=self.target, message=aio_pika.Message(
+                body=message.body,
+                headers={**headers, **Tracing.headers(trace_id), 'x-attempt': attempt, 'x-last-error': repr(error)},
+                expiration=delay,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ))
+
+            # Its dispatcher will be long gone, the manager spawns one when this comes back
+            await exchange.publish(routing_key=settings.SHOPIFY.Queue.PendingTasks, message=aio_pika.Message(
+                body=json.dumps({'task': payload.get('task'), 'target': self.target}).encode(),
+                headers=Tracing.headers(trace_id),
+                priority=Priority.level(payload.get('task')),
+                expiration=delay,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ))
+
+            return Metrics.incr("tasks.retried", rate=1)
+
+        logger.opt(exception=error).error("{task} | Giving up after {attempt} attempt(s)", task=payload.get('task'), attempt=attempt)
+        bugsnag.notify(error)
+
+        await self.channel.default_exchange.publish(routing_key=settings.SHOPIFY.Queue.DeadLetters, message=aio_pika.Message(
+            body=json.dumps({
+                'target': self.target,
+                'payload': payload,
+                'attempts': attempt,
+                'error': repr(error),
+                'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+                'failed_at': time.time(),
+            }, default=str).encode(),
+            headers=headers,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        ))
+
+        Metrics.incr("tasks.dead_lettered", rate=1)
+
+    async def should_live(self, recycle=None):
         while True:
+            # Stop taking new messages, unacked ones go back to the queue for the next worker
+            if recycle and self.last_task_time and not self.recycling and recycle():
+                logger.warning("Recycling worker, waiting for {count} running task(s)", count=self.running_tasks)
+
+                self.recycling = True
+                await self.iterator.close()
+
+            if self.recycling and self.running_tasks == 0:
+                break
+
+            await self.refresh_backlog()
+
             now = time.time()
             time_since_last_task = now - self.last_task_time if self.last_task_time else None
 
@@ -93,6 +279,34 @@ class Queue:
 
             await asyncio.sleep(1)
 
+    async def refresh_backlog(self, interval=5):
+        """ Messages waiting in the queue, re-declaring it is the cheapest way to ask """
+
+        if self.backlog_updated_at and time.time() - self.backlog_updated_at < interval:
+            return
+
+        self.backlog_updated_at = time.time()
+
+        try:
+            self.backlog = (await self.queue.declare()).message_count
+        except Exception as e:
+            logger.debug("Unable to get the queue backlog: {error}", error=e)
+
+    def stats(self):
+        durations = [duration for task, duration in self.recent_tasks]
+
+        return {
+            'target': getattr(self, 'target', None),
+            'running_tasks': self.running_tasks,
+            'running_by_task': {task: count for task, count in self.running_by_task.items() if count},
+            'backlog': self.backlog,
+            'last_task_time': self.last_task_time,
+            'idle_for': round(time.time() - self.last_task_time, 1) if self.last_task_time else None,
+            'recycling': self.recycling,
+            'recent_tasks': list(self.recent_tasks),
+            'recent_max_duration': max(durations, default=None),
+        }
+
     async def shutdown(self):
         if self.queue.iterator():
             await self.queue.iterator().close()
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from dynaconf import settings
+from yarl import URL
+
+
+class RateBudget:
+    """ Local copy of every shop's leaky bucket, concurrent calls wait for room instead of running into 429s """
+
+    # REST limits of a standard plan, shops on bigger plans report their size in the call limit header
+    BUCKET_SIZE = settings.SHOPIFY.RateBudget.BucketSize
+    LEAK_RATE = settings.SHOPIFY.RateBudget.LeakRate
+
+    # Calls left to the other apps of the shop and to the other tasks
+    HEADROOM = settings.SHOPIFY.RateBudget.Headroom
+
+    # Domain => bucket level, when it was last updated and its size
+    SHOPS = {}
+
+    def bucket(domain):
+        now = time.monotonic()
+        bucket = RateBudget.SHOPS.setdefault(domain, {'level': 0.0, 'updated_at': now, 'size': RateBudget.BUCKET_SIZE})
+
+        bucket['level'] = max(0.0, bucket['level'] - (now - bucket['updated_at']) * RateBudget.LEAK_RATE)
+        bucket['updated_at'] = now
+
+        return bucket
+
+    async def acquire(domain):
+        """ Wait until the shop's bucket has room for one more call and take it """
+
+        while True:
+            bucket = RateBudget.bucket(domain)
+            room = bucket['size'] - RateBudget.HEADROOM
+
+            if bucket['level'] + 1 <= room:
+                bucket['level'] += 1
+                return
+
+            await asyncio.sleep((bucket['level'] + 1 - room) / RateBudget.LEAK_RATE)
+
+    def observe(method, url, status, headers, **kwargs):
+        """ Shopify request observer, what the shop reports wins over the estimate when it's fuller """
+
+        bucket = RateBudget.bucket(URL(str(url)).host)
+
+        if call_limit := headers.get('X-Shopify-Shop-Api-Call-Limit'):
+            used, size = call_limit.split('/')
+
+            bucket['size'] = int(size)
+            bucket['level'] = max(bucket['level'], float(used))
+
+        if status == 429:
+            bucket['level'] = bucket['size']
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+
+from datetime import datetime
+from loguru import logger
+from dynaconf import settings
+from utils.Database import Database
+from utils.Logging import CONTEXT
+
+# Keys whose values identify a buyer or a shop, their whole value is dropped
+SENSITIVE_KEYS = {
+    'email', 'contact_email', 'phone', 'first_name', 'last_name', 'name', 'company',
+    'address1', 'address2', 'city', 'zip', 'latitude', 'longitude', 'browser_ip',
+    'customer', 'billing_address', 'shipping_address', 'client_details', 'note',
+    'token', 'access_token', 'shopify_creds', 'mws_creds', 'jl_mws_auth_token',
+}
+
+# Same, within MWS XML
+SENSITIVE_TAGS = [
+    'Name', 'Line1', 'Line2', 'Line3', 'City', 'PostalCode', 'PhoneNumber',
+    'DisplayableOrderComment', 'NotificationEmailList',
+]
+
+EMAIL = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+DOMAIN = re.compile(r'[\w-]+\.myshopify\.com')
+QUEUE = re.compile(r'^(.*Shopify\.(\w+))\.(.+)$')
+
+
+class Recorder:
+    """ Captures the tasks consumed and the Shopify/MWS responses of their runs, see benchmarks/Replay.py """
+
+    ENABLED = settings.APP.Recording.Enabled
+    DIRECTORY = settings.APP.Recording.Directory
+
+    # Share of the user queues recorded, a queue is either fully recorded or not at all
+    SAMPLE = settings.APP.Recording.Sample
+
+    # In KB, larger response bodies are replaced by the number of items they hold
+    MAX_BODY_SIZE = settings.APP.Recording.MaxBodySize
+
+    # Queues whose catalog size is already recorded by this process
+    SHAPES = set()
+
+    def wants(queue):
+        if not Recorder.ENABLED or not queue:
+            return False
+
+        # Stable across processes, unlike hash()
+        return zlib.crc32(queue.encode()) % 10000 < Recorder.SAMPLE * 10000
+
+    def shop(domain):
+        """ Stand-in domain of a shop, the same one in every record """
+
+        return 'shop-' + hashlib.sha1(domain.encode()).hexdigest()[:12] + '.myshopify.com'
+
+    def queue(name):
+        """ User queue name with the stand-in domain, as in DEBUG::Shopify.<user_id>.<shop> """
+
+        match = QUEUE.match(name or '')
+
+        if not match:
+            return name
+
+        return match.group(1) + '.' + Recorder.shop(match.group(3) + '.myshopify.com').split('.myshopify.com')[0]
+
+    def sanitize(value):
+        if isinstance(value, dict):
+            return {key: '[redacted]' if key in SENSITIVE_KEYS else Recorder.sanitize(item) for key, item in value.items()}
+
+        if isinstance(value, list):
+            return [Recorder.sanitize(item) for item in value]
+
+        if isinstance(value, str):
+            value = DOMAIN.sub(lambda match: Recorder.shop(match.group(0)), value)
+            return EMAIL.sub('redacted@example.com', value)
+
+        return value
+
+    def sanitize_xml(xml):
+        for tag in SENSITIVE_TAGS:
+            xml = re.sub(rf'<{tag}>.*?</{tag}>', f'<{tag}>[redacted]</{tag}>', xml, flags=re.S)
+
+        return EMAIL.sub('redacted@example.com', xml)
+
+    def write(record):
+        record = {'at': time.time(), 'pid': os.getpid(), **record}
+        filename = os.path.join(Recorder.DIRECTORY, datetime.utcnow().strftime('%Y%m%d') + '.jsonl')
+
+        # Single small appends stay intact across the processes of the host, a full disk mustn't fail the task
+        try:
+            os.makedirs(Recorder.DIRECTORY, exist_ok=True)
+
+            with open(filename, 'a') as file:
+                file.write(json.dumps(record, default=str) + '\n')
+        except OSError:
+            logger.exception("Unable to write the recording")
+
+    def task(queue, payload):
+        """ A message taken off a user queue """
+
+        if not Recorder.wants(queue):
+            return
+
+        if queue not in Recorder.SHAPES and (match := QUEUE.match(queue)):
+            Recorder.shape(queue, user_id=match.group(2))
+
+        Recorder.write({
+            'type': 'task',
+            'queue': Recorder.queue(queue),
+            'payload': Recorder.sanitize(payload),
+        })
+
+    def shape(queue, user_id):
+        """ Catalog size of the user, the replay seeds a shop of the same size """
+
+        DB = Database.instance()
+        Recorder.SHAPES.add(queue)
+
+        listings = DB.ShopifyListings.count_documents({'user_id': user_id, 'active': True})
+
+        Recorder.write({
+            'type': 'shape',
+            'queue': Recorder.queue(queue),
+            'user_id': user_id,
+            'listings': listings,
+            'unlisted': max(0, DB.FbaItems.count_documents({'user_id': user_id}) - listings),
+            'orders': DB.ShopifySales.count_documents({'user_id': user_id}),
+        })
+
+    async def shopify(method, url, status, elapsed, response):
+        """ A Shopify response, read here and cached by aiohttp for the caller """
+
+        queue = CONTEXT.get().get('queue')
+
+        if not Recorder.wants(queue):
+            return
+
+        body = await response.read()
+
+        try:
+            body = json.loads(body) if body else None
+        except ValueError:
+            body = None
+
+        if isinstance(body, dict) and len(json.dumps(body)) > Recorder.MAX_BODY_SIZE * 1024:
+            # Shape is enough to seed the replay, e.g. {'products': 250}
+            body = {'items': {key: len(value) for key, value in body.items() if isinstance(value, list)}}
+
+        Recorder.write({
+            'type': 'shopify',
+            'queue': Recorder.queue(queue),
+            'method': method,
+            'url': Recorder.sanitize(str(url)),
+            'status': status,
+            'elapsed': elapsed,
+            'body': Recorder.sanitize(body),
+        })
+
+    def mws(action, response, elapsed):
+        """ An MWS response, the raw XML of the mws client """
+
+        queue = CONTEXT.get().get('queue')
+
+        if not Recorder.wants(queue):
+            return
+
+        Recorder.write({
+            'type': 'mws',
+            'queue': Recorder.queue(queue),
+            'action': action,
+            'elapsed': elapsed,
+            'body': Recorder.sanitize_xml(response.original if isinstance(response.original, str) else response.original.decode()),
+        })
@@ -1,8 +1,22 @@
+import asyncio
+import aiohttp
+
 from loguru import logger
 from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
+from dynaconf import settings
+from utils.Metrics import Metrics
 
 class Retry:
+    # Quick tries for blips within the task, longer waits happen in the broker (see Queue.reroute)
+    IN_PROCESS_TRIES = settings.APP.Retry.InProcessTries
+
+    # Secs a failed task waits in the broker before each of its next attempts
+    DELAYS = settings.APP.Retry.Delays
+
     def log(details):
+        Metrics.incr("retry.backoff", rate=1)
+        Metrics.timing("retry.backoff.wait", details['wait'], rate=1)
+
         logger.debug(
             "Backing off {wait:0.1f} seconds afters {tries} tries".format(**details)
         )
@@ -12,3 +26,13 @@ class TooManyRequestsException(Exception):
 
 class ServerConnectionError(Exception):
     """ Connection somehow disrupted """
+
+# Failures worth another attempt later, anything else goes to the dead letters right away
+# Timeouts of the 120 secs sessions and bodies cut short are the most common transient ones
+RETRYABLE = (
+    TooManyRequestsException,
+    ServerConnectionError,
+    asyncio.TimeoutError,
+    aiohttp.ServerTimeoutError,
+    aiohttp.ClientPayloadError,
+)
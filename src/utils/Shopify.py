@@ -0,0 +1,67 @@
+import aiohttp
+import time
+
+from loguru import logger
+from utils.Metrics import Metrics
+from utils.Health import Health
+from utils.CircuitBreaker import CircuitBreaker
+from utils.Recorder import Recorder
+from utils.RateBudget import RateBudget
+
+
+class Shopify:
+    """ aiohttp sessions towards Shopify that report on every request """
+
+    # Called with method, url, status, elapsed, headers and exception once a request is over
+    OBSERVERS = [
+        Metrics.shopify,
+        Health.shopify,
+        CircuitBreaker.observe,
+        RateBudget.observe,
+    ]
+
+    def session(**kwargs):
+        return aiohttp.ClientSession(trace_configs=[Shopify.trace_config()], **kwargs)
+
+    def trace_config():
+        async def on_request_start(session, context, params):
+            context.started_at = time.monotonic()
+
+        async def on_request_end(session, context, params):
+            elapsed = time.monotonic() - context.started_at
+
+            Shopify.notify(
+                method=params.method,
+                url=params.url,
+                status=params.response.status,
+                elapsed=elapsed,
+                headers=params.response.headers,
+                exception=None,
+            )
+
+            if Recorder.ENABLED:
+                await Recorder.shopify(params.method, params.url, params.response.status, elapsed, params.response)
+
+        async def on_request_exception(session, context, params):
+            Shopify.notify(
+                method=params.method,
+                url=params.url,
+                status=None,
+                elapsed=time.monotonic() - context.started_at,
+                headers={},
+                exception=params.exception,
+            )
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+
+        return trace_config
+
+    def notify(**request):
+        for observer in Shopify.OBSERVERS:
+            try:
+                observer(**request)
+            except Exception:
+                logger.exception("Shopify request observer failed")
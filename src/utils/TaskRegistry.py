@@ -0,0 +1,63 @@
+import json
+import time
+
+from pymongo.errors import DuplicateKeyError
+from dynaconf import settings
+from utils.Database import Database
+from utils.Priority import Priority
+
+# Get DB instance
+DB = Database.instance()
+
+
+class TaskRegistry:
+    """ Tasks waiting in a user queue, so the publisher doesn't queue the same one twice """
+
+    # Tasks that are de-duplicated and coalesced
+    TASKS = settings.APP.Coalescing.Tasks
+
+    # Secs after which a registered task counts as lost, e.g. its message was purged
+    MAX_AGE = settings.APP.Coalescing.MaxAge
+    ORDER_MAX_AGE = settings.APP.Coalescing.OrderMaxAge
+
+    def key(target, payload):
+        """ Same key for the same work, None for tasks that are never merged """
+
+        if payload.get('task') not in TaskRegistry.TASKS:
+            return None
+
+        # Flags that don't change the work done, and the cursor of chunked tasks so all their chunks count as one
+        payload = {k: v for k, v in payload.items() if k not in ['profile', 'after']}
+
+        return f"{target}|{json.dumps(payload, sort_keys=True)}"
+
+    def claim(target, payload):
+        """ Register a task about to be published, False if the same one is already waiting """
+
+        key = TaskRegistry.key(target, payload)
+
+        if not key:
+            return True
+
+        now = time.time()
+        max_age = TaskRegistry.ORDER_MAX_AGE if Priority.of(payload.get('task')) == 'order' else TaskRegistry.MAX_AGE
+
+        try:
+            DB.ShopifyTaskRegistry.insert_one({'_id': key, 'queued_at': now})
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Waiting for too long, publish it again
+        return DB.ShopifyTaskRegistry.find_one_and_update({
+            '_id': key,
+            'queued_at': {'$lt': now - max_age},
+        }, {
+            '$set': {'queued_at': now},
+        }) is not None
+
+    def release(target, payload):
+        """ Task left the queue, the next identical one may be published while it runs """
+
+        if key := TaskRegistry.key(target, payload):
+            DB.ShopifyTaskRegistry.delete_one({'_id': key})
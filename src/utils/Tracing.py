@@ -0,0 +1,76 @@
+import json
+import os
+import time
+import uuid
+
+from dynaconf import settings
+
+
+class Tracing:
+    """ Trace context carried in AMQP headers, spans are appended to a JSONL file """
+    """ Off by default, APP.Tracing.Enabled (or DYNACONF_APP__Tracing__Enabled=true) turns it on """
+
+    ENABLED = settings.APP.Tracing.Enabled
+    FILE = settings.APP.Tracing.File
+
+    # Bytes after which the file is moved to <file>.1, the one before that is dropped
+    MAX_SIZE = settings.APP.Tracing.MaxSize
+
+    # Directory of the file is created once per process
+    READY = False
+
+    def headers(trace_id=None):
+        """ Headers to attach to a message at publish time """
+
+        return {
+            'x-trace-id': trace_id or uuid.uuid4().hex,
+            'x-published-at': time.time(),
+        }
+
+    def read(headers):
+        """ Trace id and publish time of a consumed message, if it has them """
+
+        def decode(value):
+            return value.decode() if isinstance(value, bytes) else value
+
+        headers = headers or {}
+
+        trace_id = decode(headers.get('x-trace-id'))
+        published_at = decode(headers.get('x-published-at'))
+
+        return trace_id, float(published_at) if published_at is not None else None
+
+    def span(trace_id, name, start, end=None, **attributes):
+        """ Record one stage of a trace """
+
+        if not Tracing.ENABLED or not trace_id or start is None:
+            return
+
+        end = end or time.time()
+
+        record = {
+            'trace_id': trace_id,
+            'span_id': uuid.uuid4().hex[:16],
+            'name': name,
+            'start': start,
+            'end': end,
+            'duration': end - start,
+            'pid': os.getpid(),
+            'attributes': attributes,
+        }
+
+        if not Tracing.READY:
+            os.makedirs(os.path.dirname(Tracing.FILE) or '.', exist_ok=True)
+            Tracing.READY = True
+
+        # Single small appends stay intact across the processes of the host
+        with open(Tracing.FILE, 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+            size = file.tell()
+
+        # Whichever process crosses the limit rotates, the others keep appending to the new file
+        if Tracing.MAX_SIZE and size > Tracing.MAX_SIZE:
+            try:
+                os.replace(Tracing.FILE, f"{Tracing.FILE}.1")
+            except FileNotFoundError:
+                pass